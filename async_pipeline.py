@@ -0,0 +1,339 @@
+"""
+
+This script contains the asyncio engine of recharge_file_reader.py. It is run with:
+
+    python recharge_file_reader.py run --engine async
+
+It shall:
+1. Run the stages of the reader concurrently with bounded queues between them:
+   discovery -> readers -> aggregation -> report writing -> database load.
+2. Read the files in a thread pool and aggregate each file in a separate executor while the next files are being read.
+3. Open the database connection while the files are being parsed so the setup is not added to the run time.
+4. Write to Postgres with psycopg (version 3) async. Without psycopg the synchronous loaders of the reader are used.
+
+"""
+
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import recharge_file_reader as reader
+from event_dedup import open_duplicate_filter
+
+script_log = logging.getLogger("script_handler")
+
+DB_NAME = "recharge_file_stats_db"
+
+# Create, migrate (rows tagged with the id of their report, see recharge_file_reader.py) and insert query per report
+DB_TABLES = {
+    "location": (
+        "CREATE TABLE IF NOT EXISTS total_recharge_amount_per_location (id SERIAL PRIMARY KEY, Location VARCHAR(255), Total_RechargeAmount INT, report_id INT);",
+        "ALTER TABLE total_recharge_amount_per_location ADD COLUMN IF NOT EXISTS report_id INT;",
+        "INSERT INTO total_recharge_amount_per_location (Location, Total_RechargeAmount, report_id) VALUES (%s, %s, %s);",
+    ),
+    "category": (
+        "CREATE TABLE IF NOT EXISTS total_recharge_amount_per_category (id SERIAL PRIMARY KEY, Category VARCHAR(255), Total_RechargeAmount INT, report_id INT);",
+        "ALTER TABLE total_recharge_amount_per_category ADD COLUMN IF NOT EXISTS report_id INT;",
+        "INSERT INTO total_recharge_amount_per_category (Category, Total_RechargeAmount, report_id) VALUES (%s, %s, %s);",
+    ),
+    "payment_method": (
+        "CREATE TABLE IF NOT EXISTS payment_method_count (id SERIAL PRIMARY KEY, PaymentMethod VARCHAR(255), Total_Count INT, report_id INT);",
+        "ALTER TABLE payment_method_count ADD COLUMN IF NOT EXISTS report_id INT;",
+        "INSERT INTO payment_method_count (PaymentMethod, Total_Count, report_id) VALUES (%s, %s, %s);",
+    ),
+}
+
+async def discover_files(input_path, target_date, file_queue, readers):
+    """
+    This function finds the files to read and puts them in the file queue, followed by one stop marker per reader.
+
+    Args:
+        input_path (dir): Directory of the input path
+        target_date (datetime): Date of the files to read. Defaults to the current date.
+        file_queue (asyncio.Queue): Queue feeding the readers
+        readers (int): Number of readers
+    """
+
+    loop = asyncio.get_running_loop()
+    files = await loop.run_in_executor(None, reader.get_csv_files_to_read, input_path, target_date)
+    script_log.info(f"Discovered {len(files)} file(s) to read.")
+
+    for file in files:
+        await file_queue.put(file)
+    for _ in range(readers):
+        await file_queue.put(None)
+
+def read_file(file, duplicate_filter):
+    """
+    This function reads a file and drops the events already seen that day.
+
+    Args:
+        file (str): Path of the csv file
+        duplicate_filter (event_dedup.DuplicateFilter): Drops the events already seen that day, None to keep every event
+
+    Returns:
+        df (pandas.core.frame.DataFrame): Events of the file
+    """
+
+    df = reader.read_csv(file)
+    if duplicate_filter is not None:
+        df = duplicate_filter.filter_file(file, df)
+
+    return df
+
+async def read_files(file_queue, frame_queue, io_executor, failed_files, duplicate_filter=None):
+    """
+    This function reads the files of the file queue and puts the dataframes in the frame queue.
+    A stop marker is forwarded once the file queue is exhausted.
+
+    Args:
+        file_queue (asyncio.Queue): Queue of the file paths
+        frame_queue (asyncio.Queue): Queue feeding the aggregation
+        io_executor (concurrent.futures.Executor): Executor running read_csv
+        failed_files (list): Filled with the files that could not be read
+        duplicate_filter (event_dedup.DuplicateFilter): Drops the events already seen that day, None to keep every event
+    """
+
+    loop = asyncio.get_running_loop()
+    while True:
+        file = await file_queue.get()
+        if file is None:
+            await frame_queue.put(None)
+            return
+
+        try:
+            script_log.info(f"Picked up file: {file}")
+            df = await loop.run_in_executor(io_executor, read_file, file, duplicate_filter)
+            await frame_queue.put(df)
+
+        except Exception as e:
+            script_log.error(f"An error has occured while reading {file}: {e}\n")
+            failed_files.append(file)
+
+async def aggregate_frames(frame_queue, readers, cpu_executor):
+    """
+    This function computes the partial totals of every dataframe of the frame queue and merges them.
+
+    Args:
+        frame_queue (asyncio.Queue): Queue of the dataframes
+        readers (int): Number of readers, one stop marker is expected per reader
+        cpu_executor (concurrent.futures.Executor): Executor running the aggregation
+
+    Returns:
+        totals (dict): Merged totals of all the files
+    """
+
+    loop = asyncio.get_running_loop()
+    totals = reader.merge_partial_totals([])
+    stopped = 0
+    rows = 0
+    while stopped < readers:
+        df = await frame_queue.get()
+        if df is None:
+            stopped += 1
+            continue
+
+        partial = await loop.run_in_executor(cpu_executor, reader.partial_totals, df)
+        totals = reader.merge_partial_totals([totals, partial])
+        rows += len(df)
+
+    script_log.info(f"Aggregated {rows} row(s).")
+
+    return totals
+
+async def write_reports(totals, config, csv_path, report_date):
+    """
+    This function writes the three reports concurrently.
+
+    Args:
+        totals (dict): Merged totals of all the files
+        config (dict): .toml file for the inputs
+        csv_path (dir): Directory of the reports
+        report_date (datetime.date): Day covered by the reports
+
+    Returns:
+        reports (dict): Report dataframe per report ("location", "category", "payment_method")
+    """
+
+    loop = asyncio.get_running_loop()
+    dataframes = dict(zip(["location", "category", "payment_method"], reader.totals_to_dataframes(totals)))
+
+    await asyncio.gather(*[
+        loop.run_in_executor(
+            None,
+            lambda prefix=prefix, dataframe=dataframe: reader.save_to_csv(
+                prefix, csv_path, dataframe, reader.import_report_format(config, prefix), report_date=report_date
+            ),
+        )
+        for prefix, dataframe in zip(reader.REPORT_PREFIXES, dataframes.values())
+    ])
+    script_log.info("Done with the analysis. Refer to the report files for details.\n")
+
+    return dataframes
+
+async def connect_async_db(config):
+    """
+    This function creates the recharge file stats database if needed and opens an async connection to it.
+
+    Args:
+        config (dict): .toml file for the inputs
+
+    Returns:
+        connection (psycopg.AsyncConnection): Connection to the recharge file stats database
+    """
+
+    import psycopg
+    import psycopg.sql
+
+    parameters = {
+        "host": config["database"]["db_host"],
+        "user": config["database"]["db_user"],
+        "password": config["database"]["db_password"],
+    }
+
+    connection = await psycopg.AsyncConnection.connect(dbname=config["database"]["db_name"], autocommit=True, **parameters)
+    try:
+        cursor = await connection.execute("SELECT 1 FROM pg_database WHERE datname = %s;", (DB_NAME,))
+        if await cursor.fetchone() is None:
+            await connection.execute(psycopg.sql.SQL("CREATE DATABASE {}").format(psycopg.sql.Identifier(DB_NAME)))
+            script_log.info(f"Database '{DB_NAME}' has been created.\n")
+
+    finally:
+        await connection.close()
+
+    connection = await psycopg.AsyncConnection.connect(dbname=DB_NAME, **parameters)
+    script_log.info(f"Creating connection for user:{parameters['user']} to database:{DB_NAME}\n")
+
+    return connection
+
+async def load_reports_async(connection, dataframes, report_ids):
+    """
+    This function inserts the three reports in their tables in one transaction.
+
+    Args:
+        connection (psycopg.AsyncConnection): Connection to the recharge file stats database
+        dataframes (dict): Report dataframe per report ("location", "category", "payment_method")
+        report_ids (dict): Id of every report in the report catalog, stored with its rows
+    """
+
+    async with connection.cursor() as cursor:
+        for report, (create_query, migrate_query, insert_query) in DB_TABLES.items():
+            rows = [(str(key), int(value), report_ids[report]) for key, value in dataframes[report].itertuples(index=False)]
+            await cursor.execute(create_query)
+            await cursor.execute(migrate_query)
+            await cursor.executemany(insert_query, rows)
+            script_log.info(f"Successfully inserted {len(rows)} row(s) of the '{report}' report.")
+
+    await connection.commit()
+
+async def close_connect_task(connect_task):
+    """
+    This function closes the connection of the task opening it. A connection still being opened is cancelled,
+    one already opened is closed.
+
+    Args:
+        connect_task (asyncio.Task): Task running connect_async_db()
+    """
+
+    connect_task.cancel()
+    try:
+        connection = await connect_task
+
+    except asyncio.CancelledError:
+        if not connect_task.cancelled():
+            raise
+        return
+
+    except Exception:
+        # The connection could not be opened, there is nothing to close
+        return
+
+    await connection.close()
+
+async def run_pipeline_async(config, target_date=None, readers=4, queue_size=8):
+    """
+    This function runs the whole reader as concurrent stages.
+
+    Args:
+        config (dict): .toml file for the inputs
+        target_date (datetime): Date of the files to read. Defaults to the current date.
+        readers (int): Number of concurrent readers, at least 1
+        queue_size (int): Size of the queues between the stages
+
+    Raises:
+        RuntimeError: A file could not be read. No report is written, like the serial engine.
+    """
+
+    if readers < 1:
+        raise ValueError(f"The async engine needs at least 1 reader, got {readers}")
+
+    input_path = reader.import_input_path(config)
+    csv_path = config["directories"]["csv_path"]
+    report_date = (target_date or datetime.now()).date()
+    send_to_database = config["operation"]["send_to_database"] == "YES"
+
+    file_queue = asyncio.Queue(maxsize=queue_size)
+    frame_queue = asyncio.Queue(maxsize=queue_size)
+
+    # The database connection is opened while the files are being parsed
+    connect_task = None
+    if send_to_database:
+        try:
+            import psycopg  # noqa: F401
+            connect_task = asyncio.create_task(connect_async_db(config))
+        except ImportError:
+            script_log.warning("psycopg (version 3) is not installed, the synchronous database loaders will be used.")
+
+    # The connection is closed on every way out, a failed run included
+    try:
+        failed_files = []
+        duplicate_filter = open_duplicate_filter(config, report_date)
+        with ThreadPoolExecutor(max_workers=readers) as io_executor, ThreadPoolExecutor(max_workers=1) as cpu_executor:
+            stages = [discover_files(input_path, target_date, file_queue, readers)]
+            stages += [read_files(file_queue, frame_queue, io_executor, failed_files, duplicate_filter) for _ in range(readers)]
+            results = await asyncio.gather(aggregate_frames(frame_queue, readers, cpu_executor), *stages)
+        if duplicate_filter is not None:
+            duplicate_filter.close()
+
+        # Reports missing the events of a file would look complete, so the run fails instead
+        if failed_files:
+            raise RuntimeError(f"{len(failed_files)} file(s) could not be read, no report was written: {', '.join(sorted(failed_files))}")
+
+        dataframes = await write_reports(results[0], config, csv_path, report_date)
+
+        if not send_to_database:
+            script_log.info("Operation send_to_database: NO")
+            script_log.info("Skipping copying of files to postgres database...\n")
+
+        elif connect_task is not None:
+            try:
+                connection = await connect_task
+                report_ids = {report: reader.get_latest_report(csv_path, prefix)[1]
+                              for report, prefix in zip(DB_TABLES, reader.REPORT_PREFIXES)}
+                await load_reports_async(connection, dataframes, report_ids)
+
+            except Exception as e:
+                script_log.error(f"An error has occured while loading the reports to the database: {e}\n")
+
+        else:
+            await asyncio.get_running_loop().run_in_executor(None, reader.send_reports_to_database, config, csv_path)
+
+    finally:
+        if connect_task is not None:
+            await close_connect_task(connect_task)
+
+    reader.apply_retention(csv_path, config.get("reports", {}).get("retention_days", 0))
+
+def run_pipeline(config, target_date=None, readers=4, queue_size=8):
+    """
+    This function runs the asyncio pipeline from synchronous code.
+
+    Args:
+        config (dict): .toml file for the inputs
+        target_date (datetime): Date of the files to read. Defaults to the current date.
+        readers (int): Number of concurrent readers, at least 1
+        queue_size (int): Size of the queues between the stages
+    """
+
+    asyncio.run(run_pipeline_async(config, target_date, readers, queue_size))
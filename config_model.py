@@ -0,0 +1,431 @@
+"""
+
+This script contains the config model of recharge_file_reader.py.
+
+It shall:
+1. Load recharge_file_config.toml from the directory of the script (or the path given with --config or the
+   RECHARGE_CONFIG environment variable), not from the current directory.
+2. Build the effective config from four layers, each one overriding the previous one:
+       defaults of SCHEMA -> performance profile -> config file -> environment variables
+   The profile is chosen with "profile" in the config file or the RECHARGE_PROFILE environment variable.
+   Any value can be overridden with RECHARGE_<SECTION>__<KEY> (ex. RECHARGE_STREAMING__CHUNK_BYTES=16777216).
+3. Validate the effective config against SCHEMA: unknown sections or keys, wrong types and values that are
+   not allowed are all reported at once with a ConfigError. Values are converted to their type.
+4. Resolve the relative paths from the directory of the config file and fill in the state paths (checkpoints,
+   dedup filters, rolling totals) from cache_path.
+
+The effective config is a dict with the same sections as the config file, so it is used as before
+(ex. config["directories"]["csv_path"]). It is printed with:
+
+    python recharge_file_reader.py config show --effective
+
+"""
+
+import os
+
+import tomli
+
+SCHEMA_VERSION = 2
+CONFIG_FILENAME = "recharge_file_config.toml"
+ENV_PREFIX = "RECHARGE_"
+
+REQUIRED = object()
+
+class ConfigError(ValueError):
+    """
+    Raised when the config file is missing, has an unsupported schema version or does not match SCHEMA.
+    """
+
+def as_str(value):
+    if not isinstance(value, str):
+        raise ValueError("must be a string")
+    return value
+
+def as_int(value):
+    if isinstance(value, str):
+        try:
+            value = int(value)
+        except ValueError:
+            raise ValueError("must be an integer")
+    if isinstance(value, bool) or not isinstance(value, int):
+        raise ValueError("must be an integer")
+    return value
+
+def as_positive_int(value):
+    value = as_int(value)
+    if value <= 0:
+        raise ValueError("must be greater than 0")
+    return value
+
+def as_float(value):
+    if isinstance(value, str):
+        try:
+            value = float(value)
+        except ValueError:
+            raise ValueError("must be a number")
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise ValueError("must be a number")
+    return float(value)
+
+def as_rate(value):
+    value = as_float(value)
+    if not 0 < value < 1:
+        raise ValueError("must be greater than 0 and lower than 1")
+    return value
+
+def as_int_list(value):
+    if isinstance(value, str):
+        value = [as_int(item.strip()) for item in value.split(",")]
+    if not isinstance(value, list):
+        raise ValueError("must be a list of integers")
+    return [as_positive_int(item) for item in value]
+
+def one_of(*choices):
+    """
+    This function creates the converter of a value that must be one of the choices.
+    """
+
+    def as_choice(value):
+        if value not in choices:
+            raise ValueError(f"must be one of {', '.join(repr(choice) for choice in choices)}")
+        return value
+
+    return as_choice
+
+as_yes_no = one_of("YES", "NO")
+as_report_format = one_of("csv", "parquet", "arrow", "jsonl")
+
+# Converter and default of every key per section. Paths are strings resolved from the directory of the config file.
+SCHEMA = {
+    "directories": {
+        "input_path": (as_str, REQUIRED),
+        "log_path": (as_str, REQUIRED),
+        "csv_path": (as_str, REQUIRED),
+        "cache_path": (as_str, None),
+        "scratch_path": (as_str, None),
+    },
+    "database": {
+        "db_host": (as_str, "localhost"),
+        "db_name": (as_str, "postgres"),
+        "db_user": (as_str, "postgres"),
+        "db_password": (as_str, ""),
+        "loader": (one_of("rows", "batch"), "rows"),
+    },
+    "operation": {
+        "send_to_database": (as_yes_no, "YES"),
+    },
+    "performance": {
+        "workers": (as_positive_int, 4),
+    },
+    "reports": {
+        "total_recharge_per_location": (as_report_format, "csv"),
+        "total_recharge_per_category": (as_report_format, "csv"),
+        "count_per_payment_method": (as_report_format, "csv"),
+        "retention_days": (as_int, 0),
+    },
+    "streaming": {
+        "checkpoint_path": (as_str, None),
+        "checkpoint_interval_seconds": (as_float, 5.0),
+        "chunk_bytes": (as_positive_int, 8 * 1024 * 1024),
+        "memory_budget_mb": (as_int, 512),
+        "adaptive_chunks": (as_yes_no, "YES"),
+        "queue_size": (as_positive_int, 4),
+    },
+    "dedup": {
+        "enabled": (as_yes_no, "NO"),
+        "dedup_path": (as_str, None),
+        "expected_events_per_day": (as_positive_int, 10_000_000),
+        "false_positive_rate": (as_rate, 0.001),
+    },
+    "reconciliation": {
+        "enabled": (as_yes_no, "NO"),
+    },
+    "attribution": {
+        "aggregates_path": (as_str, None),
+    },
+    "rolling": {
+        "bucket_minutes": (as_positive_int, 1),
+        "windows_minutes": (as_int_list, [5, 60]),
+        "state_path": (as_str, None),
+    },
+    "history": {
+        "compact_after_days": (as_int, 7),
+        "compact_format": (one_of("parquet", "arrow"), "parquet"),
+    },
+}
+
+PATH_KEYS = [
+    ("directories", "input_path"),
+    ("directories", "log_path"),
+    ("directories", "csv_path"),
+    ("directories", "cache_path"),
+    ("directories", "scratch_path"),
+    ("streaming", "checkpoint_path"),
+    ("dedup", "dedup_path"),
+    ("attribution", "aggregates_path"),
+    ("rolling", "state_path"),
+]
+
+# State paths filled in when they are not set: (section, key, name in cache_path, default without cache_path)
+STATE_PATHS = [
+    ("streaming", "checkpoint_path", "checkpoints", ("log_path",)),
+    ("dedup", "dedup_path", "dedup", ("csv_path", "dedup")),
+    ("rolling", "state_path", "rolling_state.json", ("csv_path", "rolling_state.json")),
+    ("attribution", "aggregates_path", "day_aggregates", ("csv_path", "day_aggregates")),
+]
+
+# Performance profiles, applied between the defaults and the config file
+PROFILES = {
+    "laptop": {
+        "performance": {"workers": 2},
+        "streaming": {"chunk_bytes": 4 * 1024 * 1024, "memory_budget_mb": 512, "queue_size": 2},
+        "database": {"loader": "rows"},
+        "directories": {"cache_path": ".cache"},
+    },
+    "batch-server": {
+        "performance": {"workers": 8},
+        "streaming": {"chunk_bytes": 16 * 1024 * 1024, "memory_budget_mb": 4096, "queue_size": 4},
+        "database": {"loader": "batch"},
+        "directories": {"cache_path": "cache"},
+    },
+    "large-host": {
+        "performance": {"workers": 32},
+        "streaming": {"chunk_bytes": 64 * 1024 * 1024, "memory_budget_mb": 32768, "queue_size": 8},
+        "database": {"loader": "batch"},
+        # The run state (checkpoints, dedup segments, rolling state) cannot be rebuilt, so it stays on disk.
+        # Only the scratch files, which are not needed after the command, live in memory (tmpfs).
+        "directories": {"cache_path": "cache", "scratch_path": "/dev/shm/recharge_file_scratch"},
+    },
+}
+
+def default_config_path(environ=None):
+    """
+    This function gets the path of the config file: RECHARGE_CONFIG if set, otherwise the config file next to
+    the scripts.
+
+    Args:
+        environ (dict): Environment variables. Defaults to os.environ.
+
+    Returns:
+        config_path (str): Path of the config file
+    """
+
+    environ = os.environ if environ is None else environ
+
+    return environ.get(f"{ENV_PREFIX}CONFIG") or os.path.join(os.path.dirname(os.path.abspath(__file__)), CONFIG_FILENAME)
+
+def environment_overrides(environ):
+    """
+    This function gets the config values set with RECHARGE_<SECTION>__<KEY> environment variables.
+
+    Args:
+        environ (dict): Environment variables
+
+    Returns:
+        overrides (dict): Values per section (strings, converted during the validation)
+    """
+
+    overrides = {}
+    for name, value in environ.items():
+        if not name.startswith(ENV_PREFIX) or "__" not in name:
+            continue
+        section, key = name[len(ENV_PREFIX):].lower().split("__", 1)
+        overrides.setdefault(section, {})[key] = value
+
+    return overrides
+
+def merge_layers(layers):
+    """
+    This function merges the layers of the config, the later layers overriding the earlier ones.
+
+    Args:
+        layers (list): (source name, values per section) from the lowest to the highest priority
+
+    Returns:
+        merged (dict): Values per section
+        sources (dict): Source name per (section, key)
+    """
+
+    merged = {}
+    sources = {}
+    for source, layer in layers:
+        for section, values in layer.items():
+            if not isinstance(values, dict):
+                raise ConfigError(f"[{section}] must be a section, found {values!r} ({source})")
+            for key, value in values.items():
+                merged.setdefault(section, {})[key] = value
+                sources[(section, key)] = source
+
+    return merged, sources
+
+def validate(merged, sources):
+    """
+    This function checks the merged config against SCHEMA and converts the values to their type.
+
+    Args:
+        merged (dict): Values per section
+        sources (dict): Source name per (section, key), used in the error messages
+
+    Returns:
+        config (dict): Typed values per section, without the unset optional keys
+    """
+
+    errors = []
+    config = {}
+
+    for section, values in merged.items():
+        if section not in SCHEMA:
+            errors.append(f"unknown section [{section}]")
+            continue
+        for key in values:
+            if key not in SCHEMA[section]:
+                errors.append(f"unknown key {key} in [{section}] ({sources[(section, key)]})")
+
+    for section, keys in SCHEMA.items():
+        config[section] = {}
+        for key, (convert, default) in keys.items():
+            value = merged.get(section, {}).get(key, default)
+            if value is REQUIRED:
+                errors.append(f"missing {key} in [{section}]")
+                continue
+            if value is None:
+                continue
+            try:
+                config[section][key] = convert(value)
+            except ValueError as e:
+                errors.append(f"{section}.{key} = {value!r} {e} ({sources.get((section, key), 'default')})")
+
+    if errors:
+        raise ConfigError("Invalid config:\n  " + "\n  ".join(errors))
+
+    return config
+
+def resolve_paths(config, sources, base_dir):
+    """
+    This function makes the paths absolute (relative paths are resolved from base_dir) and fills in the
+    state paths that are not set.
+
+    Args:
+        config (dict): Typed config
+        sources (dict): Source name per (section, key), updated for the filled in paths
+        base_dir (dir): Directory of the config file
+    """
+
+    for section, key in PATH_KEYS:
+        if key in config[section]:
+            config[section][key] = os.path.normpath(os.path.join(base_dir, os.path.expanduser(config[section][key])))
+
+    directories = config["directories"]
+    for section, key, cache_name, default_parts in STATE_PATHS:
+        if key in config[section]:
+            continue
+        if "cache_path" in directories:
+            config[section][key] = os.path.join(directories["cache_path"], cache_name)
+        else:
+            config[section][key] = os.path.join(directories[default_parts[0]], *default_parts[1:])
+        sources[(section, key)] = "derived"
+
+def load_config_with_sources(config_path=None, environ=None):
+    """
+    This function builds the effective config and keeps where every value comes from.
+
+    Args:
+        config_path (str): Path of the config file. Defaults to default_config_path().
+        environ (dict): Environment variables. Defaults to os.environ.
+
+    Returns:
+        config (dict): Effective config
+        sources (dict): "default", "profile <name>", "file", "env" or "derived" per (section, key)
+    """
+
+    environ = os.environ if environ is None else environ
+    config_path = os.path.abspath(config_path or default_config_path(environ))
+
+    try:
+        with open(config_path, "rb") as file:
+            file_values = tomli.load(file)
+    except FileNotFoundError:
+        raise ConfigError(f"Config file not found: {config_path}")
+    except tomli.TOMLDecodeError as e:
+        raise ConfigError(f"Config file {config_path} is not valid TOML: {e}")
+
+    # Config files without schema_version are the first version, which has the same sections
+    schema_version = file_values.pop("schema_version", 1)
+    if not isinstance(schema_version, int) or schema_version > SCHEMA_VERSION:
+        raise ConfigError(f"Unsupported schema_version {schema_version!r} in {config_path}, "
+                          f"this version of the reader supports up to {SCHEMA_VERSION}")
+
+    file_profile = file_values.pop("profile", None)
+    profile = environ.get(f"{ENV_PREFIX}PROFILE") or file_profile or None
+    if profile is not None and profile not in PROFILES:
+        raise ConfigError(f"Unknown profile {profile!r}, use one of {', '.join(PROFILES)}")
+
+    layers = [("default", {})]
+    if profile is not None:
+        layers.append((f"profile {profile}", PROFILES[profile]))
+    layers += [("file", file_values), ("env", environment_overrides(environ))]
+
+    merged, sources = merge_layers(layers)
+    config = validate(merged, sources)
+    resolve_paths(config, sources, os.path.dirname(config_path))
+
+    config["schema_version"] = SCHEMA_VERSION
+    config["profile"] = profile
+    config["config_path"] = config_path
+
+    return config, sources
+
+def load_config(config_path=None, environ=None):
+    """
+    This function builds the effective config.
+
+    Args:
+        config_path (str): Path of the config file. Defaults to default_config_path().
+        environ (dict): Environment variables. Defaults to os.environ.
+
+    Returns:
+        config (dict): Effective config
+    """
+
+    return load_config_with_sources(config_path, environ)[0]
+
+def format_value(value):
+    """
+    This function formats a value as TOML.
+    """
+
+    if isinstance(value, str):
+        return '"' + value.replace("\\", "\\\\").replace('"', '\\"') + '"'
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, list):
+        return "[" + ", ".join(format_value(item) for item in value) + "]"
+    return str(value)
+
+def format_effective_config(config, sources):
+    """
+    This function formats the effective config as TOML, with the source of every value as a comment.
+    The database password is masked.
+
+    Args:
+        config (dict): Effective config
+        sources (dict): Source per (section, key)
+
+    Returns:
+        text (str): Effective config
+    """
+
+    lines = [
+        f"# {config['config_path']}",
+        f"schema_version = {config['schema_version']}",
+        f"profile = {format_value(config['profile']) if config['profile'] else format_value('')}",
+    ]
+    for section in SCHEMA:
+        lines.append("")
+        lines.append(f'["{section}"]')
+        for key, value in config[section].items():
+            if key == "db_password" and value:
+                value = "********"
+            lines.append(f"{key} = {format_value(value)}  # {sources.get((section, key), 'default')}")
+
+    return "\n".join(lines)
@@ -0,0 +1,382 @@
+"""
+
+This script contains the event-time attribution of recharge_file_reader.py. It is run with:
+
+    python recharge_file_reader.py run --engine incremental
+
+It shall:
+1. Attribute every event to the day of its own EventDateAndTime instead of the day in the filename, so late-arriving
+   and cross-midnight events end up in the right daily totals.
+2. Keep per-day partial aggregates (one set of totals per day and per source file) in a small on-disk store.
+   Ingesting a file again replaces its contribution, so reruns do not double count.
+3. Publish the reports of the run day from the store and, when a file changes the totals of a day that was already
+   published, re-emit only that day's reports and upsert only that day's rows in the database (correction).
+   The rows per day are kept in their own *_per_day tables, the report tables of the other engines are left as is.
+
+"""
+
+import json
+import logging
+import os
+from datetime import date, datetime
+
+import recharge_file_reader as reader
+from event_dedup import open_duplicate_filter
+from lazy_imports import LazyModule
+from report_catalog import get_reports_for_date
+from report_history import read_history
+from report_sinks import write_json_atomic
+from streaming_reader import totals_from_json, totals_to_json
+
+psycopg2 = LazyModule("psycopg2")
+
+script_log = logging.getLogger("script_handler")
+
+DB_NAME = "recharge_file_stats_db"
+FILE_INDEX = "file_days.json"
+
+# Table, key column and value column of the per-day report tables per report
+DB_TABLES = {
+    "location": ("total_recharge_amount_per_location_per_day", "Location", "Total_RechargeAmount"),
+    "category": ("total_recharge_amount_per_category_per_day", "Category", "Total_RechargeAmount"),
+    "payment_method": ("payment_method_count_per_day", "PaymentMethod", "Total_Count"),
+}
+
+def event_days(event_date_time):
+    """
+    This function gets the day of every event as a YYYYMMDD integer from the EventDateAndTime column (DDMMYYYYHHMM).
+    Only integer arithmetic on the whole column, no string or datetime parsing.
+
+    Args:
+        event_date_time (pandas.core.series.Series): EventDateAndTime column
+
+    Returns:
+        days (pandas.core.series.Series): Day of every event (ex. 20250124)
+    """
+
+    values = event_date_time.astype("int64")
+    day = values // 10**10
+    month = (values // 10**8) % 100
+    year = (values // 10**4) % 10**4
+
+    return year * 10000 + month * 100 + day
+
+def day_key_to_date(day_key):
+    """
+    This function converts a YYYYMMDD integer to a date.
+
+    Args:
+        day_key (int): Day as YYYYMMDD
+
+    Returns:
+        day (datetime.date): Day
+    """
+
+    return date(day_key // 10000, (day_key // 100) % 100, day_key % 100)
+
+def partial_totals_by_day(data):
+    """
+    This function computes the partial totals of the three reports per day of EventDateAndTime.
+
+    Args:
+        data (pandas.core.frame.DataFrame): Events with the columns of the EventFile_Recharge files
+
+    Returns:
+        totals_by_day (dict): Partial totals (see recharge_file_reader.partial_totals()) per day (datetime.date)
+    """
+
+    return {
+        day_key_to_date(int(day_key)): reader.partial_totals(day_data)
+        for day_key, day_data in data.groupby(event_days(data["EventDateAndTime"]))
+    }
+
+def load_json(path, default):
+    """
+    This function loads a json file of the store.
+
+    Args:
+        path (str): Path of the json file
+        default: Value returned when the file does not exist
+
+    Returns:
+        data: Content of the file
+    """
+
+    if not os.path.exists(path):
+        return default
+
+    with open(path, "r") as file:
+        return json.load(file)
+
+def day_path(store_path, day):
+    """
+    This function gets the path of the aggregates of a day.
+    """
+
+    return os.path.join(store_path, f"{day.isoformat()}.json")
+
+def update_day(store_path, day, source_file, totals):
+    """
+    This function sets the contribution of a source file to a day. totals=None removes the contribution.
+
+    Args:
+        store_path (dir): Directory of the per-day aggregates
+        day (datetime.date): Day of the events
+        source_file (str): Path of the source file relative to the input path
+        totals (dict): Partial totals of the events of the file on that day
+
+    Returns:
+        changed (bool): True if the totals of the day changed
+    """
+
+    path = day_path(store_path, day)
+    day_data = load_json(path, {"files": {}})
+
+    previous = day_data["files"].get(source_file)
+    new = totals_to_json(totals) if totals is not None else None
+    if previous == new:
+        return False
+
+    if new is None:
+        del day_data["files"][source_file]
+    else:
+        day_data["files"][source_file] = new
+    write_json_atomic(day_data, path)
+
+    return True
+
+def ingest_file(store_path, file, input_path, duplicate_filter=None):
+    """
+    This function reads a file and updates the per-day aggregates of every day its events fall on.
+    The contributions are keyed on the path of the file relative to the input path, so files with the same name
+    in different subdirectories are kept apart.
+
+    Args:
+        store_path (dir): Directory of the per-day aggregates
+        file (str): Path of the csv file
+        input_path (dir): Directory of the input path
+        duplicate_filter (event_dedup.DuplicateFilter): Drops the events already seen that day, None to keep every event
+
+    Returns:
+        changed_days (set): Days (datetime.date) whose totals changed
+    """
+
+    source_file = os.path.relpath(file, input_path)
+    data = reader.read_csv(file)
+    if duplicate_filter is not None:
+        data = duplicate_filter.filter_file(file, data)
+    totals_by_day = partial_totals_by_day(data)
+
+    index_path = os.path.join(store_path, FILE_INDEX)
+    file_index = load_json(index_path, {})
+    previous_days = {date.fromisoformat(day) for day in file_index.get(source_file, [])}
+
+    changed_days = set()
+
+    # Contributions stored before the relative paths were used are keyed on the filename only
+    legacy_file = os.path.basename(file)
+    if legacy_file != source_file and legacy_file in file_index:
+        for day in file_index.pop(legacy_file):
+            if update_day(store_path, date.fromisoformat(day), legacy_file, None):
+                changed_days.add(date.fromisoformat(day))
+
+    for day, totals in totals_by_day.items():
+        if update_day(store_path, day, source_file, totals):
+            changed_days.add(day)
+
+    # Days the file no longer has events for (ex. the file was redelivered with different content)
+    for day in previous_days - set(totals_by_day):
+        if update_day(store_path, day, source_file, None):
+            changed_days.add(day)
+
+    file_index[source_file] = sorted(day.isoformat() for day in totals_by_day)
+    write_json_atomic(file_index, index_path)
+
+    return changed_days
+
+def day_totals(store_path, day):
+    """
+    This function merges the contributions of all the source files to a day.
+
+    Args:
+        store_path (dir): Directory of the per-day aggregates
+        day (datetime.date): Day of the events
+
+    Returns:
+        totals (dict): Totals of the day
+    """
+
+    day_data = load_json(day_path(store_path, day), {"files": {}})
+
+    return reader.merge_partial_totals([totals_from_json(totals) for totals in day_data["files"].values()])
+
+def is_published(csv_path, day):
+    """
+    This function checks in the report catalog if the reports of a day were already written.
+
+    Args:
+        csv_path (dir): Directory of the reports
+        day (datetime.date): Day of the reports
+
+    Returns:
+        published (bool): True if a report of the day exists
+    """
+
+    # Days already compacted are looked up in their period file
+    return any(
+        get_reports_for_date(csv_path, filename_prefix, day) or not read_history(csv_path, filename_prefix, day, day).empty
+        for filename_prefix in reader.REPORT_PREFIXES
+    )
+
+def create_table_per_day(cursor, table, key_column, value_column):
+    """
+    This function creates a per-day report table, keyed on (report_date, key).
+
+    Args:
+        cursor (psycopg2.extensions.cursor): Cursor of the recharge file stats database
+        table (str): Name of the table
+        key_column (str): Column of the report key (ex. Location)
+        value_column (str): Column of the report value (ex. Total_RechargeAmount)
+    """
+
+    cursor.execute(f"CREATE TABLE IF NOT EXISTS {table} (report_date DATE NOT NULL, {key_column} VARCHAR(255) NOT NULL, "
+                   f"{value_column} BIGINT, PRIMARY KEY (report_date, {key_column}));")
+
+def upsert_day(connection, day, dataframes):
+    """
+    This function upserts the rows of a day in the per-day report tables, so that a correction replaces the rows
+    of its day only. The keys the day no longer has are deleted.
+
+    Args:
+        connection (psycopg2.extensions.connection): Connection to the recharge file stats database
+        day (datetime.date): Day of the reports
+        dataframes (list): Location, Category and PaymentMethod report dataframes
+    """
+
+    with connection.cursor() as cursor:
+        for (table, key_column, value_column), dataframe in zip(DB_TABLES.values(), dataframes):
+            create_table_per_day(cursor, table, key_column, value_column)
+            rows = [(day, str(key), int(value)) for key, value in dataframe.itertuples(index=False)]
+            cursor.execute(f"DELETE FROM {table} WHERE report_date = %s AND NOT ({key_column} = ANY(%s));",
+                           (day, [key for _, key, _ in rows]))
+            if rows:
+                psycopg2.extras.execute_values(
+                    cursor,
+                    f"INSERT INTO {table} (report_date, {key_column}, {value_column}) VALUES %s "
+                    f"ON CONFLICT (report_date, {key_column}) DO UPDATE SET {value_column} = EXCLUDED.{value_column};",
+                    rows,
+                )
+    connection.commit()
+
+def publish_day(config, store_path, day):
+    """
+    This function writes the reports of a day from the per-day aggregates.
+
+    Args:
+        config (dict): .toml file for the inputs
+        store_path (dir): Directory of the per-day aggregates
+        day (datetime.date): Day of the reports
+
+    Returns:
+        dataframes (list): Location, Category and PaymentMethod report dataframes, to upsert in the database
+    """
+
+    csv_path = config["directories"]["csv_path"]
+    dataframes = reader.totals_to_dataframes(day_totals(store_path, day))
+
+    for filename_prefix, dataframe in zip(reader.REPORT_PREFIXES, dataframes):
+        reader.save_to_csv(filename_prefix, csv_path, dataframe, reader.import_report_format(config, filename_prefix),
+                           report_date=day)
+
+    return dataframes
+
+def upsert_days(config, published):
+    """
+    This function upserts the published days in the database when the send_to_database operation is enabled.
+    Database errors are logged and do not fail the run, the reports are already written.
+
+    Args:
+        config (dict): .toml file for the inputs
+        published (dict): Report dataframes per day (datetime.date) from publish_day()
+    """
+
+    if config["operation"]["send_to_database"] != "YES":
+        script_log.info("Operation send_to_database: NO")
+        return
+
+    connection = reader.open_stats_db(config, DB_NAME)
+    if connection is None:
+        return
+
+    try:
+        for day, dataframes in published.items():
+            try:
+                upsert_day(connection, day, dataframes)
+            except Exception as e:
+                connection.rollback()
+                script_log.error(f"An error occured while upserting the totals of {day}: {e}\n")
+
+    finally:
+        connection.close()
+
+def import_aggregates_path(config):
+    """
+    This function will import the path of the per-day aggregates given in the config file.
+    Defaults to a day_aggregates directory in cache_path, or in the csv path without cache_path.
+
+    Args:
+        config (dict): .toml file for the inputs
+
+    Returns:
+        store_path (dir): Directory of the per-day aggregates
+    """
+
+    store_path = config.get("attribution", {}).get(
+        "aggregates_path", os.path.join(config["directories"]["csv_path"], "day_aggregates")
+    )
+    os.makedirs(store_path, exist_ok=True)
+
+    return store_path
+
+def run_incremental(config, target_date=None):
+    """
+    This function ingests the files of the day into the per-day aggregates, publishes the run day and
+    re-emits the already published days whose totals changed.
+
+    Args:
+        config (dict): .toml file for the inputs
+        target_date (datetime): Date of the files to read. Defaults to the current date.
+    """
+
+    run_day = (target_date or datetime.now()).date()
+    csv_path = config["directories"]["csv_path"]
+    store_path = import_aggregates_path(config)
+
+    input_path = reader.import_input_path(config)
+    # The events are deduplicated within the files of the run day, like the other engines
+    duplicate_filter = open_duplicate_filter(config, run_day)
+    changed_days = set()
+    try:
+        for file in reader.get_csv_files_to_read(input_path, target_date):
+            script_log.info(f"Picked up file: {file}")
+            changed_days |= ingest_file(store_path, file, input_path, duplicate_filter)
+    finally:
+        if duplicate_filter is not None:
+            duplicate_filter.close()
+
+    corrections = sorted(day for day in changed_days if day != run_day and is_published(csv_path, day))
+    pending = sorted(day for day in changed_days if day != run_day and day not in corrections)
+    if pending:
+        script_log.info(f"Events for unpublished day(s) {', '.join(map(str, pending))} are kept for their own run.")
+
+    # The reports are written before the database is opened, so they do not depend on the database
+    published = {run_day: publish_day(config, store_path, run_day)}
+    script_log.info(f"Published the reports of {run_day}.")
+
+    for day in corrections:
+        published[day] = publish_day(config, store_path, day)
+        script_log.warning(f"Late events changed the totals of {day}, its reports were re-emitted.")
+
+    upsert_days(config, published)
+
+    reader.apply_retention(csv_path, config.get("reports", {}).get("retention_days", 0))
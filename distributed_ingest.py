@@ -0,0 +1,413 @@
+"""
+
+This script contains the coordinator/worker mode of recharge_file_reader.py. It is run with:
+
+    python recharge_file_reader.py distributed publish --date DDMMYYYY     (on the coordinator)
+    python recharge_file_reader.py distributed work --date DDMMYYYY        (on every worker node)
+    python recharge_file_reader.py distributed finalize --date DDMMYYYY    (once all the files are done)
+    python recharge_file_reader.py distributed local --workers 4           (all of the above on one machine)
+
+It shall:
+1. Publish one task per input file into a Postgres job table of the recharge file stats database.
+2. Let workers on any node claim tasks with SELECT ... FOR UPDATE SKIP LOCKED, parse the file and push
+   its partial Location, Category and PaymentMethod totals in the same transaction that marks the task done.
+3. Merge the partial totals of the day and write the reports of the day (finalizer).
+
+The input path must be reachable with the same file paths from every worker node (ex. a shared mount).
+
+"""
+
+import logging
+import multiprocessing
+import os
+import socket
+import time
+from datetime import datetime
+
+import recharge_file_reader as reader
+from lazy_imports import LazyModule
+
+psycopg2 = LazyModule("psycopg2")
+
+script_log = logging.getLogger("script_handler")
+
+DB_NAME = "recharge_file_stats_db"
+
+# Partial totals are stored with text keys, these convert them back to the types of the reports
+KEY_TYPES = {
+    "location": str,
+    "category": str,
+    "payment_method": int,
+}
+
+def connect_job_db(config):
+    """
+    This function connects to the recharge file stats database (created if needed) and creates the job tables.
+    The job tables are the queue of the distributed mode, an unreachable database stops the run.
+
+    Args:
+        config (dict): .toml file for the inputs
+
+    Returns:
+        connection (psycopg2.extensions.connection): Connection to the recharge file stats database
+
+    Raises:
+        ConnectionError: The database server or the recharge file stats database is not reachable
+    """
+
+    db_connection = reader.connect_to_db(config)
+    if db_connection is None:
+        raise ConnectionError(f"Could not connect to the database server of '{DB_NAME}'")
+    reader.create_recharge_file_stats_db(DB_NAME, reader.open_cursor_db(db_connection), db_connection)
+
+    connection = reader.connect_to_new_db(DB_NAME, config)
+    if connection is None:
+        raise ConnectionError(f"Could not connect to database '{DB_NAME}'")
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "CREATE TABLE IF NOT EXISTS recharge_jobs ("
+            "id BIGSERIAL PRIMARY KEY, "
+            "run_date DATE NOT NULL, "
+            "file_path TEXT NOT NULL, "
+            "status VARCHAR(16) NOT NULL DEFAULT 'pending', "
+            "worker VARCHAR(255), "
+            "claimed_at TIMESTAMPTZ, "
+            "finished_at TIMESTAMPTZ, "
+            "row_count BIGINT, "
+            "error TEXT, "
+            "UNIQUE (run_date, file_path));"
+        )
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_recharge_jobs_pending ON recharge_jobs (run_date, id) WHERE status = 'pending';")
+        cursor.execute(
+            "CREATE TABLE IF NOT EXISTS recharge_partials ("
+            "job_id BIGINT NOT NULL REFERENCES recharge_jobs (id) ON DELETE CASCADE, "
+            "report VARCHAR(32) NOT NULL, "
+            "key VARCHAR(255) NOT NULL, "
+            "value BIGINT NOT NULL, "
+            "PRIMARY KEY (job_id, report, key));"
+        )
+    connection.commit()
+
+    return connection
+
+def publish_files(connection, files, run_date):
+    """
+    This function publishes one pending task per file. Files already published for the day are skipped.
+
+    Args:
+        connection (psycopg2.extensions.connection): Connection to the recharge file stats database
+        files (list): Paths of the files to read
+        run_date (datetime.date): Day covered by the files
+
+    Returns:
+        published (int): Number of new tasks
+    """
+
+    if not files:
+        return 0
+
+    with connection.cursor() as cursor:
+        inserted = psycopg2.extras.execute_values(
+            cursor,
+            "INSERT INTO recharge_jobs (run_date, file_path) VALUES %s ON CONFLICT (run_date, file_path) DO NOTHING RETURNING id;",
+            [(run_date, file) for file in files],
+            fetch=True,
+        )
+        published = len(inserted)
+    connection.commit()
+
+    script_log.info(f"Published {published} new task(s) out of {len(files)} file(s) for {run_date}.")
+
+    return published
+
+def requeue_stale_jobs(connection, run_date, lease_seconds):
+    """
+    This function puts back the tasks of workers that died (claimed for longer than the lease) in the queue.
+
+    Args:
+        connection (psycopg2.extensions.connection): Connection to the recharge file stats database
+        run_date (datetime.date): Day of the tasks
+        lease_seconds (int): Maximum time a worker can hold a task
+
+    Returns:
+        requeued (int): Number of tasks put back in the queue
+    """
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "UPDATE recharge_jobs SET status = 'pending', worker = NULL, claimed_at = NULL "
+            "WHERE run_date = %s AND status = 'running' AND claimed_at < now() - make_interval(secs => %s);",
+            (run_date, lease_seconds),
+        )
+        requeued = cursor.rowcount
+    connection.commit()
+
+    if requeued:
+        script_log.warning(f"Requeued {requeued} stale task(s) for {run_date}.")
+
+    return requeued
+
+def claim_job(connection, run_date, worker_id):
+    """
+    This function claims the next pending task of the day. Concurrent workers skip the rows locked by each other
+    so a task is only given to one worker.
+
+    Args:
+        connection (psycopg2.extensions.connection): Connection to the recharge file stats database
+        run_date (datetime.date): Day of the tasks
+        worker_id (str): Name of the worker
+
+    Returns:
+        job (tuple): (job_id, file_path) of the claimed task, None if there is no pending task
+    """
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "UPDATE recharge_jobs SET status = 'running', worker = %s, claimed_at = now() "
+            "WHERE id = ("
+            "SELECT id FROM recharge_jobs WHERE run_date = %s AND status = 'pending' "
+            "ORDER BY id FOR UPDATE SKIP LOCKED LIMIT 1) "
+            "RETURNING id, file_path;",
+            (worker_id, run_date),
+        )
+        job = cursor.fetchone()
+    connection.commit()
+
+    return job
+
+def complete_job(connection, job_id, worker_id, totals, row_count):
+    """
+    This function stores the partial totals of a task and marks it done in one transaction.
+    Nothing is stored if the task was requeued and claimed by another worker in the meantime.
+
+    Args:
+        connection (psycopg2.extensions.connection): Connection to the recharge file stats database
+        job_id (int): Id of the task
+        worker_id (str): Name of the worker
+        totals (dict): Partial totals of the file
+        row_count (int): Number of rows of the file
+
+    Returns:
+        completed (bool): True if the partial totals were stored
+    """
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "UPDATE recharge_jobs SET status = 'done', finished_at = now(), row_count = %s, error = NULL "
+            "WHERE id = %s AND worker = %s AND status = 'running';",
+            (row_count, job_id, worker_id),
+        )
+        if cursor.rowcount != 1:
+            connection.rollback()
+            script_log.warning(f"Task {job_id} is no longer owned by {worker_id}, dropping its partial totals.")
+            return False
+
+        cursor.execute("DELETE FROM recharge_partials WHERE job_id = %s;", (job_id,))
+        psycopg2.extras.execute_values(
+            cursor,
+            "INSERT INTO recharge_partials (job_id, report, key, value) VALUES %s;",
+            [(job_id, report, str(key), int(value)) for report, values in totals.items() for key, value in values.items()],
+        )
+    connection.commit()
+
+    return True
+
+def fail_job(connection, job_id, error):
+    """
+    This function marks a task as failed with its error.
+
+    Args:
+        connection (psycopg2.extensions.connection): Connection to the recharge file stats database
+        job_id (int): Id of the task
+        error (str): Error message
+    """
+
+    connection.rollback()
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "UPDATE recharge_jobs SET status = 'failed', finished_at = now(), error = %s WHERE id = %s;",
+            (error, job_id),
+        )
+    connection.commit()
+
+def run_worker(config, run_date, worker_id=None, lease_seconds=900):
+    """
+    This function claims and processes tasks of the day until the queue is empty.
+
+    Args:
+        config (dict): .toml file for the inputs
+        run_date (datetime.date): Day of the tasks
+        worker_id (str): Name of the worker. Defaults to <hostname>-<pid>.
+        lease_seconds (int): Maximum time a worker can hold a task before it is requeued
+
+    Returns:
+        processed (int): Number of tasks completed by this worker
+    """
+
+    worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+    connection = connect_job_db(config)
+
+    processed = 0
+    try:
+        requeue_stale_jobs(connection, run_date, lease_seconds)
+
+        while True:
+            job = claim_job(connection, run_date, worker_id)
+            if job is None:
+                break
+
+            job_id, file_path = job
+            script_log.info(f"Worker {worker_id} picked up file: {file_path}")
+            try:
+                df = reader.read_csv(file_path)
+                if complete_job(connection, job_id, worker_id, reader.partial_totals(df), len(df)):
+                    processed += 1
+
+            except Exception as e:
+                script_log.error(f"Worker {worker_id} failed on {file_path}: {e}\n")
+                fail_job(connection, job_id, str(e))
+
+    finally:
+        connection.close()
+
+    script_log.info(f"Worker {worker_id} is done, {processed} task(s) processed.")
+
+    return processed
+
+def job_status(connection, run_date):
+    """
+    This function counts the tasks of the day per status.
+
+    Args:
+        connection (psycopg2.extensions.connection): Connection to the recharge file stats database
+        run_date (datetime.date): Day of the tasks
+
+    Returns:
+        counts (dict): Number of tasks per status
+    """
+
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT status, COUNT(*) FROM recharge_jobs WHERE run_date = %s GROUP BY status;", (run_date,))
+        counts = dict(cursor.fetchall())
+    connection.commit()
+
+    return counts
+
+def merge_partials(connection, run_date):
+    """
+    This function merges the partial totals of all the completed tasks of the day in the database.
+
+    Args:
+        connection (psycopg2.extensions.connection): Connection to the recharge file stats database
+        run_date (datetime.date): Day of the tasks
+
+    Returns:
+        totals (dict): Merged totals of the day
+    """
+
+    totals = reader.merge_partial_totals([])
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT p.report, p.key, SUM(p.value) FROM recharge_partials p "
+            "JOIN recharge_jobs j ON j.id = p.job_id "
+            "WHERE j.run_date = %s AND j.status = 'done' GROUP BY p.report, p.key;",
+            (run_date,),
+        )
+        for report, key, value in cursor.fetchall():
+            totals[report][KEY_TYPES[report](key)] = int(value)
+    connection.commit()
+
+    return totals
+
+def finalize(config, run_date, wait_seconds=0):
+    """
+    This function writes the reports of the day once every task is done, then loads them to the database
+    when the send_to_database operation is enabled.
+
+    Args:
+        config (dict): .toml file for the inputs
+        run_date (datetime.date): Day of the tasks
+        wait_seconds (int): Time to wait for the running tasks to finish
+
+    Returns:
+        finalized (bool): True if the reports were written
+    """
+
+    connection = connect_job_db(config)
+    try:
+        deadline = time.monotonic() + wait_seconds
+        counts = job_status(connection, run_date)
+        while (counts.get("pending") or counts.get("running")) and time.monotonic() < deadline:
+            time.sleep(1)
+            counts = job_status(connection, run_date)
+
+        if counts.get("pending") or counts.get("running"):
+            script_log.error(f"Cannot finalize {run_date}, tasks are not done: {counts}\n")
+            return False
+        if counts.get("failed"):
+            script_log.error(f"Cannot finalize {run_date}, {counts['failed']} task(s) failed. Requeue or fix them first.\n")
+            return False
+
+        totals = merge_partials(connection, run_date)
+
+    finally:
+        connection.close()
+
+    csv_path = config["directories"]["csv_path"]
+    for filename_prefix, dataframe in zip(reader.REPORT_PREFIXES, reader.totals_to_dataframes(totals)):
+        reader.save_to_csv(filename_prefix, csv_path, dataframe, reader.import_report_format(config, filename_prefix),
+                           report_date=run_date)
+    script_log.info(f"Finalized {run_date} from {counts.get('done', 0)} task(s).\n")
+
+    reader.send_reports_to_database(config, csv_path)
+
+    return True
+
+def publish(config, target_date=None):
+    """
+    This function finds the files of the day and publishes them as tasks.
+
+    Args:
+        config (dict): .toml file for the inputs
+        target_date (datetime): Date of the files to read. Defaults to the current date.
+
+    Returns:
+        published (int): Number of new tasks
+    """
+
+    run_date = (target_date or datetime.now()).date()
+    files = reader.get_csv_files_to_read(reader.import_input_path(config), target_date)
+
+    connection = connect_job_db(config)
+    try:
+        return publish_files(connection, files, run_date)
+    finally:
+        connection.close()
+
+def run_local(config, target_date=None, workers=4):
+    """
+    This function runs the coordinator, several local worker processes and the finalizer on one machine.
+
+    Args:
+        config (dict): .toml file for the inputs
+        target_date (datetime): Date of the files to read. Defaults to the current date.
+        workers (int): Number of worker processes
+
+    Returns:
+        finalized (bool): True if the reports were written
+    """
+
+    run_date = (target_date or datetime.now()).date()
+    publish(config, target_date)
+
+    processes = [
+        multiprocessing.Process(target=run_worker, args=(config, run_date, f"{socket.gethostname()}-local-{number}"))
+        for number in range(1, workers + 1)
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+
+    return finalize(config, run_date)
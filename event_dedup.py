@@ -0,0 +1,306 @@
+"""
+
+This script contains the duplicate-event detection of recharge_file_reader.py. It is enabled with:
+
+    ["dedup"]
+    enabled = "YES"
+
+with the serial, async, compact and incremental engines (see recharge_file_reader.DEDUP_ENGINES).
+It shall:
+1. Fingerprint every event as (MSIDN, EventDateAndTime, RechargeAmount, PaymentMethod) and drop the events that
+   were already seen that day, ex. records redelivered in a new EventFile_Recharge file by a mediation retry.
+2. Stay memory-bounded: a Bloom filter of the day answers "never seen" for almost every event, and only its
+   positives are checked against the exact fingerprints, which are kept on disk (one sorted segment per source file,
+   named after its path relative to the input path) and searched memory-mapped.
+3. Persist the filter and the segments per day, so they are shared by all the runs of that day. Reading the same file
+   again (rerun) is not a repeat: a file is only checked against the segments of the other files.
+
+"""
+
+import logging
+import math
+import os
+import threading
+from urllib.parse import quote, unquote
+
+import run_metrics
+from lazy_imports import LazyModule
+
+np = LazyModule("numpy")
+pd = LazyModule("pandas")
+
+script_log = logging.getLogger("script_handler")
+
+FINGERPRINT_COLUMNS = ["MSIDN", "EventDateAndTime", "RechargeAmount", "PaymentMethod"]
+BLOOM_FILENAME = "bloom.npz"
+SEGMENT_SUFFIX = ".fingerprints.npy"
+
+def event_fingerprints(data):
+    """
+    This function computes the 64-bit fingerprint of every event.
+
+    Args:
+        data (pandas.core.frame.DataFrame): Events with the columns of the EventFile_Recharge files
+
+    Returns:
+        fingerprints (numpy.ndarray): uint64 fingerprint of every event
+    """
+
+    return pd.util.hash_pandas_object(data[FINGERPRINT_COLUMNS], index=False).to_numpy()
+
+def bloom_size(expected_events, false_positive_rate):
+    """
+    This function gets the size and the number of hash functions of a Bloom filter.
+
+    Args:
+        expected_events (int): Number of events the filter is sized for
+        false_positive_rate (float): Wanted false positive rate at that number of events
+
+    Returns:
+        size_bits (int): Number of bits of the filter (multiple of 8)
+        hashes (int): Number of hash functions
+    """
+
+    size_bits = math.ceil(-expected_events * math.log(false_positive_rate) / math.log(2) ** 2)
+    size_bits = max(8, (size_bits + 7) // 8 * 8)
+    hashes = max(1, round(size_bits / expected_events * math.log(2)))
+
+    return size_bits, hashes
+
+def save_arrays_atomic(path, save, *args, **kwargs):
+    """
+    This function writes a numpy file next to its final path, then moves it in place.
+
+    Args:
+        path (str): Final path of the file
+        save (callable): numpy.save or numpy.savez
+    """
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as file:
+        save(file, *args, **kwargs)
+    os.replace(tmp_path, path)
+
+class BloomFilter:
+    """
+    Bloom filter over the 64-bit event fingerprints. The k bit positions of a fingerprint are derived from its
+    two halves (double hashing), so no other hash is computed. All operations are vectorized over an array.
+    """
+
+    __slots__ = ("bits", "size_bits", "hashes")
+
+    def __init__(self, size_bits, hashes, bits=None):
+        self.size_bits = size_bits
+        self.hashes = hashes
+        self.bits = bits if bits is not None else np.zeros(size_bits // 8, dtype="uint8")
+
+    def positions(self, fingerprints):
+        """
+        This function yields the bit positions of the fingerprints, one array per hash function.
+        """
+
+        first = fingerprints
+        second = (fingerprints >> np.uint64(32)) | np.uint64(1)
+        size_bits = np.uint64(self.size_bits)
+        for i in range(self.hashes):
+            yield (first + np.uint64(i) * second) % size_bits
+
+    def might_contain(self, fingerprints):
+        """
+        This function checks the fingerprints against the filter.
+
+        Args:
+            fingerprints (numpy.ndarray): uint64 fingerprints
+
+        Returns:
+            found (numpy.ndarray): False for the fingerprints that were never added, True for the others
+                                   (added or false positive)
+        """
+
+        found = np.ones(len(fingerprints), dtype=bool)
+        for position in self.positions(fingerprints):
+            found &= ((self.bits[position >> np.uint64(3)] >> (position & np.uint64(7)).astype("uint8")) & 1).astype(bool)
+
+        return found
+
+    def add(self, fingerprints):
+        """
+        This function adds fingerprints to the filter.
+
+        Args:
+            fingerprints (numpy.ndarray): uint64 fingerprints
+        """
+
+        for position in self.positions(fingerprints):
+            np.bitwise_or.at(self.bits, position >> np.uint64(3), np.left_shift(1, position & np.uint64(7)).astype("uint8"))
+
+class DuplicateFilter:
+    """
+    Duplicate-event filter of one day: a Bloom filter in memory and the exact fingerprints on disk.
+    Files are filtered one at a time (filter_file() holds a lock), close() saves the Bloom filter.
+    The source files are keyed on their path relative to the input path, so same-named files of different
+    subdirectories are kept apart.
+    """
+
+    def __init__(self, day_path, input_path, expected_events=10_000_000, false_positive_rate=0.001):
+        os.makedirs(day_path, exist_ok=True)
+        self.day_path = day_path
+        self.input_path = input_path
+        self.lock = threading.Lock()
+        self.bloom = self.load_bloom(*bloom_size(expected_events, false_positive_rate))
+
+    def segment_path(self, source_file):
+        """
+        This function gets the path of the fingerprints kept from a source file. The separators of its relative
+        path are escaped, so every segment of the day stays in the day directory.
+        """
+
+        return os.path.join(self.day_path, f"{quote(source_file, safe='')}{SEGMENT_SUFFIX}")
+
+    def segments(self):
+        """
+        This function lists the source files that have a segment, in name order.
+        """
+
+        return sorted(unquote(name[:-len(SEGMENT_SUFFIX)]) for name in os.listdir(self.day_path) if name.endswith(SEGMENT_SUFFIX))
+
+    def segment_versions(self):
+        """
+        This function gets the version (name and modification time) of every segment of the day.
+        """
+
+        return [f"{source_file}@{os.stat(self.segment_path(source_file)).st_mtime_ns}" for source_file in self.segments()]
+
+    def load_bloom(self, size_bits, hashes):
+        """
+        This function loads the Bloom filter of the day. Segments written or rewritten after the filter was
+        last saved (ex. the run was interrupted) are added again, and the filter is rebuilt when its size changed in the config.
+
+        Args:
+            size_bits (int): Number of bits of the filter
+            hashes (int): Number of hash functions
+
+        Returns:
+            bloom (BloomFilter): Filter covering every segment of the day
+        """
+
+        bloom_path = os.path.join(self.day_path, BLOOM_FILENAME)
+        covered = set()
+        bloom = None
+
+        if os.path.exists(bloom_path):
+            with np.load(bloom_path) as saved:
+                if int(saved["size_bits"]) == size_bits and int(saved["hashes"]) == hashes:
+                    bloom = BloomFilter(size_bits, hashes, saved["bits"].copy())
+                    covered = set(saved["segments"].tolist())
+
+        if bloom is None:
+            bloom = BloomFilter(size_bits, hashes)
+
+        for source_file, version in zip(self.segments(), self.segment_versions()):
+            if version not in covered:
+                bloom.add(np.load(self.segment_path(source_file)))
+
+        return bloom
+
+    def seen_in_other_files(self, own_segments, fingerprints):
+        """
+        This function checks fingerprints against the exact fingerprints of the other files of the day.
+
+        Args:
+            own_segments (set): Segments of the file being filtered (relative path and legacy filename), skipped
+            fingerprints (numpy.ndarray): uint64 fingerprints to check
+
+        Returns:
+            seen (numpy.ndarray): True for the fingerprints kept from another file
+        """
+
+        seen = np.zeros(len(fingerprints), dtype=bool)
+        for other_file in self.segments():
+            if other_file in own_segments:
+                continue
+
+            segment = np.load(self.segment_path(other_file), mmap_mode="r")
+            if len(segment) == 0:
+                continue
+            index = np.minimum(np.searchsorted(segment, fingerprints), len(segment) - 1)
+            seen |= segment[index] == fingerprints
+
+        return seen
+
+    def filter_file(self, file, data):
+        """
+        This function drops the events of a file that were already seen that day, or earlier in the same file.
+
+        Args:
+            file (str): Path of the csv file
+            data (pandas.core.frame.DataFrame): Events of the file
+
+        Returns:
+            data (pandas.core.frame.DataFrame): Events seen for the first time
+        """
+
+        source_file = os.path.relpath(file, self.input_path)
+        # Segments written before the relative paths were used are named after the filename only
+        legacy_file = os.path.basename(file)
+        fingerprints = event_fingerprints(data)
+
+        with self.lock:
+            keep = ~pd.Series(fingerprints).duplicated().to_numpy()
+            candidates = keep & self.bloom.might_contain(fingerprints)
+            if candidates.any():
+                keep[candidates] = ~self.seen_in_other_files({source_file, legacy_file}, fingerprints[candidates])
+
+            kept = np.sort(fingerprints[keep])
+            save_arrays_atomic(self.segment_path(source_file), np.save, kept)
+            if legacy_file != source_file and os.path.exists(self.segment_path(legacy_file)):
+                os.remove(self.segment_path(legacy_file))
+            self.bloom.add(kept)
+
+        dropped = len(data) - len(kept)
+        run_metrics.increment("dedup_checked_events", len(data))
+        run_metrics.increment("dedup_bloom_positives", int(candidates.sum()))
+        run_metrics.increment("dedup_dropped_events", dropped)
+        if dropped:
+            script_log.warning(f"Dropped {dropped} duplicate event(s) from {source_file}.")
+            return data[keep]
+
+        return data
+
+    def close(self):
+        """
+        This function saves the Bloom filter of the day with the list of the segments it covers.
+        """
+
+        with self.lock:
+            save_arrays_atomic(
+                os.path.join(self.day_path, BLOOM_FILENAME), np.savez,
+                bits=self.bloom.bits, size_bits=self.bloom.size_bits, hashes=self.bloom.hashes,
+                segments=np.array(self.segment_versions(), dtype=str),
+            )
+
+def open_duplicate_filter(config, report_date):
+    """
+    This function opens the duplicate-event filter of a day when it is enabled in the config file.
+    The filters are kept in dedup_path, one directory per day (default: a dedup directory in the csv path).
+
+    Args:
+        config (dict): .toml file for the inputs
+        report_date (datetime.date): Day of the run
+
+    Returns:
+        duplicate_filter (DuplicateFilter): Filter of the day, None if the dedup is disabled
+    """
+
+    dedup_config = config.get("dedup", {})
+    if dedup_config.get("enabled", "NO") != "YES":
+        return None
+
+    dedup_path = dedup_config.get("dedup_path", os.path.join(config["directories"]["csv_path"], "dedup"))
+
+    return DuplicateFilter(
+        os.path.join(dedup_path, report_date.isoformat()),
+        config["directories"]["input_path"],
+        dedup_config.get("expected_events_per_day", 10_000_000),
+        dedup_config.get("false_positive_rate", 0.001),
+    )
@@ -0,0 +1,251 @@
+"""
+
+This script contains the compact in-memory event store of recharge_file_reader.py. It is run with:
+
+    python recharge_file_reader.py run --engine compact
+
+It shall:
+1. Hold the events of the day in typed numpy arrays instead of a dataframe of Python object strings:
+       MSIDN            uint64
+       EventDateAndTime uint32 (minutes since 2000-01-01 00:00)
+       ServiceClass     uint16
+       RechargeAmount   uint32
+       EventType        uint8
+       PaymentMethod, Category, Location: dictionary-encoded codes (uint8, widened if a column has more than 255 values)
+   That is about 22 bytes per event.
+2. Compute the Location, Category and PaymentMethod totals with a vectorized groupby-sum over the codes (bincount).
+
+"""
+
+import logging
+from datetime import datetime
+
+import recharge_file_reader as reader
+import reconciliation
+from event_dedup import open_duplicate_filter
+from lazy_imports import LazyModule
+
+np = LazyModule("numpy")
+pd = LazyModule("pandas")
+
+script_log = logging.getLogger("script_handler")
+
+EPOCH = "2000-01-01"
+
+# Numeric columns: (column of the csv, dtype of the store)
+NUMERIC_COLUMNS = {
+    "msidn": ("MSIDN", "uint64"),
+    "event_type": ("EventType", "uint8"),
+    "service_class": ("ServiceClass", "uint16"),
+    "recharge_amount": ("RechargeAmount", "uint32"),
+}
+
+# Dictionary-encoded columns: column of the csv
+CODED_COLUMNS = {
+    "payment_method": "PaymentMethod",
+    "category": "Category",
+    "location": "Location",
+}
+
+def code_dtype(size):
+    """
+    This function gets the smallest unsigned dtype able to hold the codes of a dictionary.
+
+    Args:
+        size (int): Number of values in the dictionary
+
+    Returns:
+        dtype (str): numpy dtype of the codes
+    """
+
+    if size <= 2**8:
+        return "uint8"
+    if size <= 2**16:
+        return "uint16"
+    return "uint32"
+
+class CompactEventStore:
+    """
+    Array-backed store of recharge events. Events are appended per dataframe (ex. per file or chunk);
+    the appended parts are concatenated on first read.
+    """
+
+    __slots__ = ("parts", "columns", "dictionaries", "size")
+
+    def __init__(self):
+        self.parts = []
+        self.columns = {}
+        self.dictionaries = {name: {} for name in CODED_COLUMNS}
+        self.size = 0
+
+    def encode(self, name, values):
+        """
+        This function converts the values of a low-cardinality column to codes, adding new values to its dictionary.
+
+        Args:
+            name (str): One of the keys of CODED_COLUMNS
+            values (pandas.core.series.Series): Values of the column
+
+        Returns:
+            codes (numpy.ndarray): Code of every value
+        """
+
+        dictionary = self.dictionaries[name]
+        for value in pd.unique(values).tolist():
+            if value not in dictionary:
+                dictionary[value] = len(dictionary)
+
+        codes = pd.Categorical(values, categories=list(dictionary)).codes
+        return codes.astype(code_dtype(len(dictionary)))
+
+    def append(self, data):
+        """
+        This function adds the events of a dataframe to the store.
+
+        Args:
+            data (pandas.core.frame.DataFrame): Events with the columns of the EventFile_Recharge files
+        """
+
+        part = {name: data[column].to_numpy().astype(dtype) for name, (column, dtype) in NUMERIC_COLUMNS.items()}
+
+        event_time = reader.parse_event_date_time(data["EventDateAndTime"])
+        part["event_time"] = ((event_time - pd.Timestamp(EPOCH)) // pd.Timedelta(minutes=1)).to_numpy().astype("uint32")
+
+        for name, column in CODED_COLUMNS.items():
+            part[name] = self.encode(name, data[column])
+
+        self.parts.append(part)
+        self.size += len(data)
+
+    def column(self, name):
+        """
+        This function gets a whole column of the store, concatenating the appended parts if needed.
+
+        Args:
+            name (str): Name of the column (ex. "recharge_amount")
+
+        Returns:
+            values (numpy.ndarray): Values of the column
+        """
+
+        if self.parts:
+            for column_name in list(NUMERIC_COLUMNS) + ["event_time"] + list(CODED_COLUMNS):
+                arrays = ([self.columns[column_name]] if column_name in self.columns else []) + [part[column_name] for part in self.parts]
+                if column_name in CODED_COLUMNS:
+                    dtype = code_dtype(len(self.dictionaries[column_name]))
+                    arrays = [array.astype(dtype, copy=False) for array in arrays]
+                self.columns[column_name] = np.concatenate(arrays)
+            self.parts = []
+
+        return self.columns[name]
+
+    def sum_by(self, name, values=None):
+        """
+        This function computes the sum (or the count when values is None) per value of a dictionary-encoded column.
+
+        Args:
+            name (str): One of the keys of CODED_COLUMNS
+            values (numpy.ndarray): Values to sum, None to count the events
+
+        Returns:
+            totals (dict): Total per value of the column
+        """
+
+        codes = self.column(name)
+        keys = list(self.dictionaries[name])
+        if values is None:
+            sums = np.bincount(codes, minlength=len(keys))
+        else:
+            # float64 weights are exact for sums below 2**53
+            sums = np.rint(np.bincount(codes, weights=values, minlength=len(keys))).astype("int64")
+
+        return {key: int(total) for key, total in zip(keys, sums)}
+
+    def partial_totals(self):
+        """
+        This function computes the totals of the three reports, in the format of recharge_file_reader.partial_totals().
+
+        Returns:
+            totals (dict): Total_RechargeAmount per "location" and "category" and Total_Count per "payment_method"
+        """
+
+        if self.size == 0:
+            return reader.merge_partial_totals([])
+
+        recharge_amount = self.column("recharge_amount")
+
+        return {
+            "location": self.sum_by("location", recharge_amount),
+            "category": self.sum_by("category", recharge_amount),
+            "payment_method": self.sum_by("payment_method"),
+        }
+
+    def nbytes(self):
+        """
+        This function gets the memory used by the arrays of the store (the dictionaries are negligible).
+
+        Returns:
+            nbytes (int): Size of the arrays in bytes
+        """
+
+        if self.size == 0:
+            return 0
+
+        return sum(self.column(name).nbytes for name in list(NUMERIC_COLUMNS) + ["event_time"] + list(CODED_COLUMNS))
+
+    def __len__(self):
+        return self.size
+
+def load_files(files, duplicate_filter=None, control_totals=None):
+    """
+    This function reads the files one by one into a compact event store, so the full combined dataframe is never built.
+
+    Args:
+        files (list): List of csv file path
+        duplicate_filter (event_dedup.DuplicateFilter): Drops the events already seen that day, None to keep every event
+        control_totals (reconciliation.ControlTotals): Filled with the control totals of every file, None to skip them
+
+    Returns:
+        store (CompactEventStore): Events of all the files
+    """
+
+    store = CompactEventStore()
+    for file in files:
+        script_log.info(f"Picked up file: {file}")
+        data = reader.read_csv(file)
+        accepted = duplicate_filter.filter_file(file, data) if duplicate_filter is not None else data
+        if control_totals is not None:
+            control_totals.add_file(file, data, accepted)
+        store.append(accepted)
+
+    return store
+
+def run_compact(config, target_date=None):
+    """
+    This function runs the reader with the compact event store.
+
+    Args:
+        config (dict): .toml file for the inputs
+        target_date (datetime): Date of the files to read. Defaults to the current date.
+    """
+
+    report_date = (target_date or datetime.now()).date()
+    csv_path = config["directories"]["csv_path"]
+
+    duplicate_filter = open_duplicate_filter(config, report_date)
+    control_totals = reconciliation.open_control_totals(config)
+    store = load_files(reader.get_csv_files_to_read(reader.import_input_path(config), target_date), duplicate_filter, control_totals)
+    if duplicate_filter is not None:
+        duplicate_filter.close()
+    if len(store):
+        script_log.info(f"Stored {len(store)} event(s) in {store.nbytes()} byte(s) ({store.nbytes() / len(store):.1f} bytes per event).")
+
+    for filename_prefix, dataframe in zip(reader.REPORT_PREFIXES, reader.totals_to_dataframes(store.partial_totals())):
+        reader.save_to_csv(filename_prefix, csv_path, dataframe, reader.import_report_format(config, filename_prefix),
+                           report_date=report_date)
+    script_log.info("Done with the analysis. Refer to the report files for details.\n")
+
+    reader.send_reports_to_database(config, csv_path)
+    if control_totals is not None:
+        reconciliation.reconcile(config, control_totals, report_date)
+    reader.apply_retention(csv_path, config.get("reports", {}).get("retention_days", 0))
@@ -0,0 +1,75 @@
+"""
+
+This script contains the helpers used to keep the start-up of recharge_file_reader.py fast.
+
+It shall:
+1. Provide a module proxy that only imports heavy dependencies (pandas, psycopg2, pyarrow) the first time they are used.
+2. Report the import-time breakdown of these dependencies.
+
+"""
+
+import importlib
+import subprocess
+import sys
+
+HEAVY_MODULES = ["tomli", "pandas", "psycopg2", "pyarrow"]
+
+class LazyModule:
+    """
+    Proxy for a module that is imported on the first attribute access.
+    Submodules that the package does not import itself (ex. psycopg2.sql) are imported on access as well.
+    """
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def _load(self):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return self._module
+
+    def __getattr__(self, attr):
+        module = self._load()
+        try:
+            return getattr(module, attr)
+        except AttributeError:
+            return importlib.import_module(f"{self._name}.{attr}")
+
+    def __repr__(self):
+        state = "loaded" if self._module is not None else "not loaded"
+        return f"<LazyModule '{self._name}' ({state})>"
+
+def import_time_breakdown(modules=None):
+    """
+    This function measures the import time of each module in a fresh interpreter using python -X importtime.
+
+    Args:
+        modules (list): Names of the modules to measure. Defaults to HEAVY_MODULES.
+
+    Returns:
+        breakdown (list): List of (module, cumulative_ms) tuples. cumulative_ms is None if the module is not installed.
+    """
+
+    modules = modules or HEAVY_MODULES
+
+    breakdown = []
+    for module in modules:
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+            capture_output=True,
+            text=True,
+        )
+        if result.returncode != 0:
+            breakdown.append((module, None))
+            continue
+
+        cumulative_ms = None
+        for line in result.stderr.splitlines():
+            # Format: "import time:      self [us] |  cumulative | imported package"
+            parts = line.split("|")
+            if len(parts) == 3 and parts[2].strip() == module:
+                cumulative_ms = int(parts[1].strip()) / 1000
+        breakdown.append((module, cumulative_ms))
+
+    return breakdown
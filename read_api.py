@@ -0,0 +1,261 @@
+"""
+
+This script contains the read API of the daily totals written by recharge_file_reader.py. It is run with:
+
+    python recharge_file_reader.py serve [--host HOST] [--port PORT] [--cache-size N]
+
+It shall:
+1. Serve the Location, Category and PaymentMethod totals of a day as JSON:
+       GET /totals/location?date=YYYY-MM-DD
+       GET /totals/category?date=YYYY-MM-DD
+       GET /totals/payment_method?date=YYYY-MM-DD
+   Without a date, the latest report is served. Days already compacted (report_history.py) are read from their
+   compacted period file.
+2. Keep the computed responses in an LRU cache that is cleared when the reader publishes a new report
+   (the report catalog changes), so hot queries are answered from memory without touching the database.
+3. Answer with 304 Not Modified when the ETag sent in If-None-Match is still current.
+4. Serve the metrics of the last run (chunk sizes, throughput, memory) on GET /metrics.
+
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from datetime import date
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from report_catalog import CATALOG_FILENAME, get_latest_entry, get_reports_for_date
+from report_history import HISTORY_COLUMNS, read_history
+from report_sinks import read_report
+from run_metrics import METRICS_FILENAME
+
+script_log = logging.getLogger("script_handler")
+
+REPORTS = {
+    "location": "total_recharge_per_location",
+    "category": "total_recharge_per_category",
+    "payment_method": "count_per_payment_method",
+}
+
+class ReportCache:
+    """
+    LRU cache of the JSON responses per (report, date). The whole cache is cleared when the modification time
+    of the report catalog changes, which happens every time save_to_csv publishes a report.
+    """
+
+    def __init__(self, csv_path, max_entries=256):
+        self.csv_path = csv_path
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.catalog_version = None
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def current_catalog_version(self):
+        """
+        This function gets the version of the report catalog (its modification time). A stat() only, no query.
+        """
+
+        try:
+            return os.stat(os.path.join(self.csv_path, CATALOG_FILENAME)).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def get(self, report, report_date):
+        """
+        This function gets the response of a report from the cache, computing it on a miss.
+
+        Args:
+            report (str): One of the keys of REPORTS
+            report_date (datetime.date): Day of the report, None for the latest report
+
+        Returns:
+            response (tuple): (etag, body) of the report, None if there is no report for the day
+        """
+
+        key = (report, report_date)
+        catalog_version = self.current_catalog_version()
+
+        with self.lock:
+            if catalog_version != self.catalog_version:
+                self.entries.clear()
+                self.catalog_version = catalog_version
+
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+
+            self.misses += 1
+
+        response = self.compute(report, report_date)
+
+        with self.lock:
+            if self.catalog_version == catalog_version:
+                self.entries[key] = response
+                if len(self.entries) > self.max_entries:
+                    self.entries.popitem(last=False)
+
+        return response
+
+    def compute(self, report, report_date):
+        """
+        This function reads the latest report of the day and builds its JSON response.
+
+        Args:
+            report (str): One of the keys of REPORTS
+            report_date (datetime.date): Day of the report, None for the latest report
+
+        Returns:
+            response (tuple): (etag, body) of the report, None if there is no report for the day
+        """
+
+        filename_prefix = REPORTS[report]
+        if report_date is None:
+            entry = get_latest_entry(self.csv_path, filename_prefix)
+        else:
+            entries = get_reports_for_date(self.csv_path, filename_prefix, report_date)
+            entry = entries[-1] if entries else None
+
+        if entry is not None:
+            dataframe = read_report(entry["path"])
+            written_at = entry["written_at"]
+        elif report_date is not None:
+            # The reports of the day may have been merged in a compacted period file
+            dataframe = read_history(self.csv_path, filename_prefix, report_date, report_date)
+            if dataframe.empty:
+                return None
+            written_at = dataframe["written_at"].iloc[0]
+            dataframe = dataframe.drop(columns=HISTORY_COLUMNS)
+        else:
+            return None
+
+        body = json.dumps({
+            "report": report,
+            "date": entry["report_date"] if entry is not None else report_date.isoformat(),
+            "written_at": written_at,
+            "rows": json.loads(dataframe.to_json(orient="records")),
+        }).encode()
+        etag = f'"{hashlib.sha1(body).hexdigest()}"'
+
+        return etag, body
+
+def make_handler(cache, metrics_path=None):
+    """
+    This function creates the request handler class bound to a cache.
+
+    Args:
+        cache (ReportCache): Cache of the responses
+        metrics_path (str): Metrics file of the last run served on /metrics
+
+    Returns:
+        handler (type): Request handler class for http.server
+    """
+
+    class TotalsHandler(BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            parts = url.path.strip("/").split("/")
+
+            if url.path == "/health":
+                self.send_json(200, {"status": "ok", "cache_entries": len(cache.entries),
+                                     "cache_hits": cache.hits, "cache_misses": cache.misses})
+                return
+
+            if url.path == "/metrics":
+                if metrics_path is None or not os.path.exists(metrics_path):
+                    self.send_json(404, {"error": "No metrics written yet"})
+                    return
+                with open(metrics_path, "r") as metrics_file:
+                    self.send_json(200, json.load(metrics_file))
+                return
+
+            if len(parts) != 2 or parts[0] != "totals" or parts[1] not in REPORTS:
+                self.send_json(404, {"error": f"Unknown path, use /totals/<{'|'.join(REPORTS)}>?date=YYYY-MM-DD"})
+                return
+
+            query = parse_qs(url.query)
+            try:
+                report_date = date.fromisoformat(query["date"][0]) if "date" in query else None
+            except ValueError:
+                self.send_json(400, {"error": "date must be YYYY-MM-DD"})
+                return
+
+            response = cache.get(parts[1], report_date)
+            if response is None:
+                self.send_json(404, {"error": f"No {parts[1]} report for {report_date or 'any day'}"})
+                return
+
+            etag, body = response
+            if self.headers.get("If-None-Match") == etag:
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.end_headers()
+                return
+
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.send_header("ETag", etag)
+            self.send_header("Cache-Control", "no-cache")
+            self.end_headers()
+            self.wfile.write(body)
+
+        def send_json(self, status, data):
+            body = json.dumps(data).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            script_log.info(f"{self.address_string()} - {format % args}")
+
+    return TotalsHandler
+
+def create_server(csv_path, host="127.0.0.1", port=8080, cache_size=256, metrics_path=None):
+    """
+    This function creates the read API server.
+
+    Args:
+        csv_path (dir): Directory of the reports and of the report catalog
+        host (str): Address to listen on
+        port (int): Port to listen on
+        cache_size (int): Maximum number of cached responses
+        metrics_path (str): Metrics file of the last run served on /metrics
+
+    Returns:
+        server (http.server.ThreadingHTTPServer): Server, started with serve_forever()
+    """
+
+    return ThreadingHTTPServer((host, port), make_handler(ReportCache(csv_path, cache_size), metrics_path))
+
+def serve(config, host="127.0.0.1", port=8080, cache_size=256):
+    """
+    This function runs the read API until it is interrupted.
+
+    Args:
+        config (dict): .toml file for the inputs
+        host (str): Address to listen on
+        port (int): Port to listen on
+        cache_size (int): Maximum number of cached responses
+    """
+
+    metrics_path = os.path.join(config["directories"]["log_path"], METRICS_FILENAME)
+    server = create_server(config["directories"]["csv_path"], host, port, cache_size, metrics_path)
+    script_log.info(f"Serving the daily totals on http://{host}:{port}/totals/")
+    try:
+        server.serve_forever()
+
+    except KeyboardInterrupt:
+        pass
+
+    finally:
+        server.server_close()
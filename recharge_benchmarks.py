@@ -0,0 +1,235 @@
+"""
+
+This script contains the benchmark suite of recharge_file_reader.py. It is run with:
+
+    python recharge_file_reader.py bench [--date DDMMYYYY] [--repeat N]
+
+It shall:
+1. Time each stage of the reader (discovery, reading, aggregation, duplicate-event filter, report writing) on the
+   configured input path.
+   With send_to_database enabled, also time the load and the view refresh of the server-side aggregation mode.
+2. Report the best time and the throughput of each stage.
+
+"""
+
+import os
+import shutil
+import tempfile
+import time
+
+import event_dedup
+import recharge_file_reader as reader
+from report_sinks import REPORT_SINKS
+
+def time_call(function, repeat):
+    """
+    This function runs a function several times and keeps the best time.
+
+    Args:
+        function (callable): Function to time, called without arguments
+        repeat (int): Number of runs
+
+    Returns:
+        best_seconds (float): Best time in seconds
+        result: Return value of the last run
+    """
+
+    best_seconds = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - start
+        if best_seconds is None or elapsed < best_seconds:
+            best_seconds = elapsed
+
+    return best_seconds, result
+
+def bench_discovery(context, repeat):
+    """
+    Benchmark of the discovery of the input files. Stores the files found in the context.
+    """
+
+    seconds, files = time_call(lambda: reader.get_csv_files_to_read(context["input_path"], context["target_date"]), repeat)
+    context["files"] = files
+    return seconds, len(files)
+
+def bench_read(context, repeat):
+    """
+    Benchmark of the reading and combining of the input files. Stores the combined dataframe in the context.
+    """
+
+    seconds, combined_df = time_call(lambda: reader.combine_matched_csv(context["files"]), repeat)
+    context["combined_df"] = combined_df
+    return seconds, len(combined_df)
+
+def bench_aggregate(context, repeat):
+    """
+    Benchmark of the three summaries (Location, Category and PaymentMethod).
+    """
+
+    def aggregate():
+        reader.location_and_recharge_df(context["combined_df"])
+        reader.category_and_recharge_df(context["combined_df"])
+        reader.payment_method_df(context["combined_df"])
+
+    seconds, _ = time_call(aggregate, repeat)
+    return seconds, len(context["combined_df"])
+
+def bench_dedup(context, repeat):
+    """
+    Benchmark of the duplicate-event filter (event_dedup.py) on the files of the day, with an empty filter per run
+    sized from the dedup section of the config file. The reading of the files is not timed.
+    """
+
+    dedup_config = context["config"].get("dedup", {})
+    frames = [(file, reader.read_csv(file)) for file in context["files"]]
+    runs = iter(range(repeat))
+
+    def deduplicate():
+        duplicate_filter = event_dedup.DuplicateFilter(
+            os.path.join(context["work_dir"], f"dedup_{next(runs)}"),
+            context["input_path"],
+            dedup_config.get("expected_events_per_day", 10_000_000),
+            dedup_config.get("false_positive_rate", 0.001),
+        )
+        for file, data in frames:
+            duplicate_filter.filter_file(file, data)
+        duplicate_filter.close()
+
+    seconds, _ = time_call(deduplicate, repeat)
+    return seconds, sum(len(data) for _, data in frames)
+
+def make_bench_write(output_format):
+    """
+    This function creates the benchmark of the report writing for one output format.
+
+    Args:
+        output_format (str): One of the keys of REPORT_SINKS
+
+    Returns:
+        bench_write (callable): Benchmark function
+    """
+
+    def bench_write(context, repeat):
+        report = reader.location_and_recharge_df(context["combined_df"])
+        seconds, _ = time_call(
+            lambda: reader.save_to_csv("total_recharge_per_location", context["work_dir"], report, output_format),
+            repeat,
+        )
+        return seconds, len(report)
+
+    return bench_write
+
+def bench_server_load(context, repeat):
+    """
+    Benchmark of the COPY of the raw files into recharge_events (server-side aggregation mode).
+    Only run when the send_to_database operation is enabled.
+    """
+
+    if context["config"]["operation"]["send_to_database"] != "YES":
+        return None
+
+    import server_side_aggregation
+
+    connection = server_side_aggregation.connect_events_db(context["config"])
+    context["events_connection"] = connection
+    seconds, row_count = time_call(lambda: server_side_aggregation.load_files(connection, context["files"], context["input_path"]), repeat)
+    return seconds, row_count
+
+def bench_server_refresh(context, repeat):
+    """
+    Benchmark of the concurrent refresh of the summary views (server-side aggregation mode).
+    """
+
+    connection = context.pop("events_connection", None)
+    if connection is None:
+        return None
+
+    import server_side_aggregation
+
+    try:
+        seconds, _ = time_call(lambda: server_side_aggregation.refresh_summary_views(connection), repeat)
+        return seconds, len(context["combined_df"])
+
+    finally:
+        connection.close()
+
+BENCHMARKS = [
+    ("discovery", bench_discovery),
+    ("read", bench_read),
+    ("aggregate", bench_aggregate),
+    ("dedup", bench_dedup),
+] + [(f"write_{output_format}", make_bench_write(output_format)) for output_format in REPORT_SINKS] + [
+    ("server_load", bench_server_load),
+    ("server_refresh", bench_server_refresh),
+]
+
+def run_benchmarks(config, target_date=None, repeat=3):
+    """
+    This function runs every benchmark of the suite in order. Later benchmarks use the data prepared by
+    the earlier ones (ex. "aggregate" uses the dataframe of "read").
+
+    Args:
+        config (dict): .toml file for the inputs
+        target_date (datetime): Day of the files to read. Defaults to the current date.
+        repeat (int): Number of runs per benchmark, the best run is kept
+
+    Returns:
+        results (list): List of dict with "name", "seconds", "rows" and "rows_per_s"
+    """
+
+    scratch_path = config["directories"].get("scratch_path")
+    if scratch_path is not None:
+        os.makedirs(scratch_path, exist_ok=True)
+    work_dir = tempfile.mkdtemp(prefix="recharge_bench_", dir=scratch_path)
+    context = {
+        "config": config,
+        "input_path": reader.import_input_path(config),
+        "target_date": target_date,
+        "work_dir": work_dir,
+    }
+
+    results = []
+    try:
+        for name, benchmark in BENCHMARKS:
+            try:
+                result = benchmark(context, repeat)
+            except Exception as e:
+                reader.script_log.error(f"Benchmark '{name}' failed: {e}")
+                continue
+
+            # Benchmarks return None when they do not apply to the configuration
+            if result is None:
+                continue
+            seconds, rows = result
+
+            results.append({
+                "name": name,
+                "seconds": seconds,
+                "rows": rows,
+                "rows_per_s": rows / seconds if seconds else None,
+            })
+
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    return results
+
+def format_results(results):
+    """
+    This function formats the benchmark results as a table.
+
+    Args:
+        results (list): Output of run_benchmarks()
+
+    Returns:
+        table (str): Table of the results
+    """
+
+    lines = [f"{'benchmark':<20}{'seconds':>12}{'rows':>12}{'rows/s':>16}"]
+    for result in results:
+        rows_per_s = f"{result['rows_per_s']:,.0f}" if result["rows_per_s"] else "-"
+        lines.append(f"{result['name']:<20}{result['seconds']:>12.4f}{result['rows']:>12}{rows_per_s:>16}")
+
+    return os.linesep.join(lines)
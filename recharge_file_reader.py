@@ -11,28 +11,51 @@ It shall:
     
 """
 
+import argparse
 import logging.handlers
 import os
-import tomli
-import pandas as pd
+import sys
+from contextlib import nullcontext
 from datetime import datetime
+from functools import partial
 import logging
 from logging.handlers import TimedRotatingFileHandler
-import psycopg2
-import psycopg2.sql
+from config_model import ConfigError, format_effective_config, load_config, load_config_with_sources
+from event_dedup import open_duplicate_filter
+from lazy_imports import LazyModule, import_time_breakdown
+from report_catalog import apply_retention, get_latest_entry, record_report
+from report_history import history_day_path
+from report_sinks import REPORT_EXTENSIONS, read_report, update_latest_pointer, write_report_atomic
+from run_profiler import profile_stage, start_profiling, stop_profiling
 
-def import_config_file():
+# pandas and psycopg2 are only imported on the code paths that use them (see lazy_imports.py)
+pd = LazyModule("pandas")
+psycopg2 = LazyModule("psycopg2")
+
+REPORT_PREFIXES = ["total_recharge_per_location", "total_recharge_per_category", "count_per_payment_method"]
+
+# Engines that drop the duplicate events when [dedup] enabled = "YES"
+DEDUP_ENGINES = ("serial", "async", "compact", "incremental")
+# Engines that write a reconciliation report when [reconciliation] enabled = "YES"
+RECONCILIATION_ENGINES = ("serial", "compact")
+
+script_log = logging.getLogger("script_handler")
+
+def import_config_file(config_path=None):
     
     """
     This function will import and initialize the specified config file to the script.
-    This file will give the inputs for the script
+    This file will give the inputs for the script. The profile, the environment overrides and the defaults
+    are applied and the result is validated (see config_model.py).
+
+    Args:
+        config_path (str): Path of the config file. Defaults to recharge_file_config.toml next to the script.
 
     Returns:
         config (dict): .toml config file for the inputs
     """
     
-    with open("recharge_file_config.toml", "rb") as file:
-        config = tomli.load(file)
+    config = load_config(config_path)
         
     return config
 
@@ -124,7 +147,7 @@ def get_base_name(files):
         
     return list_of_basename
 
-def check_filename(files):
+def check_filename(files, target_date=None):
     
     """
     This function checks the filename that has the current date of when the script
@@ -133,12 +156,13 @@ def check_filename(files):
     Args:
         files (list): This argument should be a list containing the filenames
                       to be checked.
+        target_date (datetime): Date to look for instead of the current date (used by backfill)
 
     Returns:
         matched_files (list): Returns a list of matching file names
     """
     
-    current_date = datetime.now()
+    current_date = target_date or datetime.now()
     formatted_date = current_date.strftime("%d%m%Y")
     
     try:
@@ -153,12 +177,13 @@ def check_filename(files):
     except Exception as e:
         script_log.error("An error occured: {e}")
 
-def get_csv_files_to_read(input_path):
+def get_csv_files_to_read(input_path, target_date=None):
     """
     This function will get the csv files in different directories that matches the current date.
 
     Args:
         input_path (dir): Directory of the input path
+        target_date (datetime): Date to look for instead of the current date (used by backfill)
 
     Returns:
         csv_files_to_read (list): Returns a list containing the file path of the csv files
@@ -166,10 +191,11 @@ def get_csv_files_to_read(input_path):
     
     files_in_path = combined_files_per_dir(input_path)
     filenames = get_base_name(files_in_path)
-    matched_files = check_filename(filenames)
+    matched_files = check_filename(filenames, target_date)
 
+    # Same-named files of different directories match the same name, every name is looked up once
     csv_files_to_read = []
-    for file in matched_files:
+    for file in dict.fromkeys(matched_files):
         for file_path in files_in_path:
             if file_path.find(file) != -1:
                 csv_files_to_read.append(file_path)
@@ -191,12 +217,14 @@ def read_csv(file):
     
     return csv
 
-def combine_matched_csv(files):
+def combine_matched_csv(files, duplicate_filter=None, control_totals=None):
     """
     This function will combine all the csv files data in one big df
 
     Args:
         files (list): List of csv file path that matches the current date
+        duplicate_filter (event_dedup.DuplicateFilter): Drops the events already seen that day, None to keep every event
+        control_totals (reconciliation.ControlTotals): Filled with the control totals of every file, None to skip them
 
     Returns:
         combined_df (pandas.core.frame.DataFrame): Returns a data frame with combined data from all the listed csv files
@@ -206,7 +234,10 @@ def combine_matched_csv(files):
         csv_list = []
         for file in files:
             df = read_csv(file)
-            csv_list.append(df)
+            accepted = duplicate_filter.filter_file(file, df) if duplicate_filter is not None else df
+            if control_totals is not None:
+                control_totals.add_file(file, df, accepted)
+            csv_list.append(accepted)
             
         combined_df = pd.concat(csv_list, ignore_index=True)
         
@@ -288,70 +319,188 @@ def payment_method_df(data):
     return payment_method_total
 
 
-def save_to_csv(filename_prefix, csv_path, dataframe):
+def parse_event_date_time(event_date_time):
+    """
+    This function converts the EventDateAndTime column (DDMMYYYYHHMM, read as an integer) to datetimes.
+    The digits are split with integer arithmetic on the whole column instead of parsing strings row by row.
+
+    Args:
+        event_date_time (pandas.core.series.Series): EventDateAndTime column
+
+    Returns:
+        event_time (pandas.core.series.Series): Event times as datetime64
+    """
+    
+    values = event_date_time.astype("int64")
+    
+    return pd.to_datetime(pd.DataFrame({
+        "year": (values // 10**4) % 10**4,
+        "month": (values // 10**8) % 100,
+        "day": values // 10**10,
+        "hour": (values // 100) % 100,
+        "minute": values % 100,
+    }))
+
+def partial_totals(data):
+    """
+    This function computes the partial totals of the three reports for a part of the data (ex. one file).
+    Partial totals of different parts can be merged with merge_partial_totals().
+
+    Args:
+        data (pandas.core.frame.DataFrame): Argument should be a dataframe that contains the data
+
+    Returns:
+        totals (dict): Total_RechargeAmount per "location" and "category" and Total_Count per "payment_method"
+    """
+    
+    return {
+        "location": data.groupby("Location")["RechargeAmount"].sum().to_dict(),
+        "category": data.groupby("Category")["RechargeAmount"].sum().to_dict(),
+        "payment_method": data.groupby("PaymentMethod").size().to_dict(),
+    }
+
+def merge_partial_totals(partials):
+    """
+    This function merges partial totals by summing the values of the same key.
+
+    Args:
+        partials (list): List of partial totals from partial_totals()
+
+    Returns:
+        totals (dict): Merged totals
+    """
+    
+    totals = {"location": {}, "category": {}, "payment_method": {}}
+    for partial in partials:
+        for report, values in partial.items():
+            report_totals = totals[report]
+            for key, value in values.items():
+                report_totals[key] = report_totals.get(key, 0) + int(value)
+    
+    return totals
+
+def totals_to_dataframes(totals):
     """
-    This function will create a csv file for the location_and_total_recharge dataframe
+    This function converts merged totals to the three report dataframes. The dataframes are the same as the ones of
+    location_and_recharge_df(), category_and_recharge_df() and payment_method_df() for the same data.
 
     Args:
+        totals (dict): Totals from partial_totals() or merge_partial_totals()
+
+    Returns:
+        location_and_total_recharge (pandas.core.frame.DataFrame): "Location" and "Total_RechargeAmount"
+        category_and_total_recharge (pandas.core.frame.DataFrame): "Category" and "Total_RechargeAmount"
+        payment_method_total (pandas.core.frame.DataFrame): "PaymentMethod" and "Total_Count"
+    """
+    
+    location_and_total_recharge = pd.DataFrame(sorted(totals["location"].items()), columns=["Location", "Total_RechargeAmount"])
+    category_and_total_recharge = pd.DataFrame(sorted(totals["category"].items()), columns=["Category", "Total_RechargeAmount"])
+    payment_method_total = pd.DataFrame(sorted(totals["payment_method"].items()), columns=["PaymentMethod", "Total_Count"])
+    
+    return location_and_total_recharge, category_and_total_recharge, payment_method_total
+
+def save_to_csv(filename_prefix, csv_path, dataframe, output_format="csv", latest_symlink=True, report_date=None):
+    """
+    This function will create a report file for the summarized dataframe in the history directory of its day
+    (see report_history.py). The file is written atomically, recorded in the report catalog and the "latest"
+    pointer of the report type is updated once the file is complete.
+
+    Args:
+        filename_prefix (str): Prefix of the report file (ex. total_recharge_per_location)
         csv_path (dir): Directory for the csv_file path
         dataframe (pandas.core.frame.DataFrame): Dataframe consisting of "Location" and "Total_RechargeAmount"
+        output_format (str): Report format from the config file (csv, parquet, arrow or jsonl)
+        latest_symlink (bool): Also maintain a <prefix>_latest symlink next to the manifest
+        report_date (datetime.date): Day covered by the report. Defaults to the current date.
+
+    Returns:
+        file_path (str): Path of the written report
     """
     current_date = datetime.now().strftime("%d-%m-%Y_%H-%M-%S")
-    file_name = f"{filename_prefix}_{current_date}.csv"
+    file_name = f"{filename_prefix}_{current_date}{REPORT_EXTENSIONS[output_format]}"
     
-    file_path = os.path.abspath(os.path.join(csv_path, file_name))
-    dataframe.to_csv(file_path, index=False)
+    day_path = history_day_path(csv_path, filename_prefix, report_date or datetime.now().date())
+    os.makedirs(day_path, exist_ok=True)
+    file_path = os.path.abspath(os.path.join(day_path, file_name))
+    write_report_atomic(dataframe, file_path, output_format)
+    record_report(csv_path, filename_prefix, file_path, output_format, len(dataframe), report_date)
+    update_latest_pointer(csv_path, filename_prefix, latest_symlink)
+    
+    return file_path
 
-def create_location_final_data(combined_df, csv_path):
+def import_report_format(config, filename_prefix):
+    """
+    This function will import the output format of a report given in the config file.
+    Reports without an entry in the ["reports"] section are written as csv.
+
+    Args:
+        config (dict): .toml file for the inputs
+        filename_prefix (str): Prefix of the report file (ex. total_recharge_per_location)
+
+    Returns:
+        output_format (str): Output format of the report
+    """
+    
+    output_format = config.get("reports", {}).get(filename_prefix, "csv")
+    
+    return output_format
+
+def create_location_final_data(combined_df, csv_path, output_format="csv", report_date=None):
     """
     This function will run different functions to create the summarized data and save it to csv.
 
     Args:
         combined_df (dataframe): Combined data from all directories
         csv_path (dir): File path for the csv file
+        output_format (str): Report format (csv, parquet, arrow or jsonl)
+        report_date (datetime.date): Day covered by the report. Defaults to the current date.
     """
     
     script_log.info("Analyzing 'Location' and 'RechargeAmount' data...")
     
     location_and_total_recharge_data = location_and_recharge_df(combined_df)
     filename_prefix = "total_recharge_per_location"
-    save_to_csv(filename_prefix,csv_path, location_and_total_recharge_data)
+    save_to_csv(filename_prefix, csv_path, location_and_total_recharge_data, output_format, report_date=report_date)
     
-    script_log.info("Done with the analysis. Refer to the csv file for details.\n")
+    script_log.info("Done with the analysis. Refer to the report file for details.\n")
 
-def create_category_final_data(combined_df, csv_path):
+def create_category_final_data(combined_df, csv_path, output_format="csv", report_date=None):
     """
     This function will run different functions to create the summarized data and save it to csv.
 
     Args:
         combined_df (dataframe): Combined data from all directories
         csv_path (dir): File path for the csv file
+        output_format (str): Report format (csv, parquet, arrow or jsonl)
+        report_date (datetime.date): Day covered by the report. Defaults to the current date.
     """
     
     script_log.info("Analyzing 'Category' and 'RechargeAmount' data...")
     
     category_and_total_recharge_data = category_and_recharge_df(combined_df)
     filename_prefix = "total_recharge_per_category"
-    save_to_csv(filename_prefix,csv_path, category_and_total_recharge_data)
+    save_to_csv(filename_prefix, csv_path, category_and_total_recharge_data, output_format, report_date=report_date)
     
-    script_log.info("Done with the analysis. Refer to the csv file for details.\n")
+    script_log.info("Done with the analysis. Refer to the report file for details.\n")
     
-def create_paymentmethod_final_data(combined_df, csv_path):
+def create_paymentmethod_final_data(combined_df, csv_path, output_format="csv", report_date=None):
     """
     This function will run different functions to create the summarized data and save it to csv.
 
     Args:
         combined_df (dataframe): Combined data from all directories
         csv_path (dir): File path for the csv file
+        output_format (str): Report format (csv, parquet, arrow or jsonl)
+        report_date (datetime.date): Day covered by the report. Defaults to the current date.
     """
     
     script_log.info("Analyzing 'PaymentMethod' data...")
     
     payment_method_count = payment_method_df(combined_df)
     filename_prefix = "count_per_payment_method"
-    save_to_csv(filename_prefix,csv_path, payment_method_count)
+    save_to_csv(filename_prefix, csv_path, payment_method_count, output_format, report_date=report_date)
     
-    script_log.info("Done with the analysis. Refer to the csv file for details.\n")
+    script_log.info("Done with the analysis. Refer to the report file for details.\n")
 
 def initialize_logger(log_path, log_filename, logger_type):
     """
@@ -467,6 +616,28 @@ def create_recharge_file_stats_db(db_name, cursor, connection):
         cursor.close()
         connection.close()
  
+def open_stats_db(config, db_name="recharge_file_stats_db"):
+    """
+    This function connects to the recharge file stats database, created if needed. An unreachable database server
+    is logged and None is returned, so the caller can carry on without the database like send_reports_to_database.
+
+    Args:
+        config (dict): .toml file for the inputs
+        db_name (str): Name of the recharge file stats database
+
+    Returns:
+        connection (psycopg2.extensions.connection): Connection to the database, None if it could not be opened
+    """
+    
+    db_connection = connect_to_db(config)
+    if db_connection is None:
+        script_log.error(f"Could not connect to the database server, nothing is sent to '{db_name}'.\n")
+        return None
+    
+    create_recharge_file_stats_db(db_name, open_cursor_db(db_connection), db_connection)
+    
+    return connect_to_new_db(db_name, config)
+
 def connect_to_new_db(db_name, config):   
     """
     This function will create a new connection to the newly created database for recharge file stats.
@@ -530,38 +701,49 @@ def create_table_locations_stats(cursor):
         
         script_log.info("Creating table...")
         table_name = "total_recharge_amount_per_location"
-        query = f"CREATE TABLE IF NOT EXISTS {table_name} (id SERIAL PRIMARY KEY, Location VARCHAR(255), Total_RechargeAmount INT);"
+        query = f"CREATE TABLE IF NOT EXISTS {table_name} (id SERIAL PRIMARY KEY, Location VARCHAR(255), Total_RechargeAmount INT, report_id INT);"
         script_log.info(f"Executing query to create table '{table_name}' if not exists.")
         
         cursor.execute(query)
+        # Tables created before the rows were tagged with the report they come from
+        cursor.execute(f"ALTER TABLE {table_name} ADD COLUMN IF NOT EXISTS report_id INT;")
         
         script_log.info("Table created or already exists.")
         
     except Exception as e:
         script_log.error(f"An error occured: {e}\n")
 
-def insert_location_data(csv_file, connection):
+def insert_location_data(csv_file, connection, report_id=None):
     """
     This function inserts the location data to the table.
 
     Args:
-        csv_file (file): CSV file outputted by the script
+        csv_file (file): Report file outputted by the script (csv, parquet, arrow or jsonl)
         connection (psycopg2.extensions.connection): Connection to the database
+        report_id (int): Id of the report in the report catalog, stored with every row
+
+    Returns:
+        loaded (bool): True once the rows are committed, False if the insert failed
     """
     try:
         cursor = connection.cursor()
         
-        df = pd.read_csv(csv_file)
+        df = read_report(csv_file)
         table = "total_recharge_amount_per_location"
         for index, row in df.iterrows():
-            query = f"INSERT INTO {table} (Location, Total_RechargeAmount) VALUES (%s, %s);"
-            cursor.execute(query, (row["Location"], row["Total_RechargeAmount"]))
+            query = f"INSERT INTO {table} (Location, Total_RechargeAmount, report_id) VALUES (%s, %s, %s);"
+            cursor.execute(query, (row["Location"], row["Total_RechargeAmount"], report_id))
         
         connection.commit()
         script_log.info(f"Successfully inserted data from {csv_file} into '{table}' table\n")
+        
+        return True
     
     except Exception as e:
         script_log.error(f"Error inserting data into database: {e}\n")
+        connection.rollback()
+        
+        return False
     
     finally:
         cursor.close()
@@ -578,39 +760,50 @@ def create_table_category_stats(cursor):
         
         script_log.info("Creating table...")
         table_name = "total_recharge_amount_per_category"
-        query = f"CREATE TABLE IF NOT EXISTS {table_name} (id SERIAL PRIMARY KEY, Category VARCHAR(255), Total_RechargeAmount INT);"
+        query = f"CREATE TABLE IF NOT EXISTS {table_name} (id SERIAL PRIMARY KEY, Category VARCHAR(255), Total_RechargeAmount INT, report_id INT);"
         script_log.info(f"Executing query to create table '{table_name}' if not exists.")
         
         cursor.execute(query)
+        # Tables created before the rows were tagged with the report they come from
+        cursor.execute(f"ALTER TABLE {table_name} ADD COLUMN IF NOT EXISTS report_id INT;")
         
         script_log.info("Table created or already exists.")
         
     except Exception as e:
         script_log.error(f"An error occured: {e}\n")
 
-def insert_category_data(csv_file, connection):
+def insert_category_data(csv_file, connection, report_id=None):
     """
     This function inserts the location data to the table.
 
     Args:
-        csv_file (file): CSV file outputted by the script
+        csv_file (file): Report file outputted by the script (csv, parquet, arrow or jsonl)
         connection (psycopg2.extensions.connection): Connection to the database
+        report_id (int): Id of the report in the report catalog, stored with every row
+
+    Returns:
+        loaded (bool): True once the rows are committed, False if the insert failed
     """
     try:
         cursor = connection.cursor()
         
-        df = pd.read_csv(csv_file)
+        df = read_report(csv_file)
         table = "total_recharge_amount_per_category"
         
         for index, row in df.iterrows():
-            query = f"INSERT INTO {table} (Category, Total_RechargeAmount) VALUES (%s, %s);"
-            cursor.execute(query, (row["Category"], row["Total_RechargeAmount"]))
+            query = f"INSERT INTO {table} (Category, Total_RechargeAmount, report_id) VALUES (%s, %s, %s);"
+            cursor.execute(query, (row["Category"], row["Total_RechargeAmount"], report_id))
         
         connection.commit()
         script_log.info(f"Successfully inserted data from {csv_file} into '{table}' table\n")
+        
+        return True
     
     except Exception as e:
         script_log.error(f"Error inserting data into database: {e}\n")
+        connection.rollback()
+        
+        return False
     
     finally:
         connection.commit()
@@ -628,44 +821,76 @@ def create_table_payment_method_stats(cursor):
         
         script_log.info("Creating table...")
         table_name = "payment_method_count"
-        query = f"CREATE TABLE IF NOT EXISTS {table_name} (id SERIAL PRIMARY KEY, PaymentMethod VARCHAR(255), Total_Count INT);"
+        query = f"CREATE TABLE IF NOT EXISTS {table_name} (id SERIAL PRIMARY KEY, PaymentMethod VARCHAR(255), Total_Count INT, report_id INT);"
         script_log.info(f"Executing query to create table '{table_name}' if not exists.")
         
         cursor.execute(query)
+        # Tables created before the rows were tagged with the report they come from
+        cursor.execute(f"ALTER TABLE {table_name} ADD COLUMN IF NOT EXISTS report_id INT;")
         
         script_log.info("Table created or already exists.")
         
     except Exception as e:
         script_log.error(f"An error occured: {e}\n")
 
-def insert_payment_method_data(csv_file, connection):
+def insert_payment_method_data(csv_file, connection, report_id=None):
     """
     This function inserts the paymentmethod data to the table.
 
     Args:
-        csv_file (file): CSV file outputted by the script
+        csv_file (file): Report file outputted by the script (csv, parquet, arrow or jsonl)
         connection (psycopg2.extensions.connection): Connection to the database
+        report_id (int): Id of the report in the report catalog, stored with every row
+
+    Returns:
+        loaded (bool): True once the rows are committed, False if the insert failed
     """
     try:
         cursor = connection.cursor()
         
-        df = pd.read_csv(csv_file)
+        df = read_report(csv_file)
         table = "payment_method_count"
         
         for index, row in df.iterrows():
-            query = f"INSERT INTO {table} (PaymentMethod, Total_Count) VALUES (%s, %s);"
-            cursor.execute(query, (str(row["PaymentMethod"]), int(row["Total_Count"])))
+            query = f"INSERT INTO {table} (PaymentMethod, Total_Count, report_id) VALUES (%s, %s, %s);"
+            cursor.execute(query, (str(row["PaymentMethod"]), int(row["Total_Count"]), report_id))
         
         connection.commit()
         script_log.info(f"Successfully inserted data from {csv_file} into '{table}' table\n")
+        
+        return True
     
     except Exception as e:
         script_log.error(f"Error inserting data into database: {e}\n")
+        connection.rollback()
+        
+        return False
     
     finally:
         connection.commit()
         cursor.close()
 
+def get_latest_report(csv_path, filename_prefix):
+    """
+    This function gets the latest report of a report type and its id in the report catalog written by save_to_csv.
+    Both come from the same catalog entry, so the rows loaded from the report are tagged with the id of the run
+    that wrote it even when another run records a report in the meantime.
+
+    Args:
+        csv_path (dir): Directory of the report catalog
+        filename_prefix (str): Prefix of the report file (ex. total_recharge_per_location)
+
+    Returns:
+        latest_report (str): Path of the latest report, None if the catalog has no report of this type
+        report_id (int): Id of the latest report, None if the catalog has no report of this type
+    """
+    
+    latest_entry = get_latest_entry(csv_path, filename_prefix)
+    if latest_entry is None or not os.path.exists(latest_entry["path"]):
+        return None, None
+    
+    return latest_entry["path"], latest_entry["id"]
+
 def execute_location_data_functions(new_cursor, csv_path, new_connection):
     """
     This function executes functions to handle the insertion of data from the summarized location data
@@ -674,14 +899,18 @@ def execute_location_data_functions(new_cursor, csv_path, new_connection):
         new_cursor (psycopg2.extensions.cursor): Cursor created to execute a command
         csv_path (dir): Directory to get the csv file
         new_connection (psycopg2.extensions.connection): Connection to the database
+
+    Returns:
+        loaded (bool): True once the rows are committed, False if the insert failed
     """
     
     create_table_locations_stats(new_cursor)
-    latest_csv_file = max(
-        [os.path.join(csv_path, f) for f in os.listdir(csv_path) if f.startswith("total_recharge_per_location")],
-        key=os.path.getctime
-        )
-    insert_location_data(latest_csv_file, new_connection)
+    latest_csv_file, report_id = get_latest_report(csv_path, "total_recharge_per_location")
+    if latest_csv_file is None:
+        script_log.error("No total_recharge_per_location report in the report catalog, nothing to insert.\n")
+        return False
+    
+    return insert_location_data(latest_csv_file, new_connection, report_id)
 
 def execute_category_data_functions(new_cursor, csv_path, new_connection):
     """
@@ -691,14 +920,18 @@ def execute_category_data_functions(new_cursor, csv_path, new_connection):
         new_cursor (psycopg2.extensions.cursor): Cursor created to execute a command
         csv_path (dir): Directory to get the csv file
         new_connection (psycopg2.extensions.connection): Connection to the database
+
+    Returns:
+        loaded (bool): True once the rows are committed, False if the insert failed
     """
     
     create_table_category_stats(new_cursor)
-    latest_csv_file = max(
-        [os.path.join(csv_path, f) for f in os.listdir(csv_path) if f.startswith("total_recharge_per_category")],
-        key=os.path.getctime
-        )
-    insert_category_data(latest_csv_file, new_connection)
+    latest_csv_file, report_id = get_latest_report(csv_path, "total_recharge_per_category")
+    if latest_csv_file is None:
+        script_log.error("No total_recharge_per_category report in the report catalog, nothing to insert.\n")
+        return False
+    
+    return insert_category_data(latest_csv_file, new_connection, report_id)
 
 def execute_paymentmethod_data_functions(new_cursor, csv_path, new_connection):
     """
@@ -708,43 +941,90 @@ def execute_paymentmethod_data_functions(new_cursor, csv_path, new_connection):
         new_cursor (psycopg2.extensions.cursor): Cursor created to execute a command
         csv_path (dir): Directory to get the csv file
         new_connection (psycopg2.extensions.connection): Connection to the database
+
+    Returns:
+        loaded (bool): True once the rows are committed, False if the insert failed
     """
     
     create_table_payment_method_stats(new_cursor)
-    latest_csv_file = max(
-        [os.path.join(csv_path, f) for f in os.listdir(csv_path) if f.startswith("count_per_payment_method")],
-        key=os.path.getctime
-        )
-    insert_payment_method_data(latest_csv_file, new_connection)
+    latest_csv_file, report_id = get_latest_report(csv_path, "count_per_payment_method")
+    if latest_csv_file is None:
+        script_log.error("No count_per_payment_method report in the report catalog, nothing to insert.\n")
+        return False
+    
+    return insert_payment_method_data(latest_csv_file, new_connection, report_id)
 
-def main():
+def execute_batch_data_functions(create_table, filename_prefix, table, columns, new_cursor, csv_path, new_connection):
+    """
+    This function inserts the latest report of a type in one statement (psycopg2 execute_values) instead of
+    one INSERT per row. Used when the loader of the config file is "batch".
+
+    Args:
+        create_table (callable): Function creating the table (ex. create_table_locations_stats)
+        filename_prefix (str): Prefix of the report file (ex. total_recharge_per_location)
+        table (str): Name of the table
+        columns (list): Columns of the report, in the order of the table
+        new_cursor (psycopg2.extensions.cursor): Cursor created to execute a command
+        csv_path (dir): Directory to get the csv file
+        new_connection (psycopg2.extensions.connection): Connection to the database
+
+    Returns:
+        loaded (bool): True once the rows are committed, False without a report. A failed insert raises.
+    """
     
-    config = import_config_file()
-    input_path = import_input_path(config)
-    log_path = import_log_path(config)
+    create_table(new_cursor)
+    latest_csv_file, report_id = get_latest_report(csv_path, filename_prefix)
+    if latest_csv_file is None:
+        script_log.error(f"No {filename_prefix} report in the report catalog, nothing to insert.\n")
+        return False
     
-    csv_files_to_read = get_csv_files_to_read(input_path)
-    combined_df = combine_matched_csv(csv_files_to_read)
-    send_to_database_operation = config["operation"]["send_to_database"]
-    csv_path = config["directories"]["csv_path"]
+    df = read_report(latest_csv_file)
     
-    try:
-        create_location_final_data(combined_df, csv_path)
-    except Exception as e:
-        script_log.error(f"An error occured while analyzing 'Location' and 'RechargeAmount' data: {e}\n")
+    psycopg2.extras.execute_values(
+        new_cursor,
+        f"INSERT INTO {table} ({', '.join(columns)}, report_id) VALUES %s;",
+        [(str(key), int(value), report_id) for key, value in df[columns].itertuples(index=False)],
+    )
+    new_connection.commit()
+    script_log.info(f"Successfully inserted {len(df)} row(s) from {latest_csv_file} into '{table}' table\n")
     
-    try:    
-        create_category_final_data(combined_df, csv_path)
-    except Exception as e:
-        script_log.error(f"An error occured while analyzing 'Category' and 'RechargeAmount' data: {e}\n")
+    return True
+
+DB_LOADERS = [
+    ("location", execute_location_data_functions),
+    ("category", execute_category_data_functions),
+    ("payment_method", execute_paymentmethod_data_functions),
+]
+
+DB_BATCH_LOADERS = [
+    ("location", partial(execute_batch_data_functions, create_table_locations_stats, "total_recharge_per_location",
+                         "total_recharge_amount_per_location", ["Location", "Total_RechargeAmount"])),
+    ("category", partial(execute_batch_data_functions, create_table_category_stats, "total_recharge_per_category",
+                         "total_recharge_amount_per_category", ["Category", "Total_RechargeAmount"])),
+    ("payment_method", partial(execute_batch_data_functions, create_table_payment_method_stats, "count_per_payment_method",
+                               "payment_method_count", ["PaymentMethod", "Total_Count"])),
+]
+
+def send_reports_to_database(config, csv_path, skip_loaders=(), on_loaded=None):
+    """
+    This function loads the latest reports to the recharge file stats database when the send_to_database
+    operation is enabled.
+
+    Args:
+        config (dict): .toml file for the inputs
+        csv_path (dir): Directory to get the report files
+        skip_loaders (tuple): Names of the DB_LOADERS already done (used when resuming a run)
+        on_loaded (callable): Called with the name of each loader once its data is committed
+
+    Returns:
+        loaded (list): Names of the loaders whose data was committed by this call
+    """
     
-    try:
-        create_paymentmethod_final_data(combined_df, csv_path)
-    except Exception as e:
-        script_log.error(f"An error occured while analyzing 'Payment' data: {e}\n")
+    send_to_database_operation = config["operation"]["send_to_database"]
     
     new_cursor = None
     new_connection = None
+    loaded = []
     
     if send_to_database_operation == "YES":
         
@@ -763,11 +1043,21 @@ def main():
                 new_connection = connect_to_new_db(db_name, config)
                 new_cursor = cursor_for_new_db(new_connection)
                 
-                execute_location_data_functions(new_cursor, csv_path, new_connection)
-                execute_category_data_functions(new_cursor, csv_path, new_connection)
-                execute_paymentmethod_data_functions(new_cursor, csv_path, new_connection)
-                
-                new_connection.commit()
+                loaders = DB_BATCH_LOADERS if config["database"].get("loader", "rows") == "batch" else DB_LOADERS
+                for loader_name, loader in loaders:
+                    if loader_name in skip_loaders:
+                        script_log.info(f"Skipping '{loader_name}' data, it was already loaded.")
+                        continue
+                    
+                    # A loader returns False when its insert failed, the load is then not marked as done
+                    if not loader(new_cursor, csv_path, new_connection):
+                        script_log.error(f"Loading '{loader_name}' data failed.")
+                        continue
+                    
+                    new_connection.commit()
+                    loaded.append(loader_name)
+                    if on_loaded is not None:
+                        on_loaded(loader_name)
             
             except Exception as e:
                 script_log.error(f"An error occured while creating a new connection or new cursor: {e}\n")
@@ -789,18 +1079,394 @@ def main():
         script_log.info(f"Operation send_to_database: {send_to_database_operation}")
         script_log.info("Skipping copying of files to postgres database...\n")
     
-if __name__ == "__main__":
-    config = import_config_file()
+    return loaded
+
+def main(target_date=None, config=None):
+    
+    import reconciliation
+    
+    if config is None:
+        config = import_config_file()
+    input_path = import_input_path(config)
+    log_path = import_log_path(config)
+    report_date = (target_date or datetime.now()).date()
+    
+    with profile_stage("discovery"):
+        csv_files_to_read = get_csv_files_to_read(input_path, target_date)
+    
+    with profile_stage("read"):
+        duplicate_filter = open_duplicate_filter(config, report_date)
+        control_totals = reconciliation.open_control_totals(config)
+        combined_df = combine_matched_csv(csv_files_to_read, duplicate_filter, control_totals)
+        if duplicate_filter is not None:
+            duplicate_filter.close()
+    csv_path = config["directories"]["csv_path"]
+    
+    try:
+        with profile_stage("location_report"):
+            create_location_final_data(combined_df, csv_path, import_report_format(config, "total_recharge_per_location"), report_date)
+    except Exception as e:
+        script_log.error(f"An error occured while analyzing 'Location' and 'RechargeAmount' data: {e}\n")
+    
+    try:    
+        with profile_stage("category_report"):
+            create_category_final_data(combined_df, csv_path, import_report_format(config, "total_recharge_per_category"), report_date)
+    except Exception as e:
+        script_log.error(f"An error occured while analyzing 'Category' and 'RechargeAmount' data: {e}\n")
+    
+    try:
+        with profile_stage("payment_method_report"):
+            create_paymentmethod_final_data(combined_df, csv_path, import_report_format(config, "count_per_payment_method"), report_date)
+    except Exception as e:
+        script_log.error(f"An error occured while analyzing 'Payment' data: {e}\n")
+    
+    try:
+        with profile_stage("retention"):
+            apply_retention(csv_path, config.get("reports", {}).get("retention_days", 0))
+    except Exception as e:
+        script_log.error(f"An error occured while applying the report retention: {e}\n")
+    
+    with profile_stage("database"):
+        send_reports_to_database(config, csv_path)
+    
+    if control_totals is not None:
+        try:
+            with profile_stage("reconciliation"):
+                reconciliation.reconcile(config, control_totals, report_date)
+        except Exception as e:
+            script_log.error(f"An error occured during the reconciliation: {e}\n")
+
+def positive_int(value):
+    """
+    This function converts a command line value to an integer of at least 1 (argparse type).
+    """
+    
+    try:
+        number = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"'{value}' is not an integer")
+    
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {number}")
+    
+    return number
+
+def parse_arguments(argv):
+    """
+    This function parses the command line of the script. Running the script without a command is the same as "run".
+
+    Args:
+        argv (list): Command line arguments without the script name
+
+    Returns:
+        arguments (argparse.Namespace): Parsed arguments
+    """
+    
+    parser = argparse.ArgumentParser(prog="recharge_file_reader", description="Recharge file reader")
+    parser.add_argument("--config", help="Path of the config file. Defaults to recharge_file_config.toml next to the script "
+                                         "(or RECHARGE_CONFIG).")
+    subparsers = parser.add_subparsers(dest="command")
+    
+    run_parser = subparsers.add_parser("run", help="Read today's recharge files and write the reports")
+    
+    backfill_parser = subparsers.add_parser("backfill", help="Read the recharge files of a past day and write its reports")
+    backfill_parser.add_argument("--date", required=True, help="Day to backfill (DDMMYYYY)")
+    
+    for ingest_parser in [run_parser, backfill_parser]:
+        ingest_parser.add_argument("--engine", choices=["serial", "async", "streaming", "server", "compact", "incremental"], default="serial",
+                                   help="serial: one stage after the other, async: overlapping stages (async_pipeline.py), "
+                                        "streaming: chunked and resumable (streaming_reader.py), "
+                                        "server: raw events aggregated in Postgres (server_side_aggregation.py), "
+                                        "compact: dictionary-encoded in-memory event store (event_store.py), "
+                                        "incremental: events attributed to their own day with corrections (daily_attribution.py)")
+        ingest_parser.add_argument("--readers", type=positive_int, help="Number of concurrent readers of the async engine. "
+                                                                "Defaults to the workers of the config file.")
+        ingest_parser.add_argument("--profile", nargs="?", const="cprofile", choices=["cprofile", "sampling"],
+                                   help="Profile the stages of the run (cProfile, or pyinstrument with 'sampling') and "
+                                        "trace their allocations. The profiles are written in the profiles directory of the log path.")
+    
+    bench_parser = subparsers.add_parser("bench", help="Time each stage of the reader")
+    bench_parser.add_argument("--date", help="Day of the files to read (DDMMYYYY). Defaults to the current date.")
+    bench_parser.add_argument("--repeat", type=int, default=3, help="Number of runs per benchmark")
+    
+    distributed_parser = subparsers.add_parser("distributed", help="Coordinator/worker mode backed by a Postgres job table")
+    distributed_parser.add_argument("action", choices=["publish", "work", "finalize", "local"],
+                                    help="publish: queue the files of the day, work: process queued files, "
+                                         "finalize: merge the partial totals and write the reports, local: all of them with local workers")
+    distributed_parser.add_argument("--date", help="Day of the files (DDMMYYYY). Defaults to the current date.")
+    distributed_parser.add_argument("--workers", type=positive_int, help="Number of local worker processes (local only). "
+                                                                "Defaults to the workers of the config file.")
+    distributed_parser.add_argument("--worker-id", help="Name of the worker (work only). Defaults to <hostname>-<pid>.")
+    
+    serve_parser = subparsers.add_parser("serve", help="Serve the daily totals over HTTP (read_api.py)")
+    serve_parser.add_argument("--host", default="127.0.0.1", help="Address to listen on")
+    serve_parser.add_argument("--port", type=int, default=8080, help="Port to listen on")
+    serve_parser.add_argument("--cache-size", type=int, default=256, help="Maximum number of cached responses")
+    
+    rolling_parser = subparsers.add_parser("rolling", help="Update the rolling 5-minute and 1-hour totals with the new files (rolling_totals.py)")
+    rolling_parser.add_argument("--date", help="Day of the files to read (DDMMYYYY). Defaults to the current date.")
+    rolling_parser.add_argument("--interval", type=float, default=0, help="Seconds between two polls of the input path, 0 for a single pass")
+    
+    compact_parser = subparsers.add_parser("compact", help="Merge the old reports into one file per report and month (report_history.py)")
+    compact_parser.add_argument("--older-than-days", type=int, help="Compact the reports of the days older than this. "
+                                                                      "Defaults to compact_after_days of the config file.")
+    compact_parser.add_argument("--format", choices=["parquet", "arrow"], help="Format of the compacted files. "
+                                                                               "Defaults to compact_format of the config file.")
+    
+    config_parser = subparsers.add_parser("config", help="Show the config file")
+    config_parser.add_argument("action", choices=["show"])
+    config_parser.add_argument("--effective", action="store_true",
+                               help="Show the validated config with the profile, the environment overrides and the defaults applied")
+    
+    subparsers.add_parser("status", help="Show the latest report of each type")
+    subparsers.add_parser("imports", help="Show the import-time breakdown of the heavy dependencies")
+    
+    arguments = parser.parse_args(argv)
+    if arguments.command is None:
+        arguments = parser.parse_args(argv + ["run"])
+    
+    return arguments
+
+def parse_date_argument(date_argument):
+    """
+    This function parses a DDMMYYYY command line date.
+
+    Args:
+        date_argument (str): Date given in the command line
+
+    Returns:
+        target_date (datetime): Parsed date, None if no date was given
+    """
+    
+    if date_argument is None:
+        return None
+    
+    return datetime.strptime(date_argument, "%d%m%Y")
+
+def start_script_log(config, log_name):
+    """
+    This function initializes the script log and writes the start banner.
+
+    Args:
+        config (dict): .toml file for the inputs
+        log_name (str): Base name of the log file
+    """
+    
     log_path = import_log_path(config)
     current_date = datetime.now().strftime("%d-%m-%Y_%H-%M-%S")
-    script_log = initialize_logger(log_path, f"recharge_file_reader - {current_date}.log", "script_handler")
+    initialize_logger(log_path, f"{log_name} - {current_date}.log", "script_handler")
     
     script_log.info("##############################################################################")
     script_log.info("Script is called...")
     script_log.info("##############################################################################\n")
+
+def show_status(config):
+    """
+    This function prints the latest report of each report type from the report catalog.
+    It does not import pandas or psycopg2.
+
+    Args:
+        config (dict): .toml file for the inputs
+    """
     
-    main()
+    csv_path = config["directories"]["csv_path"]
+    for filename_prefix in REPORT_PREFIXES:
+        entry = get_latest_entry(csv_path, filename_prefix)
+        if entry is None:
+            print(f"{filename_prefix}: no report yet")
+        else:
+            print(f"{filename_prefix}: {entry['path']} ({entry['format']}, {entry['row_count']} rows, "
+                  f"date {entry['report_date']}, written {entry['written_at']})")
+
+def show_config(config_path=None, effective=False):
+    """
+    This function prints the config file, or the effective config with the source of every value.
+
+    Args:
+        config_path (str): Path of the config file. Defaults to recharge_file_config.toml next to the script.
+        effective (bool): Print the effective config instead of the file
+    """
+    
+    try:
+        config, sources = load_config_with_sources(config_path)
+    except ConfigError as e:
+        sys.exit(str(e))
+    
+    if effective:
+        print(format_effective_config(config, sources))
+    else:
+        with open(config["config_path"], "r") as file:
+            print(f"# {config['config_path']}")
+            print(file.read())
+
+def show_import_times():
+    """
+    This function prints the import-time breakdown of the heavy dependencies.
+    """
+    
+    for module, cumulative_ms in import_time_breakdown():
+        if cumulative_ms is None:
+            print(f"{module:<12} not installed")
+        else:
+            print(f"{module:<12} {cumulative_ms:>10.1f} ms")
+
+def cli(argv=None):
+    """
+    Entry point of the script.
+
+    Args:
+        argv (list): Command line arguments without the script name. Defaults to sys.argv[1:].
+    """
+    
+    arguments = parse_arguments(sys.argv[1:] if argv is None else argv)
+    
+    if arguments.command == "imports":
+        show_import_times()
+        return
+    
+    if arguments.command == "config":
+        show_config(arguments.config, arguments.effective)
+        return
+    
+    try:
+        config = import_config_file(arguments.config)
+    except ConfigError as e:
+        sys.exit(str(e))
+    
+    if arguments.command == "status":
+        show_status(config)
+        return
+    
+    if arguments.command == "serve":
+        import read_api
+        
+        start_script_log(config, "recharge_read_api")
+        read_api.serve(config, arguments.host, arguments.port, arguments.cache_size)
+        return
+    
+    if arguments.command == "bench":
+        import recharge_benchmarks
+        
+        start_script_log(config, "recharge_file_reader_bench")
+        results = recharge_benchmarks.run_benchmarks(config, parse_date_argument(arguments.date), arguments.repeat)
+        print(recharge_benchmarks.format_results(results))
+        return
+    
+    if arguments.command == "rolling":
+        import rolling_totals
+        
+        start_script_log(config, "recharge_rolling_totals")
+        rolling_totals.run_rolling(config, parse_date_argument(arguments.date), arguments.interval)
+        return
+    
+    if arguments.command == "compact":
+        import report_history
+        
+        start_script_log(config, "recharge_report_compaction")
+        older_than_days = config["history"]["compact_after_days"] if arguments.older_than_days is None else arguments.older_than_days
+        report_history.compact_history(config["directories"]["csv_path"], older_than_days,
+                                       arguments.format or config["history"]["compact_format"])
+        return
+    
+    if arguments.command == "distributed":
+        import distributed_ingest
+        
+        try:
+            check_dedup_engine(config, "distributed")
+        except ConfigError as e:
+            sys.exit(str(e))
+        
+        start_script_log(config, f"recharge_file_reader_{arguments.action}")
+        target_date = parse_date_argument(arguments.date)
+        run_date = (target_date or datetime.now()).date()
+        
+        if arguments.action == "publish":
+            distributed_ingest.publish(config, target_date)
+        elif arguments.action == "work":
+            distributed_ingest.run_worker(config, run_date, arguments.worker_id)
+        elif arguments.action == "finalize":
+            distributed_ingest.finalize(config, run_date)
+        else:
+            distributed_ingest.run_local(config, target_date, arguments.workers or config["performance"]["workers"])
+        return
+    
+    start_script_log(config, "recharge_file_reader")
+    target_date = parse_date_argument(getattr(arguments, "date", None))
+    
+    engine = getattr(arguments, "engine", "serial")
+    if getattr(arguments, "profile", None):
+        start_profiling(import_log_path(config), arguments.profile)
+    
+    try:
+        # The serial engine profiles each of its stages, the other engines are profiled as one stage
+        with profile_stage(f"engine_{engine}") if engine != "serial" else nullcontext():
+            run_engine(config, engine, target_date, arguments)
+    
+    except ConfigError as e:
+        sys.exit(str(e))
+    
+    finally:
+        stop_profiling()
     
     script_log.info("##############################################################################")
     script_log.info("Script executed...")
-    script_log.info("##############################################################################\n")
\ No newline at end of file
+    script_log.info("##############################################################################\n")
+
+def check_dedup_engine(config, engine):
+    """
+    This function rejects the dedup option for the engines that cannot drop duplicate events: the server engine
+    aggregates the files inside Postgres without reading them, the streaming engine reads the files in chunks,
+    and the distributed workers do not share the filter of the day.
+
+    Args:
+        config (dict): .toml file for the inputs
+        engine (str): One of the --engine choices, or "distributed"
+
+    Raises:
+        ConfigError: The dedup is enabled for an engine that does not support it
+    """
+
+    if config.get("dedup", {}).get("enabled", "NO") == "YES" and engine not in DEDUP_ENGINES:
+        raise ConfigError(f'[dedup] enabled = "YES" is not supported by the {engine} engine, '
+                          f"use one of: {', '.join(DEDUP_ENGINES)}")
+
+def run_engine(config, engine, target_date, arguments):
+    """
+    This function runs the reader with the chosen engine.
+
+    Args:
+        config (dict): .toml file for the inputs
+        engine (str): One of the --engine choices
+        target_date (datetime): Date of the files to read. Defaults to the current date.
+        arguments (argparse.Namespace): Parsed arguments (engine options)
+    """
+    
+    check_dedup_engine(config, engine)
+    if config.get("reconciliation", {}).get("enabled", "NO") == "YES" and engine not in RECONCILIATION_ENGINES:
+        script_log.warning(f"The {engine} engine does not reconcile its reports, use one of: {', '.join(RECONCILIATION_ENGINES)}")
+    
+    if engine == "async":
+        import async_pipeline
+        
+        async_pipeline.run_pipeline(config, target_date, arguments.readers or config["performance"]["workers"])
+    elif engine == "streaming":
+        import streaming_reader
+        
+        streaming_reader.run_streaming(config, target_date)
+    elif engine == "server":
+        import server_side_aggregation
+        
+        server_side_aggregation.run_server_side(config, target_date)
+    elif engine == "compact":
+        import event_store
+        
+        event_store.run_compact(config, target_date)
+    elif engine == "incremental":
+        import daily_attribution
+        
+        daily_attribution.run_incremental(config, target_date)
+    else:
+        main(target_date, config)
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,286 @@
+"""
+
+This script contains the reconciliation of recharge_file_reader.py. It is enabled with:
+
+    ["reconciliation"]
+    enabled = "YES"
+
+It shall:
+1. Compute control totals for every input file in the same pass that reads it: row count, sum of RechargeAmount
+   and an order-independent checksum of the rows (sum of a 64-bit hash per row). When the dedup is enabled,
+   the control totals of the accepted events are kept as well.
+2. Compare the control totals with the published reports of the day (sum of the Location and Category totals,
+   sum of the PaymentMethod counts) and, with send_to_database enabled, with the rows loaded in the stats tables
+   from those reports (the rows are tagged with the id of their report in the report catalog).
+3. Write a PASS/FAIL reconciliation report to reconciliation/<date>.json in the csv path and log the result.
+   A file whose checksum differs from the previous run of the day is reported as changed.
+
+"""
+
+import json
+import logging
+import os
+from datetime import datetime
+
+import recharge_file_reader as reader
+import run_metrics
+from lazy_imports import LazyModule
+from report_catalog import get_reports_for_date
+from report_sinks import read_report, write_json_atomic
+
+np = LazyModule("numpy")
+pd = LazyModule("pandas")
+
+script_log = logging.getLogger("script_handler")
+
+DB_NAME = "recharge_file_stats_db"
+RECONCILIATION_DIRNAME = "reconciliation"
+
+# Report prefix, table, value column and control total compared per report
+REPORT_CHECKS = {
+    "location": ("total_recharge_per_location", "total_recharge_amount_per_location", "Total_RechargeAmount", "amount"),
+    "category": ("total_recharge_per_category", "total_recharge_amount_per_category", "Total_RechargeAmount", "amount"),
+    "payment_method": ("count_per_payment_method", "payment_method_count", "Total_Count", "rows"),
+}
+
+def mix(values):
+    """
+    This function mixes the bits of 64-bit values (splitmix64 finalizer), so that close inputs give unrelated hashes.
+    """
+
+    values = values ^ (values >> np.uint64(30))
+    values = values * np.uint64(0xBF58476D1CE4E5B9)
+    values = values ^ (values >> np.uint64(27))
+    values = values * np.uint64(0x94D049BB133111EB)
+
+    return values ^ (values >> np.uint64(31))
+
+def row_hashes(data):
+    """
+    This function computes a 64-bit hash of every row. Integer columns are used as they are and text columns
+    through the hash of their distinct values, so only the distinct strings are hashed.
+
+    Args:
+        data (pandas.core.frame.DataFrame): Events with the columns of the EventFile_Recharge files
+
+    Returns:
+        hashes (numpy.ndarray): uint64 hash of every row
+    """
+
+    hashes = np.zeros(len(data), dtype="uint64")
+    for column in data.columns:
+        values = data[column]
+        if values.dtype.kind in "iu":
+            column_hashes = values.to_numpy().astype("uint64")
+        else:
+            codes, uniques = pd.factorize(values)
+            column_hashes = pd.util.hash_array(np.asarray(uniques, dtype=object))[codes]
+        hashes = (hashes * np.uint64(0x100000001B3)) ^ column_hashes
+
+    return mix(hashes)
+
+def control_totals(data):
+    """
+    This function computes the control totals of a part of the data (ex. one file).
+
+    Args:
+        data (pandas.core.frame.DataFrame): Events with the columns of the EventFile_Recharge files
+
+    Returns:
+        controls (dict): "rows", "amount" and "checksum" (hex) of the data
+    """
+
+    return {
+        "rows": len(data),
+        "amount": int(data["RechargeAmount"].sum()),
+        "checksum": f"{int(row_hashes(data).sum()):016x}",
+    }
+
+class ControlTotals:
+    """
+    Control totals of the files of a run, filled while the files are read. The files are keyed on their path
+    relative to the input path, so same-named files of different subdirectories are kept apart.
+    """
+
+    def __init__(self, input_path):
+        self.input_path = input_path
+        self.files = {}
+
+    def add_file(self, file, data, accepted=None):
+        """
+        This function records the control totals of a file.
+
+        Args:
+            file (str): Path of the csv file
+            data (pandas.core.frame.DataFrame): Events of the file as read
+            accepted (pandas.core.frame.DataFrame): Events kept after the dedup, None if every event is kept
+        """
+
+        controls = {"input": control_totals(data)}
+        if accepted is not None and accepted is not data:
+            controls["accepted"] = {"rows": len(accepted), "amount": int(accepted["RechargeAmount"].sum())}
+        self.files[os.path.relpath(file, self.input_path)] = controls
+
+    def expected(self):
+        """
+        This function gets the totals the reports should have: the accepted events of all the files.
+
+        Returns:
+            expected (dict): "rows" and "amount"
+        """
+
+        accepted = [controls.get("accepted", controls["input"]) for controls in self.files.values()]
+
+        return {
+            "rows": sum(controls["rows"] for controls in accepted),
+            "amount": sum(controls["amount"] for controls in accepted),
+        }
+
+def open_control_totals(config):
+    """
+    This function starts the control totals of a run when the reconciliation is enabled in the config file.
+
+    Args:
+        config (dict): .toml file for the inputs
+
+    Returns:
+        control_totals (ControlTotals): Control totals to fill, None if the reconciliation is disabled
+    """
+
+    if config.get("reconciliation", {}).get("enabled", "NO") != "YES":
+        return None
+
+    return ControlTotals(reader.import_input_path(config))
+
+def check(name, expected, actual):
+    """
+    This function builds the result of one check.
+    """
+
+    return {"check": name, "expected": expected, "actual": actual, "status": "PASS" if expected == actual else "FAIL"}
+
+def check_reports(csv_path, report_date, expected):
+    """
+    This function compares the latest reports of the day with the control totals.
+
+    Args:
+        csv_path (dir): Directory of the reports
+        report_date (datetime.date): Day of the reports
+        expected (dict): "rows" and "amount" from ControlTotals.expected()
+
+    Returns:
+        checks (list): Result of every check
+        reports (dict): (report id, report dataframe) per report, None when the report is missing
+    """
+
+    checks = []
+    reports = {}
+    for report, (filename_prefix, _, value_column, control) in REPORT_CHECKS.items():
+        entries = get_reports_for_date(csv_path, filename_prefix, report_date)
+        if not entries:
+            reports[report] = None
+            checks.append(check(f"report {report} {control}", expected[control], None))
+            continue
+
+        dataframe = read_report(entries[-1]["path"])
+        reports[report] = (entries[-1]["id"], dataframe)
+        checks.append(check(f"report {report} {control}", expected[control], int(dataframe[value_column].sum())))
+
+    return checks, reports
+
+def check_database(config, reports):
+    """
+    This function compares the rows loaded from the reports in the stats tables with the reports.
+    The rows of a report are found by the report id they are tagged with, so the rows loaded by other runs
+    (ex. a concurrent run of another day) are never compared.
+
+    Args:
+        config (dict): .toml file for the inputs
+        reports (dict): (report id, report dataframe) per report from check_reports()
+
+    Returns:
+        checks (list): Result of every check
+    """
+
+    checks = []
+    connection = reader.connect_to_new_db(DB_NAME, config)
+    if connection is None:
+        return [check("database connection", "connected", None)]
+
+    try:
+        with connection.cursor() as cursor:
+            for report, (_, table, value_column, _) in REPORT_CHECKS.items():
+                if reports[report] is None:
+                    continue
+
+                report_id, dataframe = reports[report]
+                key_column = dataframe.columns[0]
+                cursor.execute(f"SELECT {key_column}, {value_column} FROM {table} WHERE report_id = %s;", (report_id,))
+                loaded = {str(key): int(value) for key, value in cursor.fetchall()}
+                published = {str(key): int(value) for key, value in dataframe[[key_column, value_column]].itertuples(index=False)}
+                checks.append(check(f"database {table}", published, loaded))
+
+    except Exception as e:
+        checks.append(check("database query", "rows", f"error: {e}"))
+
+    finally:
+        connection.close()
+
+    return checks
+
+def reconcile(config, control_totals, report_date):
+    """
+    This function compares the control totals of the run with the reports and the database and writes the
+    reconciliation report of the day.
+
+    Args:
+        config (dict): .toml file for the inputs
+        control_totals (ControlTotals): Control totals filled while the files were read
+        report_date (datetime.date): Day of the reports
+
+    Returns:
+        reconciliation (dict): Reconciliation report, "status" is "PASS" or "FAIL"
+    """
+
+    csv_path = config["directories"]["csv_path"]
+    report_path = os.path.join(csv_path, RECONCILIATION_DIRNAME, f"{report_date.isoformat()}.json")
+
+    previous_files = {}
+    if os.path.exists(report_path):
+        with open(report_path, "r") as file:
+            previous_files = json.load(file).get("files", {})
+
+    expected = control_totals.expected()
+    checks, reports = check_reports(csv_path, report_date, expected)
+    if config["operation"]["send_to_database"] == "YES":
+        checks += check_database(config, reports)
+
+    changed_files = sorted(
+        source_file for source_file, controls in control_totals.files.items()
+        if source_file in previous_files and previous_files[source_file]["input"]["checksum"] != controls["input"]["checksum"]
+    )
+    for source_file in changed_files:
+        script_log.warning(f"{source_file} changed since the previous run of {report_date} (different checksum).")
+
+    status = "PASS" if all(result["status"] == "PASS" for result in checks) else "FAIL"
+    reconciliation = {
+        "report_date": report_date.isoformat(),
+        "status": status,
+        "expected": expected,
+        "checks": checks,
+        "changed_files": changed_files,
+        "files": control_totals.files,
+        "written_at": datetime.now().isoformat(timespec="seconds"),
+    }
+    os.makedirs(os.path.dirname(report_path), exist_ok=True)
+    write_json_atomic(reconciliation, report_path)
+
+    run_metrics.set_gauge("reconciliation_failed_checks", sum(result["status"] == "FAIL" for result in checks))
+    for result in checks:
+        if result["status"] == "FAIL":
+            script_log.error(f"Reconciliation check '{result['check']}' failed: expected {result['expected']}, got {result['actual']}")
+    log = script_log.info if status == "PASS" else script_log.error
+    log(f"Reconciliation {status}: {len(control_totals.files)} file(s), {expected['rows']} row(s), "
+        f"RechargeAmount {expected['amount']}. Report: {report_path}\n")
+
+    return reconciliation
@@ -0,0 +1,489 @@
+"""
+
+This script contains the report catalog used by recharge_file_reader.py to keep track of the written reports.
+
+It shall:
+1. Record every report written by save_to_csv with its type, date, path, format and row count in a SQLite index.
+2. Give the latest report of a report type with an indexed lookup instead of listing and stat()-ing the report directory.
+3. Apply a retention period to old reports and compact the index.
+4. Keep track of the compacted period files of the report history (see report_history.py), and of the report
+   files merged into them until they are deleted, so an interrupted compaction never leaves files behind.
+
+"""
+
+import logging
+import os
+import sqlite3
+from datetime import datetime, timedelta
+
+script_log = logging.getLogger("script_handler")
+
+CATALOG_FILENAME = "report_catalog.sqlite3"
+# Version of the tables created by create_catalog_tables(), stored in the user_version of the catalog
+CATALOG_SCHEMA_VERSION = 1
+
+def create_catalog_tables(connection):
+    """
+    This function creates the tables of the report catalog and stamps the catalog with CATALOG_SCHEMA_VERSION,
+    in one transaction so the other connections see either no table or all of them.
+
+    Args:
+        connection (sqlite3.Connection): Connection to the catalog
+    """
+
+    connection.executescript(
+        "BEGIN IMMEDIATE;"
+        "CREATE TABLE IF NOT EXISTS reports ("
+        "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+        "report_type TEXT NOT NULL, "
+        "report_date TEXT NOT NULL, "
+        "path TEXT NOT NULL, "
+        "format TEXT NOT NULL, "
+        "row_count INTEGER NOT NULL, "
+        "written_at TEXT NOT NULL);"
+        "CREATE INDEX IF NOT EXISTS idx_reports_type_date ON reports (report_type, report_date);"
+        "CREATE TABLE IF NOT EXISTS latest_reports ("
+        "report_type TEXT PRIMARY KEY, "
+        "report_id INTEGER NOT NULL REFERENCES reports (id));"
+        "CREATE TABLE IF NOT EXISTS compacted_periods ("
+        "report_type TEXT NOT NULL, "
+        "period TEXT NOT NULL, "
+        "path TEXT NOT NULL, "
+        "format TEXT NOT NULL, "
+        "first_date TEXT NOT NULL, "
+        "last_date TEXT NOT NULL, "
+        "row_count INTEGER NOT NULL, "
+        "written_at TEXT NOT NULL, "
+        "PRIMARY KEY (report_type, period));"
+        "CREATE TABLE IF NOT EXISTS pending_deletions (path TEXT PRIMARY KEY, recorded_at TEXT NOT NULL);"
+        f"PRAGMA user_version = {CATALOG_SCHEMA_VERSION};"
+        "COMMIT;"
+    )
+
+def connect_to_catalog(csv_path):
+    """
+    This function will open the report catalog in the report directory. Its tables are only created when the
+    catalog is new or was written by an older version (schema version below CATALOG_SCHEMA_VERSION), so the
+    lookups of the other runs never write to it.
+
+    Args:
+        csv_path (dir): Directory of the reports
+
+    Returns:
+        connection (sqlite3.Connection): Connection to the catalog
+    """
+
+    connection = sqlite3.connect(os.path.join(csv_path, CATALOG_FILENAME), timeout=30)
+    if connection.execute("PRAGMA user_version;").fetchone()[0] < CATALOG_SCHEMA_VERSION:
+        create_catalog_tables(connection)
+
+    return connection
+
+def record_report(csv_path, report_type, file_path, output_format, row_count, report_date=None):
+    """
+    This function records a newly written report in the catalog and makes it the latest report of its type.
+
+    Args:
+        csv_path (dir): Directory of the reports
+        report_type (str): Prefix of the report (ex. total_recharge_per_location)
+        file_path (str): Path of the written report
+        output_format (str): Format of the written report
+        row_count (int): Number of rows in the report
+        report_date (datetime.date): Day covered by the report. Defaults to the current date.
+
+    Returns:
+        report_id (int): Id of the report in the catalog
+    """
+
+    report_date = report_date or datetime.now().date()
+
+    connection = connect_to_catalog(csv_path)
+    try:
+        with connection:
+            cursor = connection.execute(
+                "INSERT INTO reports (report_type, report_date, path, format, row_count, written_at) VALUES (?, ?, ?, ?, ?, ?);",
+                (report_type, report_date.isoformat(), file_path, output_format, int(row_count), datetime.now().isoformat(timespec="seconds")),
+            )
+            report_id = cursor.lastrowid
+            connection.execute(
+                "INSERT INTO latest_reports (report_type, report_id) VALUES (?, ?) "
+                "ON CONFLICT (report_type) DO UPDATE SET report_id = excluded.report_id;",
+                (report_type, report_id),
+            )
+
+        return report_id
+
+    finally:
+        connection.close()
+
+def get_latest_entry(csv_path, report_type):
+    """
+    This function gets the catalog entry of the latest report of a report type.
+
+    Args:
+        csv_path (dir): Directory of the reports
+        report_type (str): Prefix of the report (ex. total_recharge_per_location)
+
+    Returns:
+        entry (dict): Catalog entry of the report, None if the report type has no report yet
+    """
+
+    if not os.path.exists(os.path.join(csv_path, CATALOG_FILENAME)):
+        return None
+
+    connection = connect_to_catalog(csv_path)
+    connection.row_factory = sqlite3.Row
+    try:
+        row = connection.execute(
+            "SELECT reports.* FROM latest_reports JOIN reports ON reports.id = latest_reports.report_id "
+            "WHERE latest_reports.report_type = ?;",
+            (report_type,),
+        ).fetchone()
+
+        return dict(row) if row is not None else None
+
+    finally:
+        connection.close()
+
+def get_latest_entries(csv_path):
+    """
+    This function gets the catalog entries of the latest report of every report type.
+
+    Args:
+        csv_path (dir): Directory of the reports
+
+    Returns:
+        entries (dict): Catalog entry (dict) per report type
+    """
+
+    if not os.path.exists(os.path.join(csv_path, CATALOG_FILENAME)):
+        return {}
+
+    connection = connect_to_catalog(csv_path)
+    connection.row_factory = sqlite3.Row
+    try:
+        rows = connection.execute(
+            "SELECT reports.* FROM latest_reports JOIN reports ON reports.id = latest_reports.report_id "
+            "ORDER BY reports.report_type;"
+        ).fetchall()
+
+        return {row["report_type"]: dict(row) for row in rows}
+
+    finally:
+        connection.close()
+
+def get_reports_for_date(csv_path, report_type, report_date):
+    """
+    This function gets all the catalog entries of a report type for a day, oldest first.
+
+    Args:
+        csv_path (dir): Directory of the reports
+        report_type (str): Prefix of the report (ex. total_recharge_per_location)
+        report_date (datetime.date): Day covered by the reports
+
+    Returns:
+        entries (list): List of catalog entries (dict)
+    """
+
+    if not os.path.exists(os.path.join(csv_path, CATALOG_FILENAME)):
+        return []
+
+    connection = connect_to_catalog(csv_path)
+    connection.row_factory = sqlite3.Row
+    try:
+        rows = connection.execute(
+            "SELECT * FROM reports WHERE report_type = ? AND report_date = ? ORDER BY id;",
+            (report_type, report_date.isoformat()),
+        ).fetchall()
+
+        return [dict(row) for row in rows]
+
+    finally:
+        connection.close()
+
+def get_reports_in_range(csv_path, report_type, start_date, end_date):
+    """
+    This function gets the catalog entries of a report type for a range of days, oldest first.
+
+    Args:
+        csv_path (dir): Directory of the reports
+        report_type (str): Prefix of the report (ex. total_recharge_per_location)
+        start_date (datetime.date): First day of the range
+        end_date (datetime.date): Last day of the range (included)
+
+    Returns:
+        entries (list): List of catalog entries (dict)
+    """
+
+    if not os.path.exists(os.path.join(csv_path, CATALOG_FILENAME)):
+        return []
+
+    connection = connect_to_catalog(csv_path)
+    connection.row_factory = sqlite3.Row
+    try:
+        rows = connection.execute(
+            "SELECT * FROM reports WHERE report_type = ? AND report_date BETWEEN ? AND ? ORDER BY report_date, id;",
+            (report_type, start_date.isoformat(), end_date.isoformat()),
+        ).fetchall()
+
+        return [dict(row) for row in rows]
+
+    finally:
+        connection.close()
+
+def get_compacted_periods(csv_path, report_type, start_date, end_date):
+    """
+    This function gets the compacted period files of a report type that overlap a range of days.
+
+    Args:
+        csv_path (dir): Directory of the reports
+        report_type (str): Prefix of the report (ex. total_recharge_per_location)
+        start_date (datetime.date): First day of the range
+        end_date (datetime.date): Last day of the range (included)
+
+    Returns:
+        periods (list): List of compacted period entries (dict), oldest first
+    """
+
+    if not os.path.exists(os.path.join(csv_path, CATALOG_FILENAME)):
+        return []
+
+    connection = connect_to_catalog(csv_path)
+    connection.row_factory = sqlite3.Row
+    try:
+        rows = connection.execute(
+            "SELECT * FROM compacted_periods WHERE report_type = ? AND first_date <= ? AND last_date >= ? ORDER BY period;",
+            (report_type, end_date.isoformat(), start_date.isoformat()),
+        ).fetchall()
+
+        return [dict(row) for row in rows]
+
+    finally:
+        connection.close()
+
+def get_compactable_reports(csv_path, cutoff_date):
+    """
+    This function gets the catalog entries of the reports of the days before a cutoff and of the reruns replaced
+    by a later run of the same day after it, oldest first. The last run of the recent days and the latest report
+    of every report type are left out, so the recent days and the "latest" pointers keep a report file.
+
+    Args:
+        csv_path (dir): Directory of the reports
+        cutoff_date (datetime.date): First day that is not compacted
+
+    Returns:
+        entries (list): List of catalog entries (dict)
+    """
+
+    if not os.path.exists(os.path.join(csv_path, CATALOG_FILENAME)):
+        return []
+
+    connection = connect_to_catalog(csv_path)
+    connection.row_factory = sqlite3.Row
+    try:
+        rows = connection.execute(
+            "SELECT * FROM reports r WHERE id NOT IN (SELECT report_id FROM latest_reports) "
+            "AND (report_date < ? OR EXISTS (SELECT 1 FROM reports later WHERE later.report_type = r.report_type "
+            "AND later.report_date = r.report_date AND later.id > r.id)) ORDER BY report_type, report_date, id;",
+            (cutoff_date.isoformat(),),
+        ).fetchall()
+
+        return [dict(row) for row in rows]
+
+    finally:
+        connection.close()
+
+def get_compacted_period(csv_path, report_type, period):
+    """
+    This function gets the catalog entry of a compacted period file.
+
+    Args:
+        csv_path (dir): Directory of the reports
+        report_type (str): Prefix of the report (ex. total_recharge_per_location)
+        period (str): Period of the file (YYYY-MM)
+
+    Returns:
+        entry (dict): Compacted period entry, None if the period was never compacted
+    """
+
+    connection = connect_to_catalog(csv_path)
+    connection.row_factory = sqlite3.Row
+    try:
+        row = connection.execute(
+            "SELECT * FROM compacted_periods WHERE report_type = ? AND period = ?;", (report_type, period)
+        ).fetchone()
+
+        return dict(row) if row is not None else None
+
+    finally:
+        connection.close()
+
+def record_compacted_period(csv_path, report_type, period, file_path, output_format, first_date, last_date, row_count,
+                            report_ids, delete_paths=()):
+    """
+    This function records a compacted period file and drops the catalog entries of the reports merged into it,
+    in one transaction. The files to delete are recorded as pending deletions in the same transaction and are
+    deleted by delete_pending_files().
+
+    Args:
+        csv_path (dir): Directory of the reports
+        report_type (str): Prefix of the report (ex. total_recharge_per_location)
+        period (str): Period of the file (YYYY-MM)
+        file_path (str): Path of the compacted file
+        output_format (str): Format of the compacted file
+        first_date (str): First day in the file (YYYY-MM-DD)
+        last_date (str): Last day in the file (YYYY-MM-DD)
+        row_count (int): Number of rows in the file
+        report_ids (list): Ids of the reports merged into the file
+        delete_paths (list): Files replaced by the compacted file (merged reports, previous period file)
+    """
+
+    recorded_at = datetime.now().isoformat(timespec="seconds")
+
+    connection = connect_to_catalog(csv_path)
+    try:
+        with connection:
+            connection.execute(
+                "INSERT INTO compacted_periods (report_type, period, path, format, first_date, last_date, row_count, written_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT (report_type, period) DO UPDATE SET "
+                "path = excluded.path, format = excluded.format, first_date = excluded.first_date, "
+                "last_date = excluded.last_date, row_count = excluded.row_count, written_at = excluded.written_at;",
+                (report_type, period, file_path, output_format, first_date, last_date, int(row_count), recorded_at),
+            )
+            connection.executemany("DELETE FROM reports WHERE id = ?;", [(report_id,) for report_id in report_ids])
+            connection.executemany("INSERT OR IGNORE INTO pending_deletions (path, recorded_at) VALUES (?, ?);",
+                                   [(path, recorded_at) for path in delete_paths if path != file_path])
+
+    finally:
+        connection.close()
+
+def delete_pending_files(csv_path):
+    """
+    This function deletes the files recorded as pending deletions, with their day directory once it is empty.
+    A deletion is only forgotten once its file is gone, so it is retried after an interruption.
+
+    Args:
+        csv_path (dir): Directory of the reports
+
+    Returns:
+        deleted (int): Number of pending deletions done
+    """
+
+    if not os.path.exists(os.path.join(csv_path, CATALOG_FILENAME)):
+        return 0
+
+    connection = connect_to_catalog(csv_path)
+    try:
+        paths = [path for (path,) in connection.execute("SELECT path FROM pending_deletions;")]
+        for path in paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            try:
+                os.rmdir(os.path.dirname(path))
+            except OSError:
+                # Other reports are still in the day directory
+                pass
+
+        with connection:
+            connection.executemany("DELETE FROM pending_deletions WHERE path = ?;", [(path,) for path in paths])
+
+    finally:
+        connection.close()
+
+    return len(paths)
+
+def apply_retention(csv_path, retention_days):
+    """
+    This function deletes the reports older than the retention period together with their catalog entries,
+    then compacts the catalog. The latest report of every report type is always kept.
+
+    Args:
+        csv_path (dir): Directory of the reports
+        retention_days (int): Number of days of reports to keep. 0 keeps everything.
+
+    Returns:
+        removed (int): Number of reports removed
+    """
+
+    if retention_days <= 0 or not os.path.exists(os.path.join(csv_path, CATALOG_FILENAME)):
+        return 0
+
+    cutoff = (datetime.now().date() - timedelta(days=retention_days)).isoformat()
+
+    connection = connect_to_catalog(csv_path)
+    try:
+        expired = connection.execute(
+            "SELECT id, path FROM reports WHERE report_date < ? "
+            "AND id NOT IN (SELECT report_id FROM latest_reports);",
+            (cutoff,),
+        ).fetchall()
+
+        for report_id, path in expired:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+        # Compacted period files are removed once their last day is out of the retention period
+        expired_periods = connection.execute(
+            "SELECT report_type, period, path FROM compacted_periods WHERE last_date < ?;", (cutoff,)
+        ).fetchall()
+        for _, _, path in expired_periods:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+        with connection:
+            connection.executemany("DELETE FROM reports WHERE id = ?;", [(report_id,) for report_id, _ in expired])
+            connection.executemany("DELETE FROM compacted_periods WHERE report_type = ? AND period = ?;",
+                                   [(report_type, period) for report_type, period, _ in expired_periods])
+
+        script_log.info(f"Retention: removed {len(expired)} report(s) and {len(expired_periods)} compacted period(s) older than {cutoff}.")
+
+    finally:
+        connection.close()
+
+    # Also drops the entries of the files deleted by hand or left by an interrupted retention
+    compact_catalog(csv_path)
+
+    return len(expired)
+
+def compact_catalog(csv_path):
+    """
+    This function drops the catalog entries whose report (or compacted period) file no longer exists and reclaims
+    the free space of the index.
+
+    Args:
+        csv_path (dir): Directory of the reports
+
+    Returns:
+        removed (int): Number of entries removed
+    """
+
+    if not os.path.exists(os.path.join(csv_path, CATALOG_FILENAME)):
+        return 0
+
+    connection = connect_to_catalog(csv_path)
+    try:
+        missing = [
+            (report_id,) for report_id, path in connection.execute("SELECT id, path FROM reports;")
+            if not os.path.exists(path)
+        ]
+        missing_periods = [
+            (report_type, period) for report_type, period, path in connection.execute("SELECT report_type, period, path FROM compacted_periods;")
+            if not os.path.exists(path)
+        ]
+
+        with connection:
+            connection.executemany("DELETE FROM latest_reports WHERE report_id = ?;", missing)
+            connection.executemany("DELETE FROM reports WHERE id = ?;", missing)
+            connection.executemany("DELETE FROM compacted_periods WHERE report_type = ? AND period = ?;", missing_periods)
+        connection.execute("VACUUM;")
+
+        return len(missing) + len(missing_periods)
+
+    finally:
+        connection.close()
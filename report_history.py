@@ -0,0 +1,234 @@
+"""
+
+This script contains the report history of recharge_file_reader.py. The reports are written by save_to_csv in:
+
+    <csv_path>/history/<report>/<YYYY>/<MM>/<DD>/<report>_<timestamp>.<ext>
+
+and the history is compacted with:
+
+    python recharge_file_reader.py compact [--older-than-days N] [--format parquet|arrow]
+
+It shall:
+1. Give the partition (report, year, month, day) of every report written by a run.
+2. Merge the reports of the days older than compact_after_days, every rerun included, and the replaced reruns
+   of the recent days into one columnar file per report and month:
+       <csv_path>/history/<report>/<YYYY>/<MM>/<report>_<YYYY>-<MM>.parquet
+   with report_date, report_id and written_at columns in front of the report columns. The last run of a recent
+   day stays a report file. The period file is written atomically, then recorded in the report catalog together
+   with the files to delete, then the files are deleted. A compaction interrupted before the deletions finishes
+   them on its next run. A period compacted again (ex. a late backfill) is merged with its existing file.
+3. Read a report for any range of days from the report catalog and the compacted period files, without listing
+   the history directories. By default only the last run of every day is returned.
+
+"""
+
+import logging
+import os
+from datetime import datetime, timedelta
+
+from lazy_imports import LazyModule
+from report_catalog import (
+    compact_catalog,
+    delete_pending_files,
+    get_compactable_reports,
+    get_compacted_period,
+    get_compacted_periods,
+    get_reports_in_range,
+    record_compacted_period,
+)
+from report_sinks import REPORT_EXTENSIONS, read_report, write_report_atomic
+
+pd = LazyModule("pandas")
+
+script_log = logging.getLogger("script_handler")
+
+HISTORY_DIRNAME = "history"
+COMPACT_FORMATS = ("parquet", "arrow")
+HISTORY_COLUMNS = ["report_date", "report_id", "written_at"]
+
+def history_day_path(csv_path, filename_prefix, report_date):
+    """
+    This function gets the directory of the reports of a day.
+
+    Args:
+        csv_path (dir): Directory of the reports
+        filename_prefix (str): Prefix of the report (ex. total_recharge_per_location)
+        report_date (datetime.date): Day of the reports
+
+    Returns:
+        day_path (dir): <csv_path>/history/<report>/<YYYY>/<MM>/<DD>
+    """
+
+    return os.path.join(csv_path, HISTORY_DIRNAME, filename_prefix,
+                        f"{report_date.year:04d}", f"{report_date.month:02d}", f"{report_date.day:02d}")
+
+def period_file_path(csv_path, filename_prefix, period, output_format):
+    """
+    This function gets the path of the compacted file of a report and month.
+
+    Args:
+        csv_path (dir): Directory of the reports
+        filename_prefix (str): Prefix of the report (ex. total_recharge_per_location)
+        period (str): Month of the file (YYYY-MM)
+        output_format (str): "parquet" or "arrow"
+
+    Returns:
+        file_path (str): <csv_path>/history/<report>/<YYYY>/<MM>/<report>_<YYYY>-<MM>.<ext>
+    """
+
+    year, month = period.split("-")
+
+    return os.path.abspath(os.path.join(csv_path, HISTORY_DIRNAME, filename_prefix, year, month,
+                                        f"{filename_prefix}_{period}{REPORT_EXTENSIONS[output_format]}"))
+
+def with_history_columns(dataframe, entry):
+    """
+    This function adds the report_date, report_id and written_at of a catalog entry in front of a report.
+    """
+
+    dataframe = dataframe.copy()
+    dataframe.insert(0, "written_at", entry["written_at"])
+    dataframe.insert(0, "report_id", entry["id"])
+    dataframe.insert(0, "report_date", entry["report_date"])
+
+    return dataframe
+
+def read_period(file_path, start_date=None, end_date=None):
+    """
+    This function reads the rows of a compacted period file, only the rows of a range of days if given.
+    Parquet files are filtered while they are read.
+
+    Args:
+        file_path (str): Path of the compacted file
+        start_date (datetime.date): First day to read
+        end_date (datetime.date): Last day to read (included)
+
+    Returns:
+        dataframe (pandas.core.frame.DataFrame): Rows of the period
+    """
+
+    if start_date is None:
+        return read_report(file_path)
+
+    if file_path.endswith(REPORT_EXTENSIONS["parquet"]):
+        return pd.read_parquet(file_path, filters=[("report_date", ">=", start_date.isoformat()),
+                                                   ("report_date", "<=", end_date.isoformat())])
+
+    dataframe = read_report(file_path)
+
+    return dataframe[dataframe["report_date"].between(start_date.isoformat(), end_date.isoformat())]
+
+def compact_period(csv_path, filename_prefix, period, entries, output_format="parquet"):
+    """
+    This function merges the reports of a month into its compacted file and deletes the merged report files.
+
+    Args:
+        csv_path (dir): Directory of the reports
+        filename_prefix (str): Prefix of the report (ex. total_recharge_per_location)
+        period (str): Month of the reports (YYYY-MM)
+        entries (list): Catalog entries of the reports to merge
+        output_format (str): "parquet" or "arrow"
+
+    Returns:
+        file_path (str): Path of the compacted file, None if none of the report files exists anymore
+    """
+
+    report_ids = [entry["id"] for entry in entries]
+    parts = [with_history_columns(read_report(entry["path"]), entry) for entry in entries if os.path.exists(entry["path"])]
+
+    # Rows of the same reports left by an interrupted compaction are replaced, not duplicated
+    existing = get_compacted_period(csv_path, filename_prefix, period)
+    if existing is not None and os.path.exists(existing["path"]):
+        previous = read_period(existing["path"])
+        parts.insert(0, previous[~previous["report_id"].isin(report_ids)])
+
+    file_path = period_file_path(csv_path, filename_prefix, period, output_format)
+    delete_paths = [entry["path"] for entry in entries]
+    if existing is not None and existing["path"] != file_path:
+        delete_paths.append(existing["path"])
+
+    if parts:
+        dataframe = pd.concat(parts, ignore_index=True).sort_values(["report_date", "report_id"], kind="stable")
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        write_report_atomic(dataframe.reset_index(drop=True), file_path, output_format)
+        record_compacted_period(csv_path, filename_prefix, period, file_path, output_format,
+                                dataframe["report_date"].min(), dataframe["report_date"].max(), len(dataframe),
+                                report_ids, delete_paths)
+    elif existing is not None:
+        record_compacted_period(csv_path, filename_prefix, period, file_path, output_format,
+                                existing["first_date"], existing["last_date"], existing["row_count"],
+                                report_ids, delete_paths)
+    else:
+        return None
+
+    delete_pending_files(csv_path)
+
+    return file_path
+
+def compact_history(csv_path, compact_after_days, output_format="parquet"):
+    """
+    This function compacts the reports of the days older than compact_after_days, and the replaced reruns of the
+    more recent days, into one file per report and month.
+
+    Args:
+        csv_path (dir): Directory of the reports
+        compact_after_days (int): Days of reports kept as separate files
+        output_format (str): "parquet" or "arrow"
+
+    Returns:
+        compacted (int): Number of report files merged
+    """
+
+    if output_format not in COMPACT_FORMATS:
+        raise ValueError(f"Unknown compaction format '{output_format}'. Choose from: {', '.join(COMPACT_FORMATS)}")
+
+    # Deletions left by an interrupted compaction
+    delete_pending_files(csv_path)
+    compact_catalog(csv_path)
+
+    cutoff = datetime.now().date() - timedelta(days=compact_after_days)
+    periods = {}
+    for entry in get_compactable_reports(csv_path, cutoff):
+        periods.setdefault((entry["report_type"], entry["report_date"][:7]), []).append(entry)
+
+    for (filename_prefix, period), entries in periods.items():
+        file_path = compact_period(csv_path, filename_prefix, period, entries, output_format)
+        script_log.info(f"Compacted {len(entries)} {filename_prefix} report(s) of {period} into {file_path}")
+
+    compacted = sum(len(entries) for entries in periods.values())
+    script_log.info(f"Compaction: merged {compacted} report(s) older than {cutoff} or replaced by a rerun into {len(periods)} period file(s).")
+
+    return compacted
+
+def read_history(csv_path, filename_prefix, start_date, end_date, all_runs=False):
+    """
+    This function reads a report for a range of days. The report files and the compacted period files of the
+    range are found in the report catalog, so the history directories are never listed.
+
+    Args:
+        csv_path (dir): Directory of the reports
+        filename_prefix (str): Prefix of the report (ex. total_recharge_per_location)
+        start_date (datetime.date): First day of the range
+        end_date (datetime.date): Last day of the range (included)
+        all_runs (bool): Return the rows of every run of a day instead of the last run only
+
+    Returns:
+        dataframe (pandas.core.frame.DataFrame): report_date, report_id, written_at and the report columns,
+        ordered by day and run. Empty if there is no report in the range.
+    """
+
+    parts = [read_period(period["path"], start_date, end_date)
+             for period in get_compacted_periods(csv_path, filename_prefix, start_date, end_date)]
+    parts += [with_history_columns(read_report(entry["path"]), entry)
+              for entry in get_reports_in_range(csv_path, filename_prefix, start_date, end_date)]
+    parts = [part for part in parts if len(part)]
+
+    if not parts:
+        return pd.DataFrame(columns=HISTORY_COLUMNS)
+
+    dataframe = pd.concat(parts, ignore_index=True)
+    if not all_runs:
+        last_run = dataframe.groupby("report_date")["report_id"].transform("max")
+        dataframe = dataframe[dataframe["report_id"] == last_run]
+
+    return dataframe.sort_values(["report_date", "report_id"], kind="stable").reset_index(drop=True)
@@ -0,0 +1,231 @@
+"""
+
+This script contains the report sinks used by recharge_file_reader.py to write the summarized data.
+
+It shall:
+1. Write a report in the format selected in the config file (csv, parquet, arrow or jsonl).
+2. Write every report to a temporary file first and rename it once complete so consumers never read a partial file.
+3. Keep a "latest" pointer per report (manifest and symlink) so consumers don't have to list the report directory.
+   Both are derived from the report catalog, which is the source of truth of the latest reports.
+
+"""
+
+import json
+import logging
+import os
+import threading
+
+from lazy_imports import LazyModule
+from report_catalog import get_latest_entries, get_latest_entry
+
+pd = LazyModule("pandas")
+
+script_log = logging.getLogger("script_handler")
+
+LATEST_MANIFEST = "latest_reports.json"
+
+_manifest_lock = threading.Lock()
+
+REPORT_EXTENSIONS = {
+    "csv": ".csv",
+    "parquet": ".parquet",
+    "arrow": ".arrow",
+    "jsonl": ".jsonl",
+}
+
+def write_csv_report(dataframe, file_path):
+    """
+    This function writes the dataframe as a csv file.
+
+    Args:
+        dataframe (pandas.core.frame.DataFrame): Summarized data to be written
+        file_path (str): Path of the file to write
+    """
+
+    dataframe.to_csv(file_path, index=False)
+
+def write_parquet_report(dataframe, file_path):
+    """
+    This function writes the dataframe as a parquet file. Requires pyarrow.
+
+    Args:
+        dataframe (pandas.core.frame.DataFrame): Summarized data to be written
+        file_path (str): Path of the file to write
+    """
+
+    dataframe.to_parquet(file_path, index=False)
+
+def write_arrow_report(dataframe, file_path):
+    """
+    This function writes the dataframe as an Arrow IPC file. Requires pyarrow.
+
+    Args:
+        dataframe (pandas.core.frame.DataFrame): Summarized data to be written
+        file_path (str): Path of the file to write
+    """
+
+    import pyarrow as pa
+
+    table = pa.Table.from_pandas(dataframe, preserve_index=False)
+    with pa.OSFile(file_path, "wb") as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+
+def write_jsonl_report(dataframe, file_path):
+    """
+    This function writes the dataframe as JSON lines, one record per line.
+
+    Args:
+        dataframe (pandas.core.frame.DataFrame): Summarized data to be written
+        file_path (str): Path of the file to write
+    """
+
+    dataframe.to_json(file_path, orient="records", lines=True)
+
+REPORT_SINKS = {
+    "csv": write_csv_report,
+    "parquet": write_parquet_report,
+    "arrow": write_arrow_report,
+    "jsonl": write_jsonl_report,
+}
+
+def read_report(file_path):
+    """
+    This function reads a report written by one of the sinks. The format is taken from the file extension.
+
+    Args:
+        file_path (str): Path of the report file
+
+    Returns:
+        report (pandas.core.frame.DataFrame): Returns the report as a dataframe
+    """
+
+    extension = os.path.splitext(file_path)[1]
+
+    if extension == ".parquet":
+        return pd.read_parquet(file_path)
+
+    if extension == ".arrow":
+        import pyarrow as pa
+
+        with pa.memory_map(file_path, "r") as source:
+            return pa.ipc.open_file(source).read_all().to_pandas()
+
+    if extension == ".jsonl":
+        return pd.read_json(file_path, orient="records", lines=True)
+
+    return pd.read_csv(file_path)
+
+def write_report_atomic(dataframe, file_path, output_format):
+    """
+    This function writes the report into a temporary file in the same directory then renames it
+    to its final name. The rename is atomic so a reader either sees the complete report or nothing.
+
+    Args:
+        dataframe (pandas.core.frame.DataFrame): Summarized data to be written
+        file_path (str): Final path of the report
+        output_format (str): One of the keys of REPORT_SINKS
+    """
+
+    if output_format not in REPORT_SINKS:
+        raise ValueError(f"Unknown report format '{output_format}'. Choose from: {', '.join(REPORT_SINKS)}")
+
+    tmp_path = f"{file_path}.tmp"
+    try:
+        REPORT_SINKS[output_format](dataframe, tmp_path)
+        os.replace(tmp_path, file_path)
+
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def write_json_atomic(data, file_path):
+    """
+    This function writes a small json document atomically (write to temporary file then rename).
+
+    Args:
+        data (dict): Data to be written
+        file_path (str): Final path of the json file
+    """
+
+    # One temporary file per writer, reports are saved from several threads by the async engine
+    tmp_path = f"{file_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w") as file:
+        json.dump(data, file, indent=2)
+    os.replace(tmp_path, file_path)
+
+def load_latest_manifest(csv_path):
+    """
+    This function loads the manifest of the latest report per report type.
+
+    Args:
+        csv_path (dir): Directory of the reports
+
+    Returns:
+        manifest (dict): Latest report entry per filename prefix. Empty if there is no manifest yet.
+    """
+
+    manifest_path = os.path.join(csv_path, LATEST_MANIFEST)
+    if not os.path.exists(manifest_path):
+        return {}
+
+    with open(manifest_path, "r") as file:
+        return json.load(file)
+
+def update_latest_pointer(csv_path, filename_prefix, create_symlink=True):
+    """
+    This function rewrites the "latest" manifest and the symlink of a report type from the report catalog.
+    The catalog is the source of truth of the latest reports, the manifest and the symlink are derived from it
+    for the consumers that don't read the catalog.
+
+    Args:
+        csv_path (dir): Directory of the reports
+        filename_prefix (str): Prefix of the report type (ex. total_recharge_per_location)
+        create_symlink (bool): Also maintain a <prefix>_latest<ext> symlink
+    """
+
+    # The catalog is read and the manifest written under the lock so an older snapshot never replaces a newer one
+    with _manifest_lock:
+        latest_entries = get_latest_entries(csv_path)
+        manifest = {
+            report_type: {
+                "file": os.path.relpath(entry["path"], csv_path),
+                "format": entry["format"],
+                "report_date": entry["report_date"],
+                "written_at": entry["written_at"],
+            }
+            for report_type, entry in latest_entries.items()
+        }
+        write_json_atomic(manifest, os.path.join(csv_path, LATEST_MANIFEST))
+
+    entry = latest_entries.get(filename_prefix)
+    if create_symlink and entry is not None:
+        link_path = os.path.join(csv_path, f"{filename_prefix}_latest{REPORT_EXTENSIONS[entry['format']]}")
+        tmp_link = f"{link_path}.tmp"
+        try:
+            if os.path.lexists(tmp_link):
+                os.remove(tmp_link)
+            os.symlink(os.path.relpath(entry["path"], csv_path), tmp_link)
+            os.replace(tmp_link, link_path)
+
+        except OSError as e:
+            script_log.warning(f"Could not create the latest symlink for '{filename_prefix}', use {LATEST_MANIFEST} instead: {e}")
+
+def latest_report_path(csv_path, filename_prefix):
+    """
+    This function gets the latest report of a report type from the report catalog.
+
+    Args:
+        csv_path (dir): Directory of the reports
+        filename_prefix (str): Prefix of the report type
+
+    Returns:
+        file_path (str): Path of the latest report, None if the report type has no report yet
+    """
+
+    entry = get_latest_entry(csv_path, filename_prefix)
+    if entry is None:
+        return None
+
+    return entry["path"]
@@ -0,0 +1,438 @@
+"""
+
+This script contains the near-real-time rolling totals of recharge_file_reader.py. It is run with:
+
+    python recharge_file_reader.py rolling [--date DDMMYYYY] [--interval SECONDS]
+
+It shall:
+1. Keep ring buffers of time buckets (1 minute by default) with the event count and the RechargeAmount sum
+   per Location and per PaymentMethod, covering the longest window (1 hour by default).
+2. Update the buckets incrementally with the files that were not ingested yet (one micro-batch per file), so
+   no event is read twice. Events older than the ring are counted as late and skipped.
+3. Flush the 5-minute and 1-hour windows after every micro-batch to rolling_totals.json in the csv path and,
+   with send_to_database enabled, to the rolling_recharge_totals table.
+
+A window query sums the last buckets of every key, it never rescans the events. The windows end at the newest event
+time seen (event clock), so a backlog of files is replayed with the same results as a live feed.
+
+"""
+
+import json
+import logging
+import os
+import time
+from datetime import datetime, timedelta
+
+import recharge_file_reader as reader
+import run_metrics
+from lazy_imports import LazyModule
+from report_sinks import write_json_atomic
+
+np = LazyModule("numpy")
+psycopg2 = LazyModule("psycopg2")
+
+script_log = logging.getLogger("script_handler")
+
+DB_NAME = "recharge_file_stats_db"
+EPOCH = datetime(2000, 1, 1)
+STATE_FILENAME = "rolling_state.json"
+OUTPUT_FILENAME = "rolling_totals.json"
+
+# Column of the csv per dimension of the rolling totals
+DIMENSIONS = {
+    "location": "Location",
+    "payment_method": "PaymentMethod",
+}
+
+def event_minutes(event_date_time):
+    """
+    This function gets the minute of every event, counted from EPOCH.
+
+    Args:
+        event_date_time (pandas.core.series.Series): EventDateAndTime column
+
+    Returns:
+        minutes (numpy.ndarray): int64 minute of every event
+    """
+
+    event_time = reader.parse_event_date_time(event_date_time)
+
+    return ((event_time - EPOCH) // timedelta(minutes=1)).to_numpy().astype("int64")
+
+class RingBuffer:
+    """
+    Counts and sums of the last `buckets` time buckets of every key of one dimension. Bucket b is stored in
+    slot b % buckets; the slots of the buckets that fall out of the ring are cleared when the newest bucket advances.
+    """
+
+    __slots__ = ("buckets", "keys", "counts", "sums")
+
+    def __init__(self, buckets, keys=None, counts=None, sums=None):
+        self.buckets = buckets
+        self.keys = {key: index for index, key in enumerate(keys or [])}
+        self.counts = np.array(counts, dtype="int64") if counts else np.zeros((0, buckets), dtype="int64")
+        self.sums = np.array(sums, dtype="int64") if sums else np.zeros((0, buckets), dtype="int64")
+
+    def key_codes(self, values):
+        """
+        This function gets the row of every key, adding rows for the new keys.
+
+        Args:
+            values (numpy.ndarray): Key of every event
+
+        Returns:
+            codes (numpy.ndarray): Row of the key of every event
+        """
+
+        unique_values, inverse = np.unique(values, return_inverse=True)
+        new_keys = [value for value in unique_values.tolist() if value not in self.keys]
+        for key in new_keys:
+            self.keys[key] = len(self.keys)
+        if new_keys:
+            padding = np.zeros((len(new_keys), self.buckets), dtype="int64")
+            self.counts = np.vstack([self.counts, padding])
+            self.sums = np.vstack([self.sums, padding])
+
+        return np.array([self.keys[value] for value in unique_values.tolist()], dtype="int64")[inverse]
+
+    def clear(self, first_bucket, last_bucket):
+        """
+        This function clears the slots of the buckets first_bucket to last_bucket (included).
+        """
+
+        if last_bucket - first_bucket + 1 >= self.buckets:
+            self.counts[:] = 0
+            self.sums[:] = 0
+            return
+
+        slots = np.arange(first_bucket, last_bucket + 1) % self.buckets
+        self.counts[:, slots] = 0
+        self.sums[:, slots] = 0
+
+    def add(self, values, buckets, amounts):
+        """
+        This function adds events to their buckets. The buckets must be in the ring.
+
+        Args:
+            values (numpy.ndarray): Key of every event
+            buckets (numpy.ndarray): Bucket of every event
+            amounts (numpy.ndarray): RechargeAmount of every event
+        """
+
+        codes = self.key_codes(values)
+        slots = buckets % self.buckets
+        np.add.at(self.counts, (codes, slots), 1)
+        np.add.at(self.sums, (codes, slots), amounts)
+
+    def window(self, newest_bucket, length):
+        """
+        This function sums the last buckets of every key.
+
+        Args:
+            newest_bucket (int): Bucket the window ends with
+            length (int): Number of buckets of the window
+
+        Returns:
+            totals (dict): {"count": ..., "amount": ...} per key
+        """
+
+        slots = np.arange(newest_bucket - length + 1, newest_bucket + 1) % self.buckets
+        counts = self.counts[:, slots].sum(axis=1)
+        sums = self.sums[:, slots].sum(axis=1)
+
+        return {key: {"count": int(counts[index]), "amount": int(sums[index])} for key, index in self.keys.items()}
+
+    def to_json(self):
+        return {"keys": list(self.keys), "counts": self.counts.tolist(), "sums": self.sums.tolist()}
+
+class RollingTotals:
+    """
+    Ring buffers of every dimension, sharing the newest bucket, and the list of the files already ingested.
+    """
+
+    def __init__(self, bucket_minutes=1, windows_minutes=(5, 60)):
+        for window_minutes in windows_minutes:
+            if window_minutes % bucket_minutes:
+                raise ValueError(f"Window of {window_minutes} minute(s) is not a multiple of the {bucket_minutes}-minute buckets")
+
+        self.bucket_minutes = bucket_minutes
+        self.windows_minutes = list(windows_minutes)
+        self.buckets = max(windows_minutes) // bucket_minutes
+        self.rings = {dimension: RingBuffer(self.buckets) for dimension in DIMENSIONS}
+        self.newest_bucket = None
+        self.files = []
+
+    def add(self, data):
+        """
+        This function adds the events of a micro-batch to the ring buffers.
+
+        Args:
+            data (pandas.core.frame.DataFrame): Events with the columns of the EventFile_Recharge files
+
+        Returns:
+            late (int): Number of events older than the ring, not added
+        """
+
+        if len(data) == 0:
+            return 0
+
+        buckets = event_minutes(data["EventDateAndTime"]) // self.bucket_minutes
+        newest_bucket = int(buckets.max())
+
+        if self.newest_bucket is None:
+            self.newest_bucket = newest_bucket
+        elif newest_bucket > self.newest_bucket:
+            for ring in self.rings.values():
+                ring.clear(self.newest_bucket + 1, newest_bucket)
+            self.newest_bucket = newest_bucket
+
+        in_ring = buckets > self.newest_bucket - self.buckets
+        amounts = data["RechargeAmount"].to_numpy()[in_ring]
+        for dimension, column in DIMENSIONS.items():
+            self.rings[dimension].add(data[column].to_numpy()[in_ring], buckets[in_ring], amounts)
+
+        return int((~in_ring).sum())
+
+    def window_end(self):
+        """
+        This function gets the end of the windows (end of the newest bucket).
+        """
+
+        if self.newest_bucket is None:
+            return None
+
+        return EPOCH + timedelta(minutes=(self.newest_bucket + 1) * self.bucket_minutes)
+
+    def window(self, dimension, window_minutes):
+        """
+        This function gets the totals of a window ending with the newest bucket.
+
+        Args:
+            dimension (str): One of the keys of DIMENSIONS
+            window_minutes (int): Length of the window, at most the length of the ring
+
+        Returns:
+            totals (dict): {"count": ..., "amount": ...} per key
+        """
+
+        if self.newest_bucket is None:
+            return {}
+
+        return self.rings[dimension].window(self.newest_bucket, window_minutes // self.bucket_minutes)
+
+    def windows(self):
+        """
+        This function gets the totals of every window and dimension.
+
+        Returns:
+            windows (dict): {"<n>min": {dimension: totals}}
+        """
+
+        return {
+            f"{window_minutes}min": {dimension: self.window(dimension, window_minutes) for dimension in DIMENSIONS}
+            for window_minutes in self.windows_minutes
+        }
+
+    def to_json(self):
+        return {
+            "bucket_minutes": self.bucket_minutes,
+            "buckets": self.buckets,
+            "newest_bucket": self.newest_bucket,
+            "files": self.files,
+            "rings": {dimension: ring.to_json() for dimension, ring in self.rings.items()},
+        }
+
+    @classmethod
+    def from_json(cls, state, windows_minutes):
+        """
+        This function restores the rolling totals saved with to_json(). A state saved with other buckets is discarded.
+
+        Args:
+            state (dict): Saved state
+            windows_minutes (list): Window lengths in minutes
+
+        Returns:
+            rolling (RollingTotals): Restored rolling totals
+        """
+
+        rolling = cls(state["bucket_minutes"], windows_minutes)
+        if rolling.buckets != state["buckets"]:
+            script_log.warning("The rolling windows changed in the config file, the rolling totals are restarted.")
+            return rolling
+
+        rolling.newest_bucket = state["newest_bucket"]
+        rolling.files = state["files"]
+        rolling.rings = {
+            dimension: RingBuffer(rolling.buckets, ring["keys"], ring["counts"], ring["sums"])
+            for dimension, ring in state["rings"].items()
+        }
+
+        return rolling
+
+def import_rolling_config(config):
+    """
+    This function will import the rolling totals settings given in the config file.
+
+    Args:
+        config (dict): .toml file for the inputs
+
+    Returns:
+        bucket_minutes (int): Width of a bucket in minutes
+        windows_minutes (list): Window lengths in minutes
+        state_path (str): Path of the saved state
+    """
+
+    rolling_config = config.get("rolling", {})
+    state_path = rolling_config.get("state_path", os.path.join(config["directories"]["csv_path"], STATE_FILENAME))
+
+    return rolling_config.get("bucket_minutes", 1), rolling_config.get("windows_minutes", [5, 60]), state_path
+
+def load_rolling_totals(config):
+    """
+    This function loads the rolling totals saved by the previous micro-batch, or starts new ones.
+
+    Args:
+        config (dict): .toml file for the inputs
+
+    Returns:
+        rolling (RollingTotals): Rolling totals
+    """
+
+    bucket_minutes, windows_minutes, state_path = import_rolling_config(config)
+    if not os.path.exists(state_path):
+        return RollingTotals(bucket_minutes, windows_minutes)
+
+    with open(state_path, "r") as file:
+        state = json.load(file)
+    if state["bucket_minutes"] != bucket_minutes:
+        script_log.warning("The rolling bucket width changed in the config file, the rolling totals are restarted.")
+        return RollingTotals(bucket_minutes, windows_minutes)
+
+    return RollingTotals.from_json(state, windows_minutes)
+
+def upsert_windows(connection, rolling):
+    """
+    This function writes the current windows to the rolling_recharge_totals table, one row per window and key.
+
+    Args:
+        connection (psycopg2.extensions.connection): Connection to the recharge file stats database
+        rolling (RollingTotals): Rolling totals
+    """
+
+    window_end = rolling.window_end()
+    rows = [
+        (window_minutes, dimension, str(key), totals["count"], totals["amount"], window_end)
+        for window_minutes in rolling.windows_minutes
+        for dimension in DIMENSIONS
+        for key, totals in rolling.window(dimension, window_minutes).items()
+    ]
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "CREATE TABLE IF NOT EXISTS rolling_recharge_totals ("
+            "window_minutes INT NOT NULL, dimension VARCHAR(32) NOT NULL, key VARCHAR(255) NOT NULL, "
+            "event_count BIGINT NOT NULL, recharge_amount BIGINT NOT NULL, window_end TIMESTAMP NOT NULL, "
+            "updated_at TIMESTAMP NOT NULL DEFAULT now(), PRIMARY KEY (window_minutes, dimension, key));"
+        )
+        psycopg2.extras.execute_values(
+            cursor,
+            "INSERT INTO rolling_recharge_totals (window_minutes, dimension, key, event_count, recharge_amount, window_end) "
+            "VALUES %s ON CONFLICT (window_minutes, dimension, key) DO UPDATE SET event_count = EXCLUDED.event_count, "
+            "recharge_amount = EXCLUDED.recharge_amount, window_end = EXCLUDED.window_end, updated_at = now();",
+            rows,
+        )
+    connection.commit()
+
+def flush(config, rolling, connection=None):
+    """
+    This function saves the state of the rolling totals and writes the current windows.
+
+    Args:
+        config (dict): .toml file for the inputs
+        rolling (RollingTotals): Rolling totals
+        connection (psycopg2.extensions.connection): Connection to the recharge file stats database, None to skip it
+    """
+
+    _, _, state_path = import_rolling_config(config)
+    csv_path = config["directories"]["csv_path"]
+    # The state path is derived from cache_path, neither may exist before the first flush
+    for directory in [os.path.dirname(state_path), csv_path]:
+        os.makedirs(directory, exist_ok=True)
+    write_json_atomic(rolling.to_json(), state_path)
+
+    window_end = rolling.window_end()
+    write_json_atomic(
+        {"window_end": window_end.isoformat() if window_end else None, "windows": rolling.windows()},
+        os.path.join(csv_path, OUTPUT_FILENAME),
+    )
+
+    if connection is not None and window_end is not None:
+        upsert_windows(connection, rolling)
+
+def ingest_new_files(config, rolling, target_date=None, connection=None):
+    """
+    This function adds the files of the day that were not ingested yet, one micro-batch per file.
+
+    Args:
+        config (dict): .toml file for the inputs
+        rolling (RollingTotals): Rolling totals
+        target_date (datetime): Date of the files to read. Defaults to the current date.
+        connection (psycopg2.extensions.connection): Connection to the recharge file stats database, None to skip it
+
+    Returns:
+        file_count (int): Number of files ingested
+    """
+
+    files = reader.get_csv_files_to_read(reader.import_input_path(config), target_date)
+
+    # Only the files of the day are kept in the state, the files of the previous days are not picked up again
+    day_files = {os.path.basename(file) for file in files}
+    rolling.files = [source_file for source_file in rolling.files if source_file in day_files]
+
+    ingested = set(rolling.files)
+    new_files = [file for file in files if os.path.basename(file) not in ingested]
+
+    for file in new_files:
+        script_log.info(f"Picked up file: {file}")
+        late = rolling.add(reader.read_csv(file))
+        if late:
+            script_log.warning(f"Skipped {late} event(s) of {file} older than the rolling windows.")
+            run_metrics.increment("rolling_late_events", late)
+        rolling.files.append(os.path.basename(file))
+        flush(config, rolling, connection)
+
+    return len(new_files)
+
+def run_rolling(config, target_date=None, interval=0):
+    """
+    This function updates the rolling totals with the new files of the day. With an interval, the input path is
+    polled until the script is interrupted.
+
+    Args:
+        config (dict): .toml file for the inputs
+        target_date (datetime): Date of the files to read. Defaults to the current date.
+        interval (float): Seconds between two polls, 0 for a single pass
+    """
+
+    rolling = load_rolling_totals(config)
+
+    # Without the database (disabled or unreachable), the windows are only flushed to the files
+    connection = None
+    if config["operation"]["send_to_database"] == "YES":
+        connection = reader.open_stats_db(config, DB_NAME)
+
+    try:
+        while True:
+            file_count = ingest_new_files(config, rolling, target_date, connection)
+            if file_count:
+                script_log.info(f"Rolling totals updated with {file_count} file(s), windows end at {rolling.window_end()}.")
+            if not interval:
+                break
+            time.sleep(interval)
+
+    except KeyboardInterrupt:
+        pass
+
+    finally:
+        if connection is not None:
+            connection.close()
@@ -0,0 +1,114 @@
+"""
+
+This script contains the metrics of a run of recharge_file_reader.py.
+
+It shall:
+1. Keep gauges (last value) and counters (running total) set by the engines during a run.
+2. Write the metrics of the run as json next to the log files (recharge_metrics.json) so they can be
+   collected by monitoring or served by the read API (/metrics).
+
+"""
+
+import os
+import threading
+from datetime import datetime
+
+from report_sinks import write_json_atomic
+
+METRICS_FILENAME = "recharge_metrics.json"
+
+_lock = threading.Lock()
+_gauges = {}
+_counters = {}
+
+def set_gauge(name, value):
+    """
+    This function sets the value of a gauge.
+
+    Args:
+        name (str): Name of the gauge
+        value (float): Value of the gauge
+    """
+
+    with _lock:
+        _gauges[name] = value
+
+def increment(name, value=1):
+    """
+    This function adds a value to a counter.
+
+    Args:
+        name (str): Name of the counter
+        value (float): Value to add
+    """
+
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+def snapshot():
+    """
+    This function gets a copy of the current metrics.
+
+    Returns:
+        metrics (dict): "gauges" and "counters" of the run
+    """
+
+    with _lock:
+        return {"gauges": dict(_gauges), "counters": dict(_counters)}
+
+def reset():
+    """
+    This function clears all the metrics.
+    """
+
+    with _lock:
+        _gauges.clear()
+        _counters.clear()
+
+def write_metrics_file(log_path):
+    """
+    This function writes the current metrics next to the log files.
+
+    Args:
+        log_path (dir): Directory of the log files
+
+    Returns:
+        metrics_path (str): Path of the metrics file
+    """
+
+    os.makedirs(log_path, exist_ok=True)
+    metrics_path = os.path.join(log_path, METRICS_FILENAME)
+    write_json_atomic(dict(snapshot(), written_at=datetime.now().isoformat(timespec="seconds")), metrics_path)
+
+    return metrics_path
+
+def current_rss_bytes():
+    """
+    This function gets the resident memory of the process. Uses /proc on Linux, psutil when installed,
+    otherwise the peak resident memory from the resource module.
+
+    Returns:
+        rss (int): Resident memory in bytes, None if it cannot be measured
+    """
+
+    try:
+        with open("/proc/self/statm", "r") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        pass
+
+    try:
+        import psutil
+
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        pass
+
+    try:
+        import resource
+        import sys
+
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+    except ImportError:
+        return None
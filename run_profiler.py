@@ -0,0 +1,260 @@
+"""
+
+This script contains the profiling hooks of recharge_file_reader.py. It is enabled with:
+
+    python recharge_file_reader.py run --profile [cprofile|sampling]
+
+It shall:
+1. Profile every stage of a run (ex. read, location_report, database) with cProfile and trace its allocations
+   with tracemalloc. The threads started during a stage (ex. the readers of the async engine, the producer of the
+   streaming engine) get their own cProfile profiler, merged into the pstats of the stage.
+   With "sampling", pyinstrument is used instead of cProfile when it is installed. It only samples the thread
+   that runs the stage, which is stated at the top of its report.
+2. Write the pstats, the top allocations (and the pyinstrument report) of every stage next to the log files:
+       <log_path>/profiles/<run>/<stage>.pstats
+       <log_path>/profiles/<run>/<stage>.allocations.txt
+       <log_path>/profiles/<run>/<stage>.sampling.txt
+3. Log a summary of the hottest functions of every stage and of the whole run.
+
+Without --profile, profile_stage() does nothing, so the stages can be wrapped unconditionally.
+
+"""
+
+import cProfile
+import logging
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+from functools import partial
+
+script_log = logging.getLogger("script_handler")
+
+PROFILES_DIRNAME = "profiles"
+TOP_FUNCTIONS = 10
+TOP_ALLOCATIONS = 25
+
+_profiler = None
+
+class RunProfiler:
+    """
+    Profiler of one run. Stages are profiled one at a time, a stage started inside another one is part of it.
+    """
+
+    def __init__(self, profile_path, mode="cprofile"):
+        os.makedirs(profile_path, exist_ok=True)
+        self.profile_path = profile_path
+        self.mode = mode
+        self.active_stage = None
+        self.stages = []
+
+        if mode == "sampling":
+            try:
+                import pyinstrument  # noqa: F401
+            except ImportError:
+                script_log.warning("pyinstrument is not installed, the stages are profiled with cProfile.")
+                self.mode = "cprofile"
+
+        tracemalloc.start()
+
+    def stage_path(self, stage, suffix):
+        """
+        This function gets the path of an output file of a stage.
+        """
+
+        return os.path.join(self.profile_path, f"{stage}.{suffix}")
+
+    @contextmanager
+    def stage(self, stage):
+        """
+        This function profiles the code run inside the with block as a stage.
+
+        Args:
+            stage (str): Name of the stage, used in the output filenames
+        """
+
+        if self.active_stage is not None:
+            yield
+            return
+
+        self.active_stage = stage
+        tracemalloc.reset_peak()
+        before = tracemalloc.take_snapshot()
+
+        if self.mode == "sampling":
+            from pyinstrument import Profiler
+
+            profiler = Profiler()
+            start_profiler, stop_profiler = profiler.start, profiler.stop
+        else:
+            profiler = cProfile.Profile()
+            start_profiler, stop_profiler = profiler.enable, profiler.disable
+
+        thread_profilers = []
+        if self.mode == "cprofile":
+            threading.setprofile(partial(profile_new_thread, thread_profilers))
+
+        start = time.perf_counter()
+        start_profiler()
+        try:
+            yield
+
+        finally:
+            stop_profiler()
+            threading.setprofile(None)
+            seconds = time.perf_counter() - start
+            peak_bytes = tracemalloc.get_traced_memory()[1]
+            after = tracemalloc.take_snapshot()
+            self.active_stage = None
+
+            self.save_stage(stage, profiler, before, after, thread_profilers)
+            self.stages.append((stage, seconds, peak_bytes))
+            self.log_stage(stage, seconds, peak_bytes, len(thread_profilers))
+
+    def save_stage(self, stage, profiler, before, after, thread_profilers=()):
+        """
+        This function writes the profile and the top allocations of a stage.
+
+        Args:
+            stage (str): Name of the stage
+            profiler (cProfile.Profile or pyinstrument.Profiler): Stopped profiler of the stage
+            before (tracemalloc.Snapshot): Allocations at the start of the stage
+            after (tracemalloc.Snapshot): Allocations at the end of the stage
+            thread_profilers (list): cProfile profilers of the threads started during the stage
+        """
+
+        if self.mode == "sampling":
+            with open(self.stage_path(stage, "sampling.txt"), "w") as file:
+                file.write("# Sampled in the thread of the stage only, the work of the worker threads is not included.\n")
+                file.write(profiler.output_text(unicode=False, color=False))
+        else:
+            stats = pstats.Stats(profiler)
+            for thread_profiler in list(thread_profilers):
+                stats.add(thread_profiler)
+            stats.dump_stats(self.stage_path(stage, "pstats"))
+
+        with open(self.stage_path(stage, "allocations.txt"), "w") as file:
+            for statistic in after.compare_to(before, "lineno")[:TOP_ALLOCATIONS]:
+                file.write(f"{statistic}\n")
+
+    def log_stage(self, stage, seconds, peak_bytes, threads=0):
+        """
+        This function logs the time, the peak traced memory and the hottest functions of a stage.
+        """
+
+        script_log.info(f"[profile] {stage}: {seconds:.3f}s, peak traced memory {peak_bytes / 2**20:.1f} MiB"
+                        + (f", {threads} worker thread(s) profiled" if threads else ""))
+        if self.mode == "cprofile":
+            for line in hottest_functions([self.stage_path(stage, "pstats")], 5):
+                script_log.info(f"[profile]     {line}")
+
+    def summarize(self):
+        """
+        This function logs the hottest functions of the whole run and stops tracing the allocations.
+
+        Returns:
+            profile_path (dir): Directory of the profiles of the run
+        """
+
+        tracemalloc.stop()
+
+        pstats_files = [self.stage_path(stage, "pstats") for stage, _, _ in self.stages]
+        pstats_files = [path for path in pstats_files if os.path.exists(path)]
+        if pstats_files:
+            script_log.info("[profile] Hottest functions of the run (self time):")
+            for line in hottest_functions(pstats_files, TOP_FUNCTIONS):
+                script_log.info(f"[profile]     {line}")
+        script_log.info(f"[profile] Profiles written to {self.profile_path}")
+
+        return self.profile_path
+
+def profile_new_thread(thread_profilers, frame, event, arg):
+    """
+    This function is the threading.setprofile() hook of a stage. It runs once in every thread started during
+    the stage and replaces itself with a cProfile profiler of that thread.
+
+    Args:
+        thread_profilers (list): Profilers of the threads of the stage, the new profiler is appended to it
+        frame, event, arg: Arguments of a profile function (see sys.setprofile)
+    """
+
+    profiler = cProfile.Profile()
+    thread_profilers.append(profiler)
+    profiler.enable()
+
+def hottest_functions(pstats_files, top):
+    """
+    This function gets the functions with the highest self time from pstats files.
+
+    Args:
+        pstats_files (list): Paths of pstats files, merged together
+        top (int): Number of functions
+
+    Returns:
+        lines (list): One formatted line per function
+    """
+
+    stats = pstats.Stats(*pstats_files)
+    entries = sorted(stats.stats.items(), key=lambda item: item[1][2], reverse=True)[:top]
+
+    return [
+        f"{function} ({os.path.basename(filename)}:{line}) {self_seconds:.3f}s self, "
+        f"{cumulative_seconds:.3f}s cumulative, {calls} call(s)"
+        for (filename, line, function), (_, calls, self_seconds, cumulative_seconds, _) in entries
+    ]
+
+def start_profiling(log_path, mode="cprofile"):
+    """
+    This function enables the profiling of the stages of the run.
+
+    Args:
+        log_path (dir): Directory of the log files, the profiles are written in its profiles directory
+        mode (str): "cprofile" or "sampling" (pyinstrument)
+
+    Returns:
+        profiler (RunProfiler): Profiler of the run
+    """
+
+    global _profiler
+
+    run_name = datetime.now().strftime("%d-%m-%Y_%H-%M-%S")
+    _profiler = RunProfiler(os.path.join(log_path, PROFILES_DIRNAME, run_name), mode)
+
+    return _profiler
+
+def stop_profiling():
+    """
+    This function logs the summary of the run and disables the profiling.
+
+    Returns:
+        profile_path (dir): Directory of the profiles of the run, None if profiling was not enabled
+    """
+
+    global _profiler
+
+    if _profiler is None:
+        return None
+
+    profile_path = _profiler.summarize()
+    _profiler = None
+
+    return profile_path
+
+@contextmanager
+def profile_stage(stage):
+    """
+    This function profiles a stage of the run when profiling is enabled, otherwise it does nothing.
+
+    Args:
+        stage (str): Name of the stage
+    """
+
+    if _profiler is None:
+        yield
+        return
+
+    with _profiler.stage(stage):
+        yield
@@ -1,18 +1,22 @@
+import argparse
 import os
 import random
 import string
 from datetime import datetime, timedelta
 import tomli
 
-def load_toml():
+def load_toml(config_path="sample_file_generator_config.toml"):
     """
     Loads the config file .toml
 
+    Args:
+        config_path (str): Path of the config file. Defaults to sample_file_generator_config.toml in the current directory.
+
     Returns:
         config (dict): Parameters inside the .toml file
     """
     
-    with open("sample_file_generator_config.toml", "rb") as file:
+    with open(config_path, "rb") as file:
         config = tomli.load(file)
     return config
 
@@ -34,11 +38,14 @@ def generate_msidn():
     
     return msidn
 
-def generate_event_date_time():
+def generate_event_date_time(event_date=None):
     """
     This function will generate a random date from current date to 30 days ago. Or will
     generate the current date. Depending on your choice, just uncomment.
     
+    Args:
+        event_date (datetime): Day of the events. When given, a random time of that day is generated instead.
+    
     Returns:
         now (str): This will be used as a data entry for the .csv file. Date follows
         the format: DaysMonthYearHourMinute (DDMMYYYYHHMM)
@@ -51,6 +58,11 @@ def generate_event_date_time():
     random_date = start + timedelta(seconds=random.randint(0, int((end - start).total_seconds())))
     now = random_date.strftime("%d%m%Y%H%M")
     """
+    if event_date is not None:
+        day = datetime(event_date.year, event_date.month, event_date.day)
+        random_time = day + timedelta(minutes=random.randint(0, 24 * 60 - 1))
+        return random_time.strftime("%d%m%Y%H%M")
+    
     #For current date
     now = datetime.now().strftime("%d%m%Y%H%M")
     
@@ -193,26 +205,27 @@ def get_next_unique_num_from_files(base_path):
     next_num = f"{next_num:03}"
     return next_num
 
-def generate_file_name(base_path):
+def generate_file_name(base_path, file_date=None):
     """
     This function generates the filename based on the unique number output
     of the get_next_unique_num_from_files() function.
 
     Args:
         base_path (dir): Directory where the file(s) is/are located.
+        file_date (datetime): Date and time in the filename. Defaults to the current date and time.
 
     Returns:
         file_name (str): String to use for the new unique filename
     """
     
     unique_num = get_next_unique_num_from_files(base_path)
-    date = datetime.now().strftime("%d%m%Y_%H%M")
+    date = (file_date or datetime.now()).strftime("%d%m%Y_%H%M")
     
     file_name = f"EventFile_Recharge_{unique_num}_{date}.csv"
 
     return file_name
 
-def create_sample_recharge_file(base_path, num_of_lines):
+def create_sample_recharge_file(base_path, num_of_lines, file_date=None):
     """
     This function will generate the file with contents generated randomly by different
     functions and compiled by running the generate_content_for_file() function.
@@ -220,10 +233,11 @@ def create_sample_recharge_file(base_path, num_of_lines):
     Args:
         base_path (dir): Directory where the file will be generated
         num_of_lines (int): Number of lines of content to be generated
+        file_date (datetime): Day of the file and of its events. Defaults to the current date.
     """
     os.makedirs(base_path, exist_ok=True)
     
-    file_name = generate_file_name(base_path)
+    file_name = generate_file_name(base_path, file_date)
     file_path = os.path.join(base_path, file_name)
         
     with open(file_path, "w") as f:
@@ -232,7 +246,7 @@ def create_sample_recharge_file(base_path, num_of_lines):
     x=0
     while x < num_of_lines:
         msidn = generate_msidn()
-        event_date_time = generate_event_date_time()
+        event_date_time = generate_event_date_time(file_date)
         service_class = generate_service_class()
         recharge_amt = generate_recharge_amt()
         payment_method = generate_payment_method()
@@ -243,7 +257,7 @@ def create_sample_recharge_file(base_path, num_of_lines):
                               recharge_amt, payment_method, subscriber_category, location)
         x += 1
 
-def create_subdirectories(base_path, depth, files_per_dir, num_of_lines):
+def create_subdirectories(base_path, depth, files_per_dir, num_of_lines, file_date=None):
     """
     This function will create file(s) within the created subdirectories 
     depending on the inputs.
@@ -254,6 +268,8 @@ def create_subdirectories(base_path, depth, files_per_dir, num_of_lines):
         files_per_dir (int): Number of files to be added in the subdirectories
         num_of_lines (int): Input for create_sample_recharge_file() function. Refer
                             to the function docstring.
+        file_date (datetime): Day of the files and of their events. Defaults to the current date.
+                              The files of the day are one minute apart so their filenames are unique.
     """
     os.makedirs(base_path, exist_ok=True)
     
@@ -264,21 +280,37 @@ def create_subdirectories(base_path, depth, files_per_dir, num_of_lines):
         
         # Create files in each subdirectory
         for i in range(1, files_per_dir + 1):
-            create_sample_recharge_file(sub_dir, num_of_lines)
+            file_time = None
+            if file_date is not None:
+                file_time = file_date + timedelta(minutes=(d - 1) * files_per_dir + i - 1)
+            create_sample_recharge_file(sub_dir, num_of_lines, file_time)
 
-def main():
+def main(config_path="sample_file_generator_config.toml"):
+    """
+    This function will generate the sample files given in the config file. With a seed and a date in the
+    config file, the same files are generated on every run.
+
+    Args:
+        config_path (str): Path of the config file
+    """
     
-    config = load_toml()
+    config = load_toml(config_path)
     
     base_path = config["base_path"]
     num_of_lines = config["num_of_lines"]
     depth = config["depth"]
     files_per_dir = config["files_per_dir"]
+    file_date = datetime.strptime(config["date"], "%d%m%Y") if "date" in config else None
+    
+    if "seed" in config:
+        random.seed(config["seed"])
     
-    create_subdirectories(base_path, depth, files_per_dir, num_of_lines)
+    create_subdirectories(base_path, depth, files_per_dir, num_of_lines, file_date)
     
     #Uncomment below to directly create file in the path
     #create_sample_recharge_file(base_path, num_of_lines)
     
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(prog="sample_file_generator", description="Sample recharge file generator")
+    parser.add_argument("--config", default="sample_file_generator_config.toml", help="Path of the config file")
+    main(parser.parse_args().config)
\ No newline at end of file
@@ -0,0 +1,269 @@
+"""
+
+This script contains the server-side aggregation mode of recharge_file_reader.py. It is run with:
+
+    python recharge_file_reader.py run --engine server
+
+It shall:
+1. Bulk load the raw EventFile_Recharge rows with COPY into the recharge_events table of the recharge file stats
+   database. The table is partitioned by day of EventDateAndTime and has a BRIN index on the event time.
+2. Compute the daily Location, Category and PaymentMethod summaries as materialized views refreshed concurrently.
+3. Write the reports of the day from the materialized views.
+
+The events are attributed to the day of their own EventDateAndTime, not to the day in the filename.
+
+"""
+
+import logging
+import os
+import time
+from datetime import datetime, timedelta
+
+import recharge_file_reader as reader
+from lazy_imports import LazyModule
+
+pd = LazyModule("pandas")
+
+script_log = logging.getLogger("script_handler")
+
+DB_NAME = "recharge_file_stats_db"
+
+# Materialized view, key column of the view and report column names per report
+SUMMARY_VIEWS = {
+    "location": ("mv_recharge_amount_per_location", "location", ["Location", "Total_RechargeAmount"]),
+    "category": ("mv_recharge_amount_per_category", "category", ["Category", "Total_RechargeAmount"]),
+    "payment_method": ("mv_payment_method_count", "payment_method", ["PaymentMethod", "Total_Count"]),
+}
+
+def create_events_table(cursor):
+    """
+    This function creates the partitioned recharge_events table and the summary views.
+
+    Args:
+        cursor (psycopg2.extensions.cursor): Cursor of the recharge file stats database
+    """
+
+    cursor.execute(
+        "CREATE TABLE IF NOT EXISTS recharge_events ("
+        "msidn BIGINT NOT NULL, "
+        "event_type SMALLINT NOT NULL, "
+        "event_time TIMESTAMP NOT NULL, "
+        "service_class SMALLINT NOT NULL, "
+        "recharge_amount INTEGER NOT NULL, "
+        "payment_method SMALLINT NOT NULL, "
+        "category VARCHAR(16) NOT NULL, "
+        "location VARCHAR(16) NOT NULL, "
+        "source_file VARCHAR(255) NOT NULL"
+        ") PARTITION BY RANGE (event_time);"
+    )
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_recharge_events_time ON recharge_events USING BRIN (event_time);")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_recharge_events_source ON recharge_events (source_file);")
+
+    cursor.execute(
+        "CREATE MATERIALIZED VIEW IF NOT EXISTS mv_recharge_amount_per_location AS "
+        "SELECT event_time::date AS event_date, location, SUM(recharge_amount)::BIGINT AS total "
+        "FROM recharge_events GROUP BY 1, 2;"
+    )
+    cursor.execute(
+        "CREATE MATERIALIZED VIEW IF NOT EXISTS mv_recharge_amount_per_category AS "
+        "SELECT event_time::date AS event_date, category, SUM(recharge_amount)::BIGINT AS total "
+        "FROM recharge_events GROUP BY 1, 2;"
+    )
+    cursor.execute(
+        "CREATE MATERIALIZED VIEW IF NOT EXISTS mv_payment_method_count AS "
+        "SELECT event_time::date AS event_date, payment_method, COUNT(*)::BIGINT AS total "
+        "FROM recharge_events GROUP BY 1, 2;"
+    )
+
+    # A unique index is required to refresh the views concurrently
+    for view_name, key_column, _ in SUMMARY_VIEWS.values():
+        cursor.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS {view_name}_key ON {view_name} (event_date, {key_column});")
+
+def ensure_partitions(cursor, days):
+    """
+    This function creates the daily partitions of recharge_events that do not exist yet.
+
+    Args:
+        cursor (psycopg2.extensions.cursor): Cursor of the recharge file stats database
+        days (list): Days (datetime.date) that need a partition
+    """
+
+    for day in days:
+        cursor.execute(
+            f"CREATE TABLE IF NOT EXISTS recharge_events_{day.strftime('%Y%m%d')} PARTITION OF recharge_events "
+            "FOR VALUES FROM (%s) TO (%s);",
+            (day, day + timedelta(days=1)),
+        )
+
+def load_file(cursor, file, input_path):
+    """
+    This function loads one file into recharge_events. The file is copied as is into the staging table, then
+    moved to the partitions of the days it covers. Loading the same file again replaces its rows.
+    The rows are tagged with the path of the file relative to the input path, so files with the same name
+    in different subdirectories are kept apart.
+
+    Args:
+        cursor (psycopg2.extensions.cursor): Cursor of the recharge file stats database
+        file (str): Path of the csv file
+        input_path (dir): Directory of the input path
+
+    Returns:
+        row_count (int): Number of rows loaded
+    """
+
+    source_file = os.path.relpath(file, input_path)
+
+    cursor.execute("TRUNCATE recharge_events_staging;")
+    with open(file, "r") as csv_file:
+        cursor.copy_expert("COPY recharge_events_staging FROM STDIN WITH (FORMAT csv, HEADER true);", csv_file)
+
+    cursor.execute(
+        "SELECT DISTINCT to_timestamp(event_date_time, 'DDMMYYYYHH24MI')::date FROM recharge_events_staging;"
+    )
+    ensure_partitions(cursor, [day for (day,) in cursor.fetchall()])
+
+    # Rows loaded before the relative paths were used are tagged with the filename only
+    cursor.execute("DELETE FROM recharge_events WHERE source_file IN (%s, %s);", (source_file, os.path.basename(file)))
+    cursor.execute(
+        "INSERT INTO recharge_events "
+        "SELECT msidn::BIGINT, event_type::SMALLINT, to_timestamp(event_date_time, 'DDMMYYYYHH24MI')::TIMESTAMP, "
+        "service_class::SMALLINT, recharge_amount::INTEGER, payment_method::SMALLINT, category, location, %s "
+        "FROM recharge_events_staging;",
+        (source_file,),
+    )
+
+    return cursor.rowcount
+
+def load_files(connection, files, input_path):
+    """
+    This function loads the files into recharge_events, one transaction per file.
+
+    Args:
+        connection (psycopg2.extensions.connection): Connection to the recharge file stats database
+        files (list): Paths of the csv files
+        input_path (dir): Directory of the input path
+
+    Returns:
+        row_count (int): Number of rows loaded
+    """
+
+    row_count = 0
+    with connection.cursor() as cursor:
+        # Raw text columns, the rows are converted to their types when moved to recharge_events.
+        # The table is temporary so concurrent runs each have their own.
+        cursor.execute(
+            "CREATE TEMP TABLE IF NOT EXISTS recharge_events_staging ("
+            "msidn TEXT, event_type TEXT, event_date_time TEXT, service_class TEXT, "
+            "recharge_amount TEXT, payment_method TEXT, category TEXT, location TEXT);"
+        )
+        for file in files:
+            script_log.info(f"Loading file: {file}")
+            row_count += load_file(cursor, file, input_path)
+            connection.commit()
+
+    return row_count
+
+def refresh_summary_views(connection):
+    """
+    This function refreshes the summary views concurrently so they stay readable during the refresh.
+
+    Args:
+        connection (psycopg2.extensions.connection): Connection to the recharge file stats database
+    """
+
+    connection.commit()
+    autocommit = connection.autocommit
+    connection.autocommit = True
+    try:
+        with connection.cursor() as cursor:
+            for view_name, _, _ in SUMMARY_VIEWS.values():
+                cursor.execute(f"REFRESH MATERIALIZED VIEW CONCURRENTLY {view_name};")
+
+    finally:
+        connection.autocommit = autocommit
+
+def fetch_day_reports(connection, day):
+    """
+    This function reads the summaries of a day from the views.
+
+    Args:
+        connection (psycopg2.extensions.connection): Connection to the recharge file stats database
+        day (datetime.date): Day of the reports
+
+    Returns:
+        reports (list): Location, Category and PaymentMethod dataframes with the columns of the pandas reports
+    """
+
+    reports = []
+    with connection.cursor() as cursor:
+        for view_name, key_column, columns in SUMMARY_VIEWS.values():
+            cursor.execute(
+                f"SELECT {key_column}, total FROM {view_name} WHERE event_date = %s ORDER BY {key_column};",
+                (day,),
+            )
+            reports.append(pd.DataFrame(cursor.fetchall(), columns=columns))
+    connection.commit()
+
+    return reports
+
+def connect_events_db(config):
+    """
+    This function connects to the recharge file stats database (created if needed) and creates the events table.
+
+    Args:
+        config (dict): .toml file for the inputs
+
+    Returns:
+        connection (psycopg2.extensions.connection): Connection to the recharge file stats database
+    """
+
+    db_connection = reader.connect_to_db(config)
+    reader.create_recharge_file_stats_db(DB_NAME, reader.open_cursor_db(db_connection), db_connection)
+
+    connection = reader.connect_to_new_db(DB_NAME, config)
+    if connection is None:
+        raise ConnectionError(f"Could not connect to database '{DB_NAME}'")
+
+    with connection.cursor() as cursor:
+        create_events_table(cursor)
+    connection.commit()
+
+    return connection
+
+def run_server_side(config, target_date=None):
+    """
+    This function runs the reader in server-side aggregation mode.
+
+    Args:
+        config (dict): .toml file for the inputs
+        target_date (datetime): Date of the files to read. Defaults to the current date.
+    """
+
+    report_date = (target_date or datetime.now()).date()
+    csv_path = config["directories"]["csv_path"]
+    input_path = reader.import_input_path(config)
+    files = reader.get_csv_files_to_read(input_path, target_date)
+
+    connection = connect_events_db(config)
+    try:
+        start = time.perf_counter()
+        row_count = load_files(connection, files, input_path)
+        load_seconds = time.perf_counter() - start
+        script_log.info(f"Loaded {row_count} row(s) in {load_seconds:.2f}s.")
+
+        start = time.perf_counter()
+        refresh_summary_views(connection)
+        script_log.info(f"Refreshed the summary views in {time.perf_counter() - start:.2f}s.")
+
+        reports = fetch_day_reports(connection, report_date)
+
+    finally:
+        connection.close()
+
+    for filename_prefix, dataframe in zip(reader.REPORT_PREFIXES, reports):
+        reader.save_to_csv(filename_prefix, csv_path, dataframe, reader.import_report_format(config, filename_prefix),
+                           report_date=report_date)
+    script_log.info("Done with the analysis. Refer to the report files for details.\n")
+
+    reader.send_reports_to_database(config, csv_path)
+    reader.apply_retention(csv_path, config.get("reports", {}).get("retention_days", 0))
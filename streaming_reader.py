@@ -0,0 +1,431 @@
+"""
+
+This script contains the streaming engine of recharge_file_reader.py. It is run with:
+
+    python recharge_file_reader.py run --engine streaming
+
+It shall:
+1. Read the files in chunks and only keep the running totals of the three reports in memory.
+2. Write a checkpoint of the running totals and of the file/byte offset reached every few seconds.
+   The checkpoint is written atomically (temporary file then rename).
+3. Resume a run from the last checkpoint when the previous run of the same day died, including the
+   report writing and database load stages that were already done.
+4. Tune the chunk size at runtime from the measured rows/s and resident memory against the memory budget,
+   and slow the reading down when the aggregation falls behind (bounded queue between the two).
+
+"""
+
+import io
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+
+import recharge_file_reader as reader
+import run_metrics
+from lazy_imports import LazyModule
+from report_sinks import write_json_atomic
+
+pd = LazyModule("pandas")
+
+script_log = logging.getLogger("script_handler")
+
+CHECKPOINT_FILENAME = "recharge_checkpoint.json"
+
+def totals_to_json(totals):
+    """
+    This function converts totals to a json compatible structure. The keys are kept as [key, value] pairs
+    so the integer PaymentMethod keys are not turned into strings.
+
+    Args:
+        totals (dict): Totals from recharge_file_reader.merge_partial_totals()
+
+    Returns:
+        data (dict): List of [key, value] pairs per report
+    """
+
+    return {report: [[key, value] for key, value in values.items()] for report, values in totals.items()}
+
+def totals_from_json(data):
+    """
+    This function converts the json structure of totals_to_json() back to totals.
+
+    Args:
+        data (dict): List of [key, value] pairs per report
+
+    Returns:
+        totals (dict): Totals
+    """
+
+    return {report: {key: value for key, value in pairs} for report, pairs in data.items()}
+
+def new_checkpoint(report_date):
+    """
+    This function creates the state of a run that starts from file zero.
+
+    Args:
+        report_date (datetime.date): Day covered by the run
+
+    Returns:
+        state (dict): State of the run
+    """
+
+    return {
+        "report_date": report_date.isoformat(),
+        "files_done": [],
+        "current_file": None,
+        "current_offset": 0,
+        "rows": 0,
+        "totals": reader.merge_partial_totals([]),
+        "stages_done": [],
+    }
+
+def save_checkpoint(checkpoint_path, state):
+    """
+    This function writes the state of the run atomically.
+
+    Args:
+        checkpoint_path (str): Path of the checkpoint file
+        state (dict): State of the run
+    """
+
+    data = dict(state, totals=totals_to_json(state["totals"]), saved_at=datetime.now().isoformat(timespec="seconds"))
+    write_json_atomic(data, checkpoint_path)
+
+def load_checkpoint(checkpoint_path, report_date, files):
+    """
+    This function loads the checkpoint of an interrupted run. The checkpoint is only used if it is for the
+    same day and all the files it has done are still part of the run.
+
+    Args:
+        checkpoint_path (str): Path of the checkpoint file
+        report_date (datetime.date): Day covered by the run
+        files (list): Files of the run
+
+    Returns:
+        state (dict): State of the interrupted run, None if there is no usable checkpoint
+    """
+
+    if not os.path.exists(checkpoint_path):
+        return None
+
+    try:
+        with open(checkpoint_path, "r") as file:
+            data = json.load(file)
+
+    except (OSError, ValueError) as e:
+        script_log.warning(f"Ignoring unreadable checkpoint {checkpoint_path}: {e}")
+        return None
+
+    if data.get("report_date") != report_date.isoformat() or not set(data["files_done"]).issubset(files):
+        script_log.info("Ignoring the checkpoint of a different run.")
+        return None
+
+    data["totals"] = totals_from_json(data["totals"])
+
+    return data
+
+def read_chunks(file, start_offset, chunk_bytes):
+    """
+    This function reads a csv file in chunks of whole lines starting at a byte offset.
+
+    Args:
+        file (str): Path of the csv file
+        start_offset (int): Byte offset to start from, 0 starts after the header
+        chunk_bytes (int): Approximate size of a chunk in bytes. Can be a callable returning the size
+                           so the caller can change it between chunks.
+
+    Yields:
+        chunk (pandas.core.frame.DataFrame): Rows of the chunk
+        offset (int): Byte offset right after the chunk
+    """
+
+    with open(file, "rb") as csv_file:
+        header = csv_file.readline()
+        if start_offset:
+            csv_file.seek(start_offset)
+
+        while True:
+            size = chunk_bytes() if callable(chunk_bytes) else chunk_bytes
+            lines = csv_file.readlines(size)
+            if not lines:
+                return
+
+            chunk = pd.read_csv(io.BytesIO(header + b"".join(lines)))
+            yield chunk, csv_file.tell()
+
+class AdaptiveChunker:
+    """
+    Chooses the size of the next chunk from the measured throughput and memory of the previous chunks.
+
+    The size grows while it improves the rows/s (per-call overhead dominates small chunks), steps back when it
+    stops improving, and is halved when the resident memory gets close to the memory budget or when the
+    downstream stage makes the reader wait (backpressure).
+    """
+
+    def __init__(self, initial_bytes, memory_budget_bytes=None, min_bytes=256 * 1024, max_bytes=64 * 1024 * 1024, adaptive=True):
+        self.min_bytes = min_bytes
+        self.max_bytes = max_bytes
+        self.chunk_bytes = min(max(initial_bytes, min_bytes), max_bytes)
+        self.memory_budget_bytes = memory_budget_bytes
+        self.adaptive = adaptive
+        self.previous_rate = None
+        self.previous_bytes = None
+        self.hold_chunks = 0
+
+    def size(self):
+        """
+        This function gets the size of the next chunk in bytes.
+        """
+
+        return self.chunk_bytes
+
+    def record(self, rows, seconds, wait_seconds):
+        """
+        This function records the measures of a chunk and adjusts the size of the next one.
+
+        Args:
+            rows (int): Number of rows of the chunk
+            seconds (float): Time spent reading and parsing the chunk
+            wait_seconds (float): Time the reader waited for the downstream stage to accept the chunk
+        """
+
+        rate = rows / seconds if seconds > 0 else None
+        rss = run_metrics.current_rss_bytes()
+
+        run_metrics.increment("streaming.chunks")
+        run_metrics.increment("streaming.rows", rows)
+        run_metrics.increment("streaming.backpressure_wait_seconds", wait_seconds)
+        if rate is not None:
+            run_metrics.set_gauge("streaming.rows_per_s", round(rate))
+        if rss is not None:
+            run_metrics.set_gauge("streaming.rss_bytes", rss)
+
+        if self.adaptive and rate is not None:
+            if self.memory_budget_bytes and rss is not None and rss > 0.9 * self.memory_budget_bytes:
+                self.resize(self.chunk_bytes // 2)
+                self.hold_chunks = 8
+                run_metrics.increment("streaming.memory_shrinks")
+
+            elif wait_seconds > seconds:
+                # The downstream stage is slower than the reader, bigger chunks would only wait longer in the queue
+                self.resize(self.chunk_bytes // 2)
+                self.hold_chunks = 8
+                run_metrics.increment("streaming.backpressure_shrinks")
+
+            elif self.hold_chunks > 0:
+                self.hold_chunks -= 1
+
+            elif self.previous_rate is not None and rate < 1.05 * self.previous_rate and self.previous_bytes < self.chunk_bytes:
+                # Growing did not help, go back to the previous size for a while
+                self.resize(self.previous_bytes)
+                self.hold_chunks = 16
+
+            else:
+                self.previous_rate = rate
+                self.previous_bytes = self.chunk_bytes
+                self.resize(int(self.chunk_bytes * 1.5))
+
+        run_metrics.set_gauge("streaming.chunk_bytes", self.chunk_bytes)
+
+    def resize(self, chunk_bytes):
+        """
+        This function sets the size of the next chunk within the minimum and maximum sizes.
+        """
+
+        self.chunk_bytes = min(max(chunk_bytes, self.min_bytes), self.max_bytes)
+
+def produce_chunks(files, state, chunker, chunk_queue):
+    """
+    This function reads the files that are not done yet and puts their chunks in the bounded chunk queue.
+    It runs in its own thread; a full queue blocks it, which slows the reading down to the pace of the consumer.
+
+    Queue items are (file, chunk, offset) for a chunk, (file, None, None) at the end of a file and None at the end.
+    An exception is put in the queue if the reading fails.
+
+    Args:
+        files (list): List of csv file path
+        state (dict): State of the run at the start (files done and offset of the current file)
+        chunker (AdaptiveChunker): Chooses the size of the chunks
+        chunk_queue (queue.Queue): Bounded queue to the consumer
+    """
+
+    try:
+        for file in files:
+            if file in state["files_done"]:
+                continue
+
+            start_offset = state["current_offset"] if state["current_file"] == file else 0
+            chunks = read_chunks(file, start_offset, chunker.size)
+            while True:
+                start = time.perf_counter()
+                item = next(chunks, None)
+                read_seconds = time.perf_counter() - start
+                if item is None:
+                    break
+
+                chunk, offset = item
+                start = time.perf_counter()
+                chunk_queue.put((file, chunk, offset))
+                chunker.record(len(chunk), read_seconds, time.perf_counter() - start)
+
+            chunk_queue.put((file, None, None))
+
+        chunk_queue.put(None)
+
+    except Exception as e:
+        chunk_queue.put(e)
+
+def stream_matched_csv(files, report_date, checkpoint_path, chunk_bytes=8 * 1024 * 1024, checkpoint_interval=5.0,
+                       memory_budget_bytes=None, queue_size=4, adaptive=True):
+    """
+    This function computes the totals of the three reports for the files without loading a whole file in memory.
+    The files are read by a separate thread through a bounded queue and the chunk size is tuned at runtime
+    (AdaptiveChunker). The state is checkpointed every checkpoint_interval seconds and at the end of the ingest.
+
+    Args:
+        files (list): List of csv file path that matches the day
+        report_date (datetime.date): Day covered by the run
+        checkpoint_path (str): Path of the checkpoint file
+        chunk_bytes (int): Approximate size of the first chunk in bytes
+        checkpoint_interval (float): Minimum number of seconds between two checkpoints
+        memory_budget_bytes (int): Resident memory the chunk size should stay under. None disables the check.
+        queue_size (int): Maximum number of chunks waiting for the aggregation
+        adaptive (bool): Tune the chunk size at runtime. False keeps chunk_bytes.
+
+    Returns:
+        state (dict): State of the run with the merged "totals"
+    """
+
+    state = load_checkpoint(checkpoint_path, report_date, files)
+    if state is None:
+        state = new_checkpoint(report_date)
+    elif "ingest" in state["stages_done"]:
+        if set(state["files_done"]) == set(files):
+            return state
+
+        # Files arrived after the ingest of the interrupted run: they are read on top of its totals
+        # and the reports and the database load are done again with the new totals
+        new_files = len(set(files) - set(state["files_done"]))
+        script_log.warning(f"{new_files} new file(s) since the interrupted run, reading them and writing the reports again.")
+        state["stages_done"] = []
+    else:
+        script_log.info(f"Resuming from checkpoint: {len(state['files_done'])} file(s) done, "
+                        f"{state['current_offset']} byte(s) of {state['current_file']}.")
+
+    chunker = AdaptiveChunker(chunk_bytes, memory_budget_bytes, adaptive=adaptive)
+    chunk_queue = queue.Queue(maxsize=queue_size)
+    producer = threading.Thread(target=produce_chunks, args=(files, dict(state), chunker, chunk_queue), daemon=True)
+    producer.start()
+
+    last_checkpoint = time.monotonic()
+    while True:
+        item = chunk_queue.get()
+        if item is None:
+            break
+        if isinstance(item, Exception):
+            raise item
+
+        file, chunk, offset = item
+        if chunk is None:
+            state["files_done"].append(file)
+            state["current_file"] = None
+            state["current_offset"] = 0
+            continue
+
+        if state["current_file"] != file:
+            state["current_file"] = file
+            script_log.info(f"Picked up file: {file}")
+
+        state["totals"] = reader.merge_partial_totals([state["totals"], reader.partial_totals(chunk)])
+        state["current_offset"] = offset
+        state["rows"] += len(chunk)
+
+        if time.monotonic() - last_checkpoint >= checkpoint_interval:
+            save_checkpoint(checkpoint_path, state)
+            last_checkpoint = time.monotonic()
+
+    producer.join()
+
+    state["stages_done"].append("ingest")
+    save_checkpoint(checkpoint_path, state)
+    script_log.info(f"Aggregated {state['rows']} row(s), last chunk size {chunker.chunk_bytes} byte(s).")
+
+    return state
+
+def import_checkpoint_path(config):
+    """
+    This function will import the checkpoint path given in the config file. Defaults to the log path.
+
+    Args:
+        config (dict): .toml file for the inputs
+
+    Returns:
+        checkpoint_path (str): Path of the checkpoint file
+    """
+
+    checkpoint_dir = config.get("streaming", {}).get("checkpoint_path", reader.import_log_path(config))
+    os.makedirs(checkpoint_dir, exist_ok=True)
+
+    return os.path.join(checkpoint_dir, CHECKPOINT_FILENAME)
+
+def run_streaming(config, target_date=None):
+    """
+    This function runs the reader with the streaming engine and resumes an interrupted run of the same day.
+
+    Args:
+        config (dict): .toml file for the inputs
+        target_date (datetime): Date of the files to read. Defaults to the current date.
+    """
+
+    streaming_config = config.get("streaming", {})
+    csv_path = config["directories"]["csv_path"]
+    report_date = (target_date or datetime.now()).date()
+    checkpoint_path = import_checkpoint_path(config)
+
+    files = reader.get_csv_files_to_read(reader.import_input_path(config), target_date)
+    state = stream_matched_csv(
+        files,
+        report_date,
+        checkpoint_path,
+        streaming_config.get("chunk_bytes", 8 * 1024 * 1024),
+        streaming_config.get("checkpoint_interval_seconds", 5.0),
+        streaming_config.get("memory_budget_mb", 0) * 1024 * 1024 or None,
+        streaming_config.get("queue_size", 4),
+        streaming_config.get("adaptive_chunks", "YES") == "YES",
+    )
+    metrics_path = run_metrics.write_metrics_file(reader.import_log_path(config))
+    script_log.info(f"Ingest metrics written to {metrics_path}: {run_metrics.snapshot()}")
+
+    if "reports" not in state["stages_done"]:
+        for filename_prefix, dataframe in zip(reader.REPORT_PREFIXES, reader.totals_to_dataframes(state["totals"])):
+            reader.save_to_csv(filename_prefix, csv_path, dataframe, reader.import_report_format(config, filename_prefix),
+                               report_date=report_date)
+        state["stages_done"].append("reports")
+        save_checkpoint(checkpoint_path, state)
+        script_log.info("Done with the analysis. Refer to the report files for details.\n")
+
+    def on_loaded(loader_name):
+        state["stages_done"].append(f"database_{loader_name}")
+        save_checkpoint(checkpoint_path, state)
+
+    reader.send_reports_to_database(
+        config,
+        csv_path,
+        skip_loaders=[stage[len("database_"):] for stage in state["stages_done"] if stage.startswith("database_")],
+        on_loaded=on_loaded,
+    )
+
+    reader.apply_retention(csv_path, config.get("reports", {}).get("retention_days", 0))
+
+    if config["operation"]["send_to_database"] == "YES":
+        missing = [name for name, _ in reader.DB_LOADERS if f"database_{name}" not in state["stages_done"]]
+        if missing:
+            script_log.warning(f"Keeping the checkpoint, the database load of {', '.join(missing)} did not complete.")
+            return
+
+    # The run is complete, the next run of the day starts from file zero again
+    os.remove(checkpoint_path)
@@ -0,0 +1,200 @@
+"""
+
+This script contains the shared fixtures of the test suite. It shall:
+1. Generate deterministic recharge files with a seeded sample_file_generator.
+2. Build the config of a run in its own directory, so every engine writes its reports, checkpoints and caches apart.
+3. Provide a local Postgres config, the tests using it are skipped when the server is not reachable. The tests that
+   write into the recharge file stats database get a throwaway schema (stats_database).
+   The connection is taken from the RECHARGE_DATABASE__<KEY> environment variables (see config_model.py).
+
+"""
+
+import argparse
+import os
+import uuid
+from datetime import datetime
+
+import pytest
+
+import config_model
+import recharge_file_reader as reader
+import sample_file_generator
+
+# Far from the dates of sample_data, so the events of the tests never mix with them in the database
+REPORT_DATE = datetime(2001, 2, 3)
+SEED = 2025
+
+# A host starting with / is a socket directory for libpq, this one has no server so the connection fails at once
+UNREACHABLE_DATABASE = {"db_host": "/nonexistent/recharge_file_reader_socket"}
+
+# Files per subdirectory and lines per file of the datasets, 3 subdirectories each
+GOLDEN_DATASET = (3, 2000)
+PERF_DATASET = (3, 10000)
+
+def generate_dataset(base_path, files_per_dir, num_of_lines, seed=SEED):
+    """
+    This function generates the recharge files of REPORT_DATE with the sample file generator.
+
+    Args:
+        base_path (dir): Directory of the generated files
+        files_per_dir (int): Files per subdirectory
+        num_of_lines (int): Lines per file
+        seed (int): Seed of the generator
+
+    Returns:
+        base_path (dir): Directory of the generated files
+    """
+
+    base_path.mkdir(parents=True, exist_ok=True)
+    config_path = base_path / "sample_file_generator_config.toml"
+    config_path.write_text(
+        f'base_path = "{base_path.as_posix()}"\n'
+        f"num_of_lines = {num_of_lines}\n"
+        "depth = 3\n"
+        f"files_per_dir = {files_per_dir}\n"
+        f"seed = {seed}\n"
+        f'date = "{REPORT_DATE:%d%m%Y}"\n'
+    )
+    sample_file_generator.main(str(config_path))
+    config_path.unlink()
+
+    return base_path
+
+def write_config(run_path, input_path, send_to_database="NO", database=None, extra=""):
+    """
+    This function writes the config file of a run and loads it. Environment overrides are not applied.
+
+    Args:
+        run_path (dir): Directory of the run, the log, csv and cache paths are created in it
+        input_path (dir): Directory of the recharge files
+        send_to_database (str): "YES" or "NO"
+        database (dict): Keys of the ["database"] section
+        extra (str): Other sections appended to the config file
+
+    Returns:
+        config (dict): Validated config of the run
+    """
+
+    run_path.mkdir(parents=True, exist_ok=True)
+    database_lines = "".join(f'{key} = "{value}"\n' for key, value in (database or {}).items())
+    config_path = run_path / "recharge_file_config.toml"
+    config_path.write_text(
+        "schema_version = 2\n"
+        '["directories"]\n'
+        f'input_path = "{input_path.as_posix()}"\n'
+        'log_path = "logs"\n'
+        'csv_path = "csv"\n'
+        'cache_path = "cache"\n'
+        '["database"]\n'
+        f"{database_lines}"
+        '["operation"]\n'
+        f'send_to_database = "{send_to_database}"\n'
+        f"{extra}"
+    )
+
+    return config_model.load_config(str(config_path), environ={})
+
+def run_engine(config, engine, readers=2):
+    """
+    This function runs an ingest engine on REPORT_DATE.
+
+    Args:
+        config (dict): Config of the run
+        engine (str): One of the --engine choices of recharge_file_reader.py
+        readers (int): Concurrent readers of the async engine
+    """
+
+    reader.run_engine(config, engine, REPORT_DATE, argparse.Namespace(readers=readers))
+
+def latest_reports(config):
+    """
+    This function reads the bytes of the latest Location, Category and PaymentMethod reports of a run.
+
+    Args:
+        config (dict): Config of the run
+
+    Returns:
+        reports (dict): Content (bytes) per report prefix
+    """
+
+    csv_path = config["directories"]["csv_path"]
+    reports = {}
+    for filename_prefix in reader.REPORT_PREFIXES:
+        latest_report, _ = reader.get_latest_report(csv_path, filename_prefix)
+        assert latest_report is not None, filename_prefix
+        with open(latest_report, "rb") as file:
+            reports[filename_prefix] = file.read()
+
+    return reports
+
+@pytest.fixture(scope="session")
+def golden_input(tmp_path_factory):
+    """
+    Small seeded dataset compared with the golden reports.
+    """
+
+    return generate_dataset(tmp_path_factory.mktemp("golden_input"), *GOLDEN_DATASET)
+
+@pytest.fixture(scope="session")
+def perf_input(tmp_path_factory):
+    """
+    Larger seeded dataset used for the throughput and memory checks.
+    """
+
+    return generate_dataset(tmp_path_factory.mktemp("perf_input"), *PERF_DATASET)
+
+@pytest.fixture(scope="session")
+def postgres_database():
+    """
+    Keys of the ["database"] section of a reachable local Postgres server. Skips the test otherwise.
+    """
+
+    database = {
+        key: os.environ.get(f"RECHARGE_DATABASE__{key.upper()}", default)
+        for key, default in [("db_host", "localhost"), ("db_name", "postgres"), ("db_user", "postgres"), ("db_password", "training")]
+    }
+
+    psycopg2 = pytest.importorskip("psycopg2")
+    try:
+        connection = psycopg2.connect(dbname=database["db_name"], user=database["db_user"],
+                                      password=database["db_password"], host=database["db_host"], connect_timeout=3)
+    except psycopg2.OperationalError as e:
+        pytest.skip(f"Postgres is not reachable on {database['db_host']}: {e}")
+    connection.close()
+
+    return database
+
+@pytest.fixture
+def stats_database(postgres_database, monkeypatch):
+    """
+    Keys of the ["database"] section of the local Postgres server, with every table of the recharge file stats
+    database created in a throwaway schema dropped after the test. The schema is selected with PGOPTIONS,
+    which libpq reads on every connection, worker processes included.
+    """
+
+    psycopg2 = pytest.importorskip("psycopg2")
+    parameters = dict(user=postgres_database["db_user"], password=postgres_database["db_password"],
+                      host=postgres_database["db_host"], connect_timeout=3)
+
+    connection = psycopg2.connect(dbname=postgres_database["db_name"], **parameters)
+    connection.autocommit = True
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_database WHERE datname = 'recharge_file_stats_db';")
+        if cursor.fetchone() is None:
+            cursor.execute("CREATE DATABASE recharge_file_stats_db;")
+    connection.close()
+
+    schema = f"test_{os.getpid()}_{uuid.uuid4().hex[:8]}"
+    connection = psycopg2.connect(dbname="recharge_file_stats_db", **parameters)
+    connection.autocommit = True
+    with connection.cursor() as cursor:
+        cursor.execute(f"CREATE SCHEMA {schema};")
+    monkeypatch.setenv("PGOPTIONS", f"-c search_path={schema}")
+
+    try:
+        yield postgres_database
+
+    finally:
+        with connection.cursor() as cursor:
+            cursor.execute(f"DROP SCHEMA {schema} CASCADE;")
+        connection.close()
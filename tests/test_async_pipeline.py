@@ -0,0 +1,56 @@
+import asyncio
+import shutil
+
+import pytest
+
+import async_pipeline
+import recharge_file_reader as reader
+from conftest import REPORT_DATE, write_config
+from report_catalog import get_latest_entry
+
+def test_async_engine_needs_a_reader(golden_input, tmp_path):
+    config = write_config(tmp_path, golden_input)
+
+    with pytest.raises(ValueError):
+        async_pipeline.run_pipeline(config, REPORT_DATE, readers=0)
+
+@pytest.mark.parametrize("value", ["0", "-1", "two"])
+def test_readers_option_must_be_positive(value):
+    with pytest.raises(SystemExit):
+        reader.parse_arguments(["run", "--engine", "async", "--readers", value])
+
+def test_unreadable_file_fails_the_run(golden_input, tmp_path):
+    input_path = tmp_path / "input"
+    shutil.copytree(golden_input, input_path)
+    broken_file = next((input_path / "subdir_1").iterdir())
+    with open(broken_file, "a") as file:
+        file.write("1,2,3,4,5,6,7,8,9,10\n")
+    config = write_config(tmp_path / "run", input_path)
+
+    with pytest.raises(RuntimeError, match=broken_file.name):
+        async_pipeline.run_pipeline(config, REPORT_DATE, readers=2)
+
+    assert get_latest_entry(config["directories"]["csv_path"], reader.REPORT_PREFIXES[0]) is None
+
+def test_connection_task_is_closed_or_cancelled():
+    closed = []
+
+    class Connection:
+        async def close(self):
+            closed.append(self)
+
+    async def connect():
+        return Connection()
+
+    async def close_tasks():
+        opened = asyncio.create_task(connect())
+        await asyncio.sleep(0)
+        opening = asyncio.create_task(asyncio.sleep(10))
+        for connect_task in [opened, opening]:
+            await async_pipeline.close_connect_task(connect_task)
+        return opened, opening
+
+    opened, opening = asyncio.run(close_tasks())
+
+    assert closed == [opened.result()]
+    assert opening.cancelled()
@@ -0,0 +1,77 @@
+import pytest
+
+from config_model import PROFILES, ConfigError, load_config, load_config_with_sources
+
+def write_config_file(path, text="", profile=None):
+    config_path = path / "recharge_file_config.toml"
+    config_path.write_text(
+        "schema_version = 2\n"
+        + (f'profile = "{profile}"\n' if profile else "")
+        + '["directories"]\n'
+        'input_path = "input"\n'
+        'log_path = "logs"\n'
+        'csv_path = "csv"\n'
+        f"{text}"
+    )
+    return str(config_path)
+
+def test_defaults_are_typed_and_state_paths_derived(tmp_path):
+    config, sources = load_config_with_sources(write_config_file(tmp_path), environ={})
+
+    assert config["performance"]["workers"] == 4
+    assert config["streaming"]["chunk_bytes"] == 8 * 1024 * 1024
+    assert config["directories"]["csv_path"] == str(tmp_path / "csv")
+    assert config["dedup"]["dedup_path"] == str(tmp_path / "csv" / "dedup")
+    assert ("performance", "workers") not in sources
+    assert sources[("dedup", "dedup_path")] == "derived"
+    assert config["attribution"]["aggregates_path"] == str(tmp_path / "csv" / "day_aggregates")
+
+def test_layers_override_in_order(tmp_path):
+    config_path = write_config_file(tmp_path, '["streaming"]\nqueue_size = 6\n["performance"]\nworkers = 12\n', "batch-server")
+
+    config, sources = load_config_with_sources(config_path, environ={"RECHARGE_PERFORMANCE__WORKERS": "16"})
+
+    assert config["database"]["loader"] == "batch"
+    assert sources[("database", "loader")] == "profile batch-server"
+    assert (config["streaming"]["queue_size"], sources[("streaming", "queue_size")]) == (6, "file")
+    assert (config["performance"]["workers"], sources[("performance", "workers")]) == (16, "env")
+    assert config["dedup"]["dedup_path"] == str(tmp_path / "cache" / "dedup")
+
+def test_profile_from_the_environment_wins(tmp_path):
+    config = load_config(write_config_file(tmp_path, profile="laptop"), environ={"RECHARGE_PROFILE": "batch-server"})
+
+    assert config["profile"] == "batch-server"
+    assert config["performance"]["workers"] == PROFILES["batch-server"]["performance"]["workers"]
+
+def test_large_host_keeps_the_run_state_on_disk(tmp_path):
+    config = load_config(write_config_file(tmp_path, profile="large-host"), environ={})
+
+    for path in [config["directories"]["cache_path"], config["streaming"]["checkpoint_path"],
+                 config["dedup"]["dedup_path"], config["rolling"]["state_path"], config["attribution"]["aggregates_path"]]:
+        assert path.startswith(str(tmp_path)), path
+    assert config["directories"]["scratch_path"] == "/dev/shm/recharge_file_scratch"
+
+def test_invalid_values_are_reported_together(tmp_path):
+    config_path = write_config_file(tmp_path, '["performance"]\nworkers = 0\n["operation"]\nsend_to_database = "MAYBE"\n["unknown"]\nkey = 1\n')
+
+    with pytest.raises(ConfigError) as error:
+        load_config(config_path, environ={"RECHARGE_STREAMING__CHUNK_BYTES": "big"})
+
+    message = str(error.value)
+    for expected in ["performance.workers", "operation.send_to_database", "unknown section [unknown]", "streaming.chunk_bytes"]:
+        assert expected in message
+
+@pytest.mark.parametrize("rate", ["0", "1", "1.5"])
+def test_false_positive_rate_must_be_between_0_and_1(rate, tmp_path):
+    with pytest.raises(ConfigError, match="dedup.false_positive_rate"):
+        load_config(write_config_file(tmp_path), environ={"RECHARGE_DEDUP__FALSE_POSITIVE_RATE": rate})
+
+def test_unknown_profile_and_missing_keys_are_rejected(tmp_path):
+    with pytest.raises(ConfigError, match="Unknown profile"):
+        load_config(write_config_file(tmp_path), environ={"RECHARGE_PROFILE": "mainframe"})
+
+    (tmp_path / "missing").mkdir()
+    config_path = tmp_path / "missing" / "recharge_file_config.toml"
+    config_path.write_text('["directories"]\ninput_path = "input"\n')
+    with pytest.raises(ConfigError, match="missing log_path"):
+        load_config(str(config_path), environ={})
@@ -0,0 +1,44 @@
+import shutil
+
+from conftest import REPORT_DATE, UNREACHABLE_DATABASE, latest_reports, run_engine, write_config
+from test_engine_golden import assert_golden_reports
+from daily_attribution import day_path, day_totals, import_aggregates_path, ingest_file, load_json
+
+def copy_to_subdirs(file, input_path, subdirs):
+    for subdir in subdirs:
+        (input_path / subdir).mkdir(parents=True, exist_ok=True)
+        shutil.copy(file, input_path / subdir / file.name)
+
+def test_same_named_files_are_kept_apart(golden_input, tmp_path):
+    file = sorted((golden_input / "subdir_1").glob("*.csv"))[0]
+    input_path = tmp_path / "input"
+    copy_to_subdirs(file, input_path, ["subdir_a", "subdir_b"])
+    config = write_config(tmp_path / "run", input_path)
+
+    run_engine(config, "incremental")
+
+    store_path = import_aggregates_path(config)
+    day_files = load_json(day_path(store_path, REPORT_DATE.date()), {"files": {}})["files"]
+    assert sorted(day_files) == [f"subdir_a/{file.name}", f"subdir_b/{file.name}"]
+
+def test_contributions_keyed_on_the_filename_are_replaced(golden_input, tmp_path):
+    file = sorted((golden_input / "subdir_1").glob("*.csv"))[0]
+    store_path = tmp_path / "store"
+    store_path.mkdir()
+
+    # A store written when the contributions were keyed on the filename only
+    ingest_file(str(store_path), str(file), str(file.parent))
+    before = day_totals(str(store_path), REPORT_DATE.date())
+
+    ingest_file(str(store_path), str(file), str(golden_input))
+
+    day_files = load_json(day_path(str(store_path), REPORT_DATE.date()), {"files": {}})["files"]
+    assert list(day_files) == [f"subdir_1/{file.name}"]
+    assert day_totals(str(store_path), REPORT_DATE.date()) == before
+
+def test_reports_are_written_when_the_database_is_unreachable(golden_input, tmp_path):
+    config = write_config(tmp_path, golden_input, "YES", UNREACHABLE_DATABASE)
+
+    run_engine(config, "incremental")
+
+    assert_golden_reports(latest_reports(config))
@@ -0,0 +1,83 @@
+"""
+
+Database loaders, checked against a local Postgres server (see the stats_database fixture in conftest.py).
+The tests write into a throwaway schema of the recharge file stats database and are skipped without a server.
+
+"""
+
+import json
+import os
+import shutil
+
+import pytest
+
+import recharge_file_reader as reader
+from conftest import REPORT_DATE, latest_reports, run_engine, write_config
+from reconciliation import RECONCILIATION_DIRNAME, check_database, check_reports
+from server_side_aggregation import connect_events_db, load_files
+from test_engine_golden import assert_golden_reports
+
+pytestmark = pytest.mark.postgres
+
+def read_reconciliation(config):
+    report_path = os.path.join(config["directories"]["csv_path"], RECONCILIATION_DIRNAME, f"{REPORT_DATE.date().isoformat()}.json")
+    with open(report_path, "r") as file:
+        return json.load(file)
+
+@pytest.mark.parametrize("loader", ["rows", "batch"])
+def test_loader_rows_match_the_reports(loader, golden_input, stats_database, tmp_path):
+    config = write_config(tmp_path, golden_input, "YES", dict(stats_database, loader=loader),
+                          extra='["reconciliation"]\nenabled = "YES"\n')
+
+    run_engine(config, "serial")
+
+    reconciliation = read_reconciliation(config)
+    database_checks = [check for check in reconciliation["checks"] if check["check"].startswith("database")]
+    assert len(database_checks) == 3
+    assert reconciliation["status"] == "PASS", reconciliation["checks"]
+
+def test_server_engine_matches_golden_reports(golden_input, stats_database, tmp_path):
+    config = write_config(tmp_path, golden_input, "YES", stats_database)
+
+    run_engine(config, "server")
+
+    assert_golden_reports(latest_reports(config))
+
+def test_server_engine_keeps_same_named_files_apart(golden_input, stats_database, tmp_path):
+    config = write_config(tmp_path, golden_input, "YES", stats_database)
+    file = sorted((golden_input / "subdir_1").glob("*.csv"))[0]
+    input_path = tmp_path / "input"
+    for subdir in ["subdir_a", "subdir_b"]:
+        (input_path / subdir).mkdir(parents=True)
+        shutil.copy(file, input_path / subdir / file.name)
+    files = [str(path) for path in sorted(input_path.glob("*/*.csv"))]
+
+    connection = connect_events_db(config)
+    try:
+        load_files(connection, files, str(input_path))
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT source_file, COUNT(*) FROM recharge_events WHERE source_file IN %s GROUP BY source_file;",
+                           (tuple(os.path.relpath(path, input_path) for path in files),))
+            rows_per_file = dict(cursor.fetchall())
+    finally:
+        connection.close()
+
+    assert rows_per_file == {os.path.join(subdir, file.name): 2000 for subdir in ["subdir_a", "subdir_b"]}
+
+def test_database_check_ignores_the_rows_of_other_runs(golden_input, stats_database, tmp_path):
+    config = write_config(tmp_path, golden_input, "YES", dict(stats_database, loader="batch"))
+    run_engine(config, "serial")
+
+    # Rows loaded afterwards by another run are the highest ids of the table
+    connection = reader.connect_to_new_db("recharge_file_stats_db", config)
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("INSERT INTO total_recharge_amount_per_location (Location, Total_RechargeAmount, report_id) VALUES ('X99', 1, NULL);")
+        connection.commit()
+    finally:
+        connection.close()
+
+    _, reports = check_reports(config["directories"]["csv_path"], REPORT_DATE.date(), {"rows": 0, "amount": 0})
+    checks = check_database(config, reports)
+
+    assert [result["status"] for result in checks] == ["PASS"] * 3, checks
@@ -0,0 +1,19 @@
+import pytest
+
+import distributed_ingest
+from conftest import REPORT_DATE, UNREACHABLE_DATABASE, latest_reports, write_config
+from test_engine_golden import assert_golden_reports
+
+def test_unreachable_database_stops_the_run(golden_input, tmp_path):
+    config = write_config(tmp_path, golden_input, "YES", UNREACHABLE_DATABASE)
+
+    with pytest.raises(ConnectionError, match="recharge_file_stats_db"):
+        distributed_ingest.run_local(config, REPORT_DATE, workers=2)
+
+@pytest.mark.postgres
+def test_local_workers_match_golden_reports(golden_input, stats_database, tmp_path):
+    config = write_config(tmp_path, golden_input, "YES", stats_database)
+
+    assert distributed_ingest.run_local(config, REPORT_DATE, workers=3)
+
+    assert_golden_reports(latest_reports(config))
@@ -0,0 +1,59 @@
+"""
+
+Every ingest engine must write the same Location, Category and PaymentMethod reports, byte for byte,
+as the golden reports in tests/golden. Regenerate them after an intended change of the reports with:
+
+    RECHARGE_UPDATE_GOLDEN=1 python -m pytest tests/test_engine_golden.py
+
+"""
+
+import os
+from pathlib import Path
+
+import pytest
+
+import recharge_file_reader as reader
+from conftest import latest_reports, run_engine, write_config
+
+GOLDEN_PATH = Path(__file__).parent / "golden"
+
+# serial, async (parallel readers), streaming (chunked with checkpoints), compact (in-memory event store)
+# and incremental (per-day aggregates). The server engine needs Postgres, see test_database_loaders.py.
+LOCAL_ENGINES = ["serial", "async", "streaming", "compact", "incremental"]
+
+def assert_golden_reports(reports, update=False):
+    # Only the serial engine writes the golden reports, the other engines are always compared with them
+    if update and os.environ.get("RECHARGE_UPDATE_GOLDEN") == "1":
+        GOLDEN_PATH.mkdir(exist_ok=True)
+        for filename_prefix, content in reports.items():
+            (GOLDEN_PATH / f"{filename_prefix}.csv").write_bytes(content)
+
+    for filename_prefix in reader.REPORT_PREFIXES:
+        assert reports[filename_prefix] == (GOLDEN_PATH / f"{filename_prefix}.csv").read_bytes(), filename_prefix
+
+@pytest.mark.parametrize("engine", LOCAL_ENGINES)
+def test_engine_matches_golden_reports(engine, golden_input, tmp_path):
+    config = write_config(tmp_path, golden_input)
+
+    run_engine(config, engine)
+
+    assert_golden_reports(latest_reports(config), update=engine == "serial")
+
+@pytest.mark.parametrize("engine", ["async", "streaming", "incremental"])
+def test_rerun_gives_the_same_reports(engine, golden_input, tmp_path):
+    config = write_config(tmp_path, golden_input)
+
+    run_engine(config, engine)
+    first = latest_reports(config)
+    run_engine(config, engine)
+
+    assert latest_reports(config) == first
+
+def test_async_engine_does_not_depend_on_the_readers(golden_input, tmp_path):
+    reports = []
+    for readers in [1, 4]:
+        config = write_config(tmp_path / f"readers_{readers}", golden_input)
+        run_engine(config, "async", readers)
+        reports.append(latest_reports(config))
+
+    assert reports[0] == reports[1]
@@ -0,0 +1,98 @@
+import shutil
+
+import pandas as pd
+import pytest
+
+from event_dedup import DuplicateFilter
+
+import recharge_file_reader as reader
+from config_model import ConfigError
+from conftest import latest_reports, run_engine, write_config
+from test_engine_golden import assert_golden_reports
+
+DEDUP = '["dedup"]\nenabled = "YES"\n'
+
+def events(msidns):
+    return pd.DataFrame({
+        "MSIDN": msidns,
+        "EventDateAndTime": [30220011000] * len(msidns),
+        "RechargeAmount": [100] * len(msidns),
+        "PaymentMethod": [1] * len(msidns),
+    })
+
+def test_duplicates_are_dropped_and_reruns_are_not_repeats(tmp_path):
+    input_path = tmp_path / "input"
+    duplicate_filter = DuplicateFilter(str(tmp_path / "2001-02-03"), str(input_path), expected_events=1000)
+
+    first = duplicate_filter.filter_file(str(input_path / "subdir_1" / "first.csv"), events([1, 2, 2, 3]))
+    second = duplicate_filter.filter_file(str(input_path / "subdir_2" / "second.csv"), events([3, 4]))
+    rerun = duplicate_filter.filter_file(str(input_path / "subdir_1" / "first.csv"), events([1, 2, 3]))
+    duplicate_filter.close()
+
+    assert first["MSIDN"].tolist() == [1, 2, 3]
+    assert second["MSIDN"].tolist() == [4]
+    assert rerun["MSIDN"].tolist() == [1, 2, 3]
+
+    # The next run of the day starts from the saved filter and segments
+    reopened = DuplicateFilter(str(tmp_path / "2001-02-03"), str(input_path), expected_events=1000)
+    assert reopened.filter_file(str(input_path / "subdir_3" / "third.csv"), events([4, 5]))["MSIDN"].tolist() == [5]
+
+def test_same_named_files_are_kept_apart(tmp_path):
+    input_path = tmp_path / "input"
+    duplicate_filter = DuplicateFilter(str(tmp_path / "2001-02-03"), str(input_path), expected_events=1000)
+
+    first = duplicate_filter.filter_file(str(input_path / "subdir_a" / "events.csv"), events([1, 2]))
+    second = duplicate_filter.filter_file(str(input_path / "subdir_b" / "events.csv"), events([2, 3]))
+
+    assert (first["MSIDN"].tolist(), second["MSIDN"].tolist()) == ([1, 2], [3])
+    assert duplicate_filter.segments() == ["subdir_a/events.csv", "subdir_b/events.csv"]
+
+def test_segments_named_after_the_filename_are_replaced(tmp_path):
+    input_path = tmp_path / "input"
+    day_path = str(tmp_path / "2001-02-03")
+
+    # A segment written when the source files were keyed on the filename only
+    DuplicateFilter(day_path, str(input_path / "subdir_1"), expected_events=1000).filter_file(
+        str(input_path / "subdir_1" / "first.csv"), events([1, 2]))
+
+    duplicate_filter = DuplicateFilter(day_path, str(input_path), expected_events=1000)
+    rerun = duplicate_filter.filter_file(str(input_path / "subdir_1" / "first.csv"), events([1, 2]))
+
+    assert rerun["MSIDN"].tolist() == [1, 2]
+    assert duplicate_filter.segments() == ["subdir_1/first.csv"]
+
+@pytest.fixture(scope="module")
+def redelivered_input(golden_input, tmp_path_factory):
+    """
+    Golden dataset with one of its files delivered again under a new name (ex. a mediation retry).
+    """
+
+    input_path = tmp_path_factory.mktemp("redelivered_input") / "input"
+    shutil.copytree(golden_input, input_path)
+    file = sorted((input_path / "subdir_1").glob("*.csv"))[0]
+    shutil.copy(file, input_path / "subdir_2" / "EventFile_Recharge_099_03022001_2359.csv")
+
+    return input_path
+
+@pytest.mark.parametrize("engine", reader.DEDUP_ENGINES)
+def test_engine_drops_redelivered_events(engine, redelivered_input, tmp_path):
+    config = write_config(tmp_path, redelivered_input, extra=DEDUP)
+
+    run_engine(config, engine)
+
+    assert_golden_reports(latest_reports(config))
+
+def test_redelivered_events_are_counted_without_dedup(redelivered_input, tmp_path):
+    config = write_config(tmp_path, redelivered_input)
+
+    run_engine(config, "serial")
+
+    with pytest.raises(AssertionError):
+        assert_golden_reports(latest_reports(config))
+
+@pytest.mark.parametrize("engine", ["streaming", "server"])
+def test_engine_without_dedup_rejects_the_option(engine, golden_input, tmp_path):
+    config = write_config(tmp_path, golden_input, extra=DEDUP)
+
+    with pytest.raises(ConfigError, match="dedup"):
+        run_engine(config, engine)
@@ -0,0 +1,117 @@
+"""
+
+Throughput and peak traced memory (tracemalloc: Python objects and numpy arrays) of every ingest engine
+on the seeded perf dataset, compared with tests/perf_baseline.json. The checks are opt-in (pytest.ini deselects
+the perf marker), run them with:
+
+    python -m pytest -m perf
+
+The throughput of an engine is compared relative to the serial engine measured in the same run, so the check does
+not depend on the speed of the machine: a test fails when the engine/serial ratio drops, or the peak memory grows,
+by more than the tolerance of the baseline. Override the tolerances with RECHARGE_PERF_TOLERANCE (ex. 0.3 for 30%)
+and record a new baseline with:
+
+    RECHARGE_UPDATE_PERF_BASELINE=1 python -m pytest -m perf
+
+"""
+
+import json
+import os
+import time
+import tracemalloc
+from pathlib import Path
+
+import pytest
+
+from conftest import PERF_DATASET, run_engine, write_config
+
+BASELINE_PATH = Path(__file__).parent / "perf_baseline.json"
+ENGINES = ["serial", "async", "streaming", "compact", "incremental"]
+REPEAT = 3
+
+pytestmark = pytest.mark.perf
+
+def load_baseline():
+    with open(BASELINE_PATH, "r") as file:
+        return json.load(file)
+
+def save_baseline_entry(engine, rows_per_second, peak_memory_mb):
+    baseline = load_baseline()
+    baseline["engines"][engine] = {"rows_per_second": round(rows_per_second), "peak_memory_mb": round(peak_memory_mb, 1)}
+    with open(BASELINE_PATH, "w") as file:
+        json.dump(baseline, file, indent=2)
+        file.write("\n")
+
+def measure(engine, input_path, run_path):
+    """
+    This function measures the best time of REPEAT runs of an engine, then its peak traced memory in one more run.
+    Every run writes in its own directory so that no checkpoint or cache of a previous run is reused.
+
+    Returns:
+        seconds (float): Best time of the runs
+        peak_memory_mb (float): Peak memory traced by tracemalloc
+    """
+
+    timings = []
+    for run in range(REPEAT):
+        config = write_config(run_path / f"run_{run}", input_path)
+        start = time.perf_counter()
+        run_engine(config, engine)
+        timings.append(time.perf_counter() - start)
+
+    # Tracing slows the run down, so the memory is measured apart from the timings
+    config = write_config(run_path / "run_memory", input_path)
+    tracemalloc.start()
+    try:
+        run_engine(config, engine)
+        peak_bytes = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return min(timings), peak_bytes / 2**20
+
+@pytest.fixture(scope="module")
+def serial_seconds(perf_input, tmp_path_factory):
+    """
+    Best time of the serial engine in this run, the reference of the throughput ratios.
+    """
+
+    return measure("serial", perf_input, tmp_path_factory.mktemp("perf_serial"))[0]
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_engine_performance(engine, perf_input, serial_seconds, tmp_path):
+    files_per_dir, num_of_lines = PERF_DATASET
+    rows = 3 * files_per_dir * num_of_lines
+
+    seconds, peak_memory_mb = measure(engine, perf_input, tmp_path)
+    rows_per_second = rows / seconds
+    serial_rows_per_second = rows / serial_seconds
+
+    if os.environ.get("RECHARGE_UPDATE_PERF_BASELINE") == "1":
+        save_baseline_entry(engine, rows_per_second, peak_memory_mb)
+
+    baseline = load_baseline()
+    if engine not in baseline["engines"]:
+        pytest.skip(f"No baseline for the {engine} engine, record one with RECHARGE_UPDATE_PERF_BASELINE=1")
+
+    expected = baseline["engines"][engine]
+    tolerance = dict(baseline["tolerance"])
+    if "RECHARGE_PERF_TOLERANCE" in os.environ:
+        tolerance["rows_per_second"] = tolerance["peak_memory_mb"] = float(os.environ["RECHARGE_PERF_TOLERANCE"])
+
+    # The slack keeps the small peaks of the engines that hold little in memory from failing on noise
+    expected_ratio = expected["rows_per_second"] / baseline["engines"]["serial"]["rows_per_second"]
+    min_ratio = expected_ratio * (1 - tolerance["rows_per_second"])
+    max_peak_memory_mb = expected["peak_memory_mb"] * (1 + tolerance["peak_memory_mb"]) + tolerance["peak_memory_slack_mb"]
+
+    # The serial engine is the reference, only its memory is checked
+    if engine != "serial":
+        ratio = rows_per_second / serial_rows_per_second
+        assert ratio >= min_ratio, (
+            f"{engine}: {rows_per_second:,.0f} rows/s, {ratio:.2f}x the serial engine, below {min_ratio:.2f}x "
+            f"(baseline {expected_ratio:.2f}x)"
+        )
+    assert peak_memory_mb <= max_peak_memory_mb, (
+        f"{engine}: peak memory {peak_memory_mb:.1f} MiB, above {max_peak_memory_mb:.1f} MiB "
+        f"(baseline {expected['peak_memory_mb']} MiB)"
+    )
@@ -0,0 +1,85 @@
+import http.client
+import json
+import threading
+import time
+from datetime import date
+from pathlib import Path
+
+import pytest
+
+from read_api import create_server
+from report_catalog import get_reports_for_date, record_report
+from report_history import compact_history, history_day_path
+
+PREFIX = "total_recharge_per_location"
+
+def write_report(csv_path, name, report_date, total):
+    day_path = Path(history_day_path(str(csv_path), PREFIX, report_date))
+    day_path.mkdir(parents=True, exist_ok=True)
+    file_path = day_path / name
+    file_path.write_text(f"Location,Total_RechargeAmount\nX10,{total}\n")
+    record_report(str(csv_path), PREFIX, str(file_path), "csv", 1, report_date)
+    # The cache is cleared on a new modification time of the catalog, keep the writes of a test apart
+    time.sleep(0.02)
+    return file_path
+
+@pytest.fixture
+def api(tmp_path):
+    server = create_server(str(tmp_path), port=0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+def get(server, path, headers=None):
+    connection = http.client.HTTPConnection(*server.server_address, timeout=5)
+    try:
+        connection.request("GET", path, headers=headers or {})
+        response = connection.getresponse()
+        return response.status, response.getheader("ETag"), response.read()
+    finally:
+        connection.close()
+
+def test_etag_answers_not_modified(api, tmp_path):
+    write_report(tmp_path, "day.csv", date(2001, 2, 3), 5)
+
+    status, etag, body = get(api, "/totals/location?date=2001-02-03")
+    assert status == 200
+    assert json.loads(body)["rows"] == [{"Location": "X10", "Total_RechargeAmount": 5}]
+
+    status, not_modified_etag, body = get(api, "/totals/location?date=2001-02-03", {"If-None-Match": etag})
+    assert (status, not_modified_etag, body) == (304, etag, b"")
+
+    status, _, _ = get(api, "/totals/location?date=2001-02-03", {"If-None-Match": '"stale"'})
+    assert status == 200
+
+def test_new_report_clears_the_cache(api, tmp_path):
+    write_report(tmp_path, "first.csv", date(2001, 2, 3), 5)
+
+    _, etag, _ = get(api, "/totals/location")
+    get(api, "/totals/location")
+    _, _, health = get(api, "/health")
+    assert (json.loads(health)["cache_hits"], json.loads(health)["cache_misses"]) == (1, 1)
+
+    write_report(tmp_path, "rerun.csv", date(2001, 2, 3), 7)
+
+    status, new_etag, body = get(api, "/totals/location", {"If-None-Match": etag})
+    assert status == 200 and new_etag != etag
+    assert json.loads(body)["rows"] == [{"Location": "X10", "Total_RechargeAmount": 7}]
+    _, _, health = get(api, "/health")
+    assert json.loads(health)["cache_misses"] == 2
+
+def test_compacted_day_is_read_from_its_period_file(api, tmp_path):
+    write_report(tmp_path, "first_run.csv", date(2001, 2, 3), 5)
+    write_report(tmp_path, "last_run.csv", date(2001, 2, 3), 6)
+    write_report(tmp_path, "latest.csv", date(2001, 2, 4), 7)
+    _, _, before = get(api, "/totals/location?date=2001-02-03")
+
+    assert compact_history(str(tmp_path), 7) == 2
+    assert get_reports_for_date(str(tmp_path), PREFIX, date(2001, 2, 3)) == []
+
+    status, _, after = get(api, "/totals/location?date=2001-02-03")
+    assert status == 200
+    assert json.loads(after)["rows"] == json.loads(before)["rows"] == [{"Location": "X10", "Total_RechargeAmount": 6}]
+    assert get(api, "/totals/location?date=2001-02-05")[0] == 404
@@ -0,0 +1,34 @@
+import logging
+
+import pytest
+
+from conftest import REPORT_DATE, write_config
+from recharge_benchmarks import BENCHMARKS, run_benchmarks
+
+def run_without_errors(config, caplog):
+    """
+    This function runs the benchmarks and fails on a benchmark that raised: run_benchmarks() logs it and skips it.
+    """
+
+    with caplog.at_level(logging.ERROR, logger="script_handler"):
+        results = run_benchmarks(config, REPORT_DATE, repeat=1)
+
+    failed = [record.getMessage() for record in caplog.records if record.levelno >= logging.ERROR]
+    assert failed == []
+
+    return [result["name"] for result in results]
+
+def test_local_benchmarks_run(golden_input, tmp_path, caplog):
+    config = write_config(tmp_path, golden_input)
+
+    names = run_without_errors(config, caplog)
+
+    assert names == [name for name, _ in BENCHMARKS if not name.startswith("server_")]
+
+@pytest.mark.postgres
+def test_server_benchmarks_run(golden_input, stats_database, tmp_path, caplog):
+    config = write_config(tmp_path, golden_input, "YES", stats_database)
+
+    names = run_without_errors(config, caplog)
+
+    assert names == [name for name, _ in BENCHMARKS]
@@ -0,0 +1,37 @@
+import json
+import os
+import shutil
+
+import pytest
+
+from conftest import REPORT_DATE, run_engine, write_config
+from reconciliation import RECONCILIATION_DIRNAME
+
+@pytest.mark.parametrize("engine", ["serial", "compact"])
+def test_reports_match_the_control_totals(engine, golden_input, tmp_path):
+    config = write_config(tmp_path, golden_input, extra='["reconciliation"]\nenabled = "YES"\n')
+
+    run_engine(config, engine)
+
+    report_path = os.path.join(config["directories"]["csv_path"], RECONCILIATION_DIRNAME, f"{REPORT_DATE.date().isoformat()}.json")
+    with open(report_path, "r") as file:
+        reconciliation = json.load(file)
+    assert reconciliation["status"] == "PASS", reconciliation["checks"]
+    assert len(reconciliation["checks"]) == 3
+    assert reconciliation["expected"]["rows"] == 9 * 2000
+
+def test_same_named_files_are_counted_apart(golden_input, tmp_path):
+    file = sorted((golden_input / "subdir_1").glob("*.csv"))[0]
+    input_path = tmp_path / "input"
+    for subdir in ["subdir_a", "subdir_b"]:
+        (input_path / subdir).mkdir(parents=True)
+        shutil.copy(file, input_path / subdir / file.name)
+    config = write_config(tmp_path / "run", input_path, extra='["reconciliation"]\nenabled = "YES"\n')
+
+    run_engine(config, "serial")
+
+    report_path = os.path.join(config["directories"]["csv_path"], RECONCILIATION_DIRNAME, f"{REPORT_DATE.date().isoformat()}.json")
+    with open(report_path, "r") as file_handle:
+        reconciliation = json.load(file_handle)
+    assert sorted(reconciliation["files"]) == [os.path.join(subdir, file.name) for subdir in ["subdir_a", "subdir_b"]]
+    assert reconciliation["status"] == "PASS", reconciliation["checks"]
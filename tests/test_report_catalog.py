@@ -0,0 +1,78 @@
+import sqlite3
+from datetime import date, datetime, timedelta
+
+import recharge_file_reader as reader
+import report_catalog
+from report_catalog import apply_retention, compact_catalog, get_latest_entry, get_reports_for_date, record_report
+
+PREFIX = "total_recharge_per_location"
+
+def write_report(csv_path, name, report_date):
+    file_path = csv_path / name
+    file_path.write_text("Location,Total_RechargeAmount\nX10,1\n")
+    record_report(str(csv_path), PREFIX, str(file_path), "csv", 1, report_date)
+    return file_path
+
+def test_latest_entry_is_the_last_recorded_report(tmp_path):
+    write_report(tmp_path, "first.csv", date(2025, 1, 1))
+    second = write_report(tmp_path, "second.csv", date(2024, 12, 31))
+
+    assert get_latest_entry(str(tmp_path), PREFIX)["path"] == str(second)
+    assert [entry["path"] for entry in get_reports_for_date(str(tmp_path), PREFIX, date(2025, 1, 1))] == [str(tmp_path / "first.csv")]
+
+def test_lookups_do_not_write_to_the_catalog(tmp_path, monkeypatch):
+    write_report(tmp_path, "first.csv", date(2025, 1, 1))
+    statements = []
+    connect = sqlite3.connect
+
+    def traced_connect(*args, **kwargs):
+        connection = connect(*args, **kwargs)
+        connection.set_trace_callback(statements.append)
+        return connection
+
+    monkeypatch.setattr(report_catalog.sqlite3, "connect", traced_connect)
+    get_latest_entry(str(tmp_path), PREFIX)
+    get_reports_for_date(str(tmp_path), PREFIX, date(2025, 1, 1))
+
+    assert statements
+    assert not [statement for statement in statements if not statement.lstrip().upper().startswith(("SELECT", "PRAGMA USER_VERSION;"))]
+
+def test_latest_report_comes_with_its_id(tmp_path):
+    assert reader.get_latest_report(str(tmp_path), PREFIX) == (None, None)
+
+    latest = write_report(tmp_path, "latest.csv", date(2025, 1, 1))
+
+    assert reader.get_latest_report(str(tmp_path), PREFIX) == (str(latest), get_latest_entry(str(tmp_path), PREFIX)["id"])
+    assert reader.get_latest_report(str(tmp_path), "count_per_payment_method") == (None, None)
+
+def test_retention_keeps_recent_and_latest_reports(tmp_path):
+    today = datetime.now().date()
+    old = write_report(tmp_path, "old.csv", today - timedelta(days=10))
+    recent = write_report(tmp_path, "recent.csv", today)
+    latest = write_report(tmp_path, "latest_but_old.csv", today - timedelta(days=20))
+
+    assert apply_retention(str(tmp_path), 5) == 1
+
+    assert not old.exists()
+    assert recent.exists() and latest.exists()
+    assert get_reports_for_date(str(tmp_path), PREFIX, today - timedelta(days=10)) == []
+    assert get_latest_entry(str(tmp_path), PREFIX)["path"] == str(latest)
+
+def test_retention_compacts_the_catalog(tmp_path):
+    today = datetime.now().date()
+    deleted = write_report(tmp_path, "deleted_by_hand.csv", today)
+    write_report(tmp_path, "kept.csv", today)
+    deleted.unlink()
+
+    apply_retention(str(tmp_path), 5)
+
+    assert [entry["path"] for entry in get_reports_for_date(str(tmp_path), PREFIX, today)] == [str(tmp_path / "kept.csv")]
+    assert compact_catalog(str(tmp_path)) == 0
+
+def test_retention_disabled_keeps_everything(tmp_path):
+    old = write_report(tmp_path, "old.csv", date(2000, 1, 1))
+    write_report(tmp_path, "new.csv", date(2000, 1, 2))
+
+    assert apply_retention(str(tmp_path), 0) == 0
+    assert old.exists()
+    assert (tmp_path / report_catalog.CATALOG_FILENAME).exists()
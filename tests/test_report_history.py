@@ -0,0 +1,92 @@
+from datetime import date, datetime
+from pathlib import Path
+
+import report_history
+from report_catalog import get_compacted_periods, get_reports_for_date, record_report
+from report_history import compact_history, history_day_path, period_file_path, read_history
+
+PREFIX = "total_recharge_per_location"
+
+def write_report(csv_path, report_date, total):
+    day_path = Path(history_day_path(str(csv_path), PREFIX, report_date))
+    day_path.mkdir(parents=True, exist_ok=True)
+    file_path = day_path / f"{PREFIX}_{total}.csv"
+    file_path.write_text(f"Location,Total_RechargeAmount\nX10,{total}\n")
+    record_report(str(csv_path), PREFIX, str(file_path), "csv", 1, report_date)
+    return file_path
+
+def totals(dataframe):
+    return list(zip(dataframe["report_date"], dataframe["Total_RechargeAmount"]))
+
+def test_old_days_are_merged_into_the_period_file(tmp_path):
+    first_run = write_report(tmp_path, date(2001, 2, 3), 1)
+    last_run = write_report(tmp_path, date(2001, 2, 3), 2)
+    other_day = write_report(tmp_path, date(2001, 2, 4), 3)
+    latest = write_report(tmp_path, date(2001, 2, 5), 4)
+
+    assert compact_history(str(tmp_path), 7) == 3
+
+    assert not first_run.exists() and not last_run.exists() and not other_day.exists()
+    assert latest.exists()
+    assert Path(period_file_path(str(tmp_path), PREFIX, "2001-02", "parquet")).exists()
+    assert get_reports_for_date(str(tmp_path), PREFIX, date(2001, 2, 3)) == []
+
+    history = read_history(str(tmp_path), PREFIX, date(2001, 2, 1), date(2001, 2, 28))
+    assert totals(history) == [("2001-02-03", 2), ("2001-02-04", 3), ("2001-02-05", 4)]
+    all_runs = read_history(str(tmp_path), PREFIX, date(2001, 2, 3), date(2001, 2, 3), all_runs=True)
+    assert totals(all_runs) == [("2001-02-03", 1), ("2001-02-03", 2)]
+
+def test_read_history_spans_compacted_and_recent_days(tmp_path):
+    today = datetime.now().date()
+    write_report(tmp_path, date(2001, 2, 3), 1)
+    write_report(tmp_path, today, 2)
+
+    compact_history(str(tmp_path), 7)
+
+    history = read_history(str(tmp_path), PREFIX, date(2001, 2, 3), today)
+    assert totals(history) == [("2001-02-03", 1), (today.isoformat(), 2)]
+
+def test_replaced_reruns_of_recent_days_are_merged(tmp_path):
+    today = datetime.now().date()
+    first_run = write_report(tmp_path, today, 1)
+    last_run = write_report(tmp_path, today, 2)
+
+    assert compact_history(str(tmp_path), 7) == 1
+
+    assert not first_run.exists() and last_run.exists()
+    assert [entry["path"] for entry in get_reports_for_date(str(tmp_path), PREFIX, today)] == [str(last_run)]
+    assert totals(read_history(str(tmp_path), PREFIX, today, today)) == [(today.isoformat(), 2)]
+    assert totals(read_history(str(tmp_path), PREFIX, today, today, all_runs=True)) == [(today.isoformat(), 1), (today.isoformat(), 2)]
+
+def test_recompaction_merges_a_late_backfill(tmp_path):
+    write_report(tmp_path, date(2001, 2, 3), 1)
+    write_report(tmp_path, date(2001, 2, 10), 2)
+    compact_history(str(tmp_path), 7)
+
+    backfill = write_report(tmp_path, date(2001, 2, 4), 3)
+    write_report(tmp_path, date(2001, 2, 11), 4)
+
+    assert compact_history(str(tmp_path), 7) == 2
+    assert compact_history(str(tmp_path), 7) == 0
+
+    assert not backfill.exists()
+    periods = get_compacted_periods(str(tmp_path), PREFIX, date(2001, 2, 1), date(2001, 2, 28))
+    assert [(period["first_date"], period["last_date"], period["row_count"]) for period in periods] == [("2001-02-03", "2001-02-10", 3)]
+    history = read_history(str(tmp_path), PREFIX, date(2001, 2, 1), date(2001, 2, 28))
+    assert totals(history) == [("2001-02-03", 1), ("2001-02-04", 3), ("2001-02-10", 2), ("2001-02-11", 4)]
+
+def test_interrupted_compaction_deletes_the_merged_files_on_the_next_run(tmp_path, monkeypatch):
+    merged = write_report(tmp_path, date(2001, 2, 3), 1)
+    write_report(tmp_path, date(2001, 2, 4), 2)
+
+    # Interrupted between the catalog transaction and the deletion of the merged files
+    monkeypatch.setattr(report_history, "delete_pending_files", lambda csv_path: 0)
+    compact_history(str(tmp_path), 7)
+    assert merged.exists()
+    monkeypatch.undo()
+
+    compact_history(str(tmp_path), 7)
+
+    assert not merged.exists()
+    assert not merged.parent.exists()
+    assert totals(read_history(str(tmp_path), PREFIX, date(2001, 2, 3), date(2001, 2, 3))) == [("2001-02-03", 1)]
@@ -0,0 +1,37 @@
+import json
+import os
+from datetime import date
+
+import pandas as pd
+import pytest
+
+import recharge_file_reader as reader
+from report_catalog import get_latest_entry
+from report_sinks import LATEST_MANIFEST, REPORT_SINKS, latest_report_path, read_report
+
+PREFIX = "total_recharge_per_location"
+REPORT = pd.DataFrame({"Location": ["X10", "X11"], "Total_RechargeAmount": [10, 20]})
+
+@pytest.mark.parametrize("output_format", list(REPORT_SINKS))
+def test_every_sink_reads_back_the_report(output_format, tmp_path):
+    file_path = reader.save_to_csv(PREFIX, str(tmp_path), REPORT, output_format, report_date=date(2025, 1, 24))
+
+    assert not os.path.exists(f"{file_path}.tmp")
+    pd.testing.assert_frame_equal(read_report(file_path), REPORT)
+
+def test_manifest_and_symlink_follow_the_catalog(tmp_path):
+    reader.save_to_csv(PREFIX, str(tmp_path), REPORT, "csv", report_date=date(2025, 1, 24))
+    second = reader.save_to_csv(PREFIX, str(tmp_path), REPORT.head(1), "parquet", report_date=date(2025, 1, 23))
+
+    entry = get_latest_entry(str(tmp_path), PREFIX)
+    assert entry["path"] == second
+    assert latest_report_path(str(tmp_path), PREFIX) == second
+
+    with open(tmp_path / LATEST_MANIFEST) as file:
+        manifest = json.load(file)
+    assert os.path.join(tmp_path, manifest[PREFIX]["file"]) == second
+    assert manifest[PREFIX]["format"] == "parquet"
+    assert manifest[PREFIX]["report_date"] == "2025-01-23"
+
+    link_path = tmp_path / f"{PREFIX}_latest.parquet"
+    assert os.path.realpath(link_path) == os.path.realpath(second)
@@ -0,0 +1,70 @@
+import json
+import os
+
+import pandas as pd
+
+from conftest import REPORT_DATE, UNREACHABLE_DATABASE, write_config
+from rolling_totals import OUTPUT_FILENAME, RollingTotals, ingest_new_files, load_rolling_totals, run_rolling
+
+def events(rows):
+    """
+    Events of 2001-02-03 from (HHMM, Location, PaymentMethod, RechargeAmount) tuples.
+    """
+
+    return pd.DataFrame({
+        "EventDateAndTime": [int(f"03022001{time}") for time, _, _, _ in rows],
+        "Location": [location for _, location, _, _ in rows],
+        "PaymentMethod": [payment_method for _, _, payment_method, _ in rows],
+        "RechargeAmount": [amount for _, _, _, amount in rows],
+    })
+
+def test_windows_sum_the_last_buckets(tmp_path):
+    rolling = RollingTotals(1, [5, 60])
+
+    late = rolling.add(events([("1000", "X10", 1, 100), ("1056", "X10", 1, 10), ("1059", "X11", 2, 1)]))
+
+    assert late == 0
+    assert rolling.window("location", 5) == {"X10": {"count": 1, "amount": 10}, "X11": {"count": 1, "amount": 1}}
+    assert rolling.window("location", 60)["X10"] == {"count": 2, "amount": 110}
+    assert rolling.window("payment_method", 60) == {1: {"count": 2, "amount": 110}, 2: {"count": 1, "amount": 1}}
+
+def test_advancing_clears_the_buckets_out_of_the_ring(tmp_path):
+    rolling = RollingTotals(1, [5, 60])
+    rolling.add(events([("1000", "X10", 1, 100)]))
+
+    late = rolling.add(events([("1101", "X10", 1, 5), ("0959", "X10", 1, 7)]))
+
+    assert late == 1
+    assert rolling.window("location", 60) == {"X10": {"count": 1, "amount": 5}}
+
+def test_state_round_trip_gives_the_same_windows(tmp_path):
+    rolling = RollingTotals(1, [5, 60])
+    rolling.add(events([("1000", "X10", 1, 100), ("1030", "X12", 3, 50)]))
+
+    restored = RollingTotals.from_json(rolling.to_json(), [5, 60])
+
+    assert restored.windows() == rolling.windows()
+    assert restored.window_end() == rolling.window_end()
+
+def test_files_are_ingested_once(golden_input, tmp_path):
+    config = write_config(tmp_path, golden_input)
+
+    rolling = load_rolling_totals(config)
+    assert ingest_new_files(config, rolling, REPORT_DATE) == 9
+    windows = rolling.windows()
+
+    # The next poll restarts from the saved state and finds no new file
+    rolling = load_rolling_totals(config)
+    assert ingest_new_files(config, rolling, REPORT_DATE) == 0
+    assert rolling.windows() == windows
+    assert sum(totals["count"] for totals in windows["60min"]["location"].values()) > 0
+
+def test_windows_are_flushed_to_the_files_when_the_database_is_unreachable(golden_input, tmp_path):
+    config = write_config(tmp_path, golden_input, "YES", UNREACHABLE_DATABASE)
+
+    run_rolling(config, REPORT_DATE)
+
+    with open(os.path.join(config["directories"]["csv_path"], OUTPUT_FILENAME), "r") as file:
+        output = json.load(file)
+    assert output["window_end"] is not None
+    assert output["windows"]["60min"]["location"]
@@ -0,0 +1,18 @@
+import pstats
+from concurrent.futures import ThreadPoolExecutor
+
+import run_profiler
+
+def busy_in_thread(number):
+    return sum(value * value for value in range(number))
+
+def test_worker_threads_are_in_the_stage_profile(tmp_path):
+    run_profiler.start_profiling(str(tmp_path))
+    with run_profiler.profile_stage("read"):
+        with ThreadPoolExecutor(2) as executor:
+            list(executor.map(busy_in_thread, [10000] * 4))
+    profile_path = run_profiler.stop_profiling()
+
+    stats = pstats.Stats(f"{profile_path}/read.pstats").stats
+    calls = [entry[1] for (_, _, function), entry in stats.items() if function == "busy_in_thread"]
+    assert calls == [4]
@@ -0,0 +1,37 @@
+import filecmp
+import os
+
+import recharge_file_reader as reader
+from conftest import REPORT_DATE, generate_dataset
+
+def list_files(base_path):
+    return sorted(os.path.relpath(os.path.join(root, name), base_path)
+                  for root, _, names in os.walk(base_path) for name in names)
+
+def test_same_seed_generates_the_same_files(tmp_path):
+    first = generate_dataset(tmp_path / "first", 2, 200)
+    second = generate_dataset(tmp_path / "second", 2, 200)
+
+    files = list_files(first)
+    assert files == list_files(second)
+    assert len(files) == 6
+    assert all(filecmp.cmp(first / file, second / file, shallow=False) for file in files)
+
+def test_other_seed_generates_other_events(tmp_path):
+    first = generate_dataset(tmp_path / "first", 1, 200, seed=1)
+    second = generate_dataset(tmp_path / "second", 1, 200, seed=2)
+
+    file = list_files(first)[0]
+    assert (first / file).read_bytes() != (second / file).read_bytes()
+
+def test_files_and_events_are_on_the_given_date(tmp_path):
+    base_path = generate_dataset(tmp_path / "input", 2, 100)
+
+    files = reader.get_csv_files_to_read(str(base_path), REPORT_DATE)
+    assert len(files) == 6
+    assert len({os.path.basename(file) for file in files}) == 6
+
+    for file in files:
+        data = reader.read_csv(file)
+        assert len(data) == 100
+        assert data["EventDateAndTime"].astype(str).str.zfill(12).str[:8].eq(f"{REPORT_DATE:%d%m%Y}").all()
@@ -0,0 +1,115 @@
+"""
+
+Interrupted runs of the streaming engine, resumed from their checkpoint.
+
+"""
+
+import json
+import os
+import shutil
+
+import pytest
+
+import recharge_file_reader as reader
+import streaming_reader
+from conftest import latest_reports, run_engine, write_config
+from test_engine_golden import assert_golden_reports
+
+STREAMING = '["streaming"]\ncheckpoint_interval_seconds = 0\n'
+
+class Interrupted(Exception):
+    pass
+
+def fail_after(function, calls):
+    """
+    This function wraps a function so that it raises Interrupted after a number of calls.
+    """
+
+    count = {"calls": 0}
+
+    def wrapper(*args, **kwargs):
+        count["calls"] += 1
+        if count["calls"] > calls:
+            raise Interrupted()
+        return function(*args, **kwargs)
+
+    wrapper.count = count
+    return wrapper
+
+def load_checkpoint_file(config):
+    with open(streaming_reader.import_checkpoint_path(config)) as file:
+        return json.load(file)
+
+def test_interrupted_ingest_resumes_where_it_stopped(golden_input, tmp_path, monkeypatch):
+    config = write_config(tmp_path, golden_input, extra=STREAMING)
+
+    monkeypatch.setattr(reader, "partial_totals", fail_after(reader.partial_totals, 4))
+    with pytest.raises(Interrupted):
+        run_engine(config, "streaming")
+    assert load_checkpoint_file(config)["rows"] == 4 * 2000
+    monkeypatch.undo()
+
+    counter = fail_after(reader.partial_totals, 100)
+    monkeypatch.setattr(reader, "partial_totals", counter)
+    run_engine(config, "streaming")
+
+    assert counter.count["calls"] == 5
+    assert_golden_reports(latest_reports(config))
+    assert not os.path.exists(streaming_reader.import_checkpoint_path(config))
+
+def test_files_added_after_the_ingest_are_read_on_resume(golden_input, tmp_path, monkeypatch):
+    input_path = tmp_path / "input"
+    shutil.copytree(golden_input, input_path)
+    late_file = next((input_path / "subdir_3").iterdir())
+    late_file.rename(tmp_path / late_file.name)
+    config = write_config(tmp_path / "run", input_path, extra=STREAMING)
+
+    # Interrupted after the ingest, before the reports are written
+    monkeypatch.setattr(reader, "save_to_csv", fail_after(reader.save_to_csv, 0))
+    with pytest.raises(Interrupted):
+        run_engine(config, "streaming")
+    assert load_checkpoint_file(config)["stages_done"] == ["ingest"]
+    monkeypatch.undo()
+
+    (tmp_path / late_file.name).rename(late_file)
+    run_engine(config, "streaming")
+
+    assert_golden_reports(latest_reports(config))
+
+class FakeConnection:
+    def cursor(self):
+        return self
+
+    def commit(self):
+        pass
+
+    def close(self):
+        pass
+
+def test_failed_database_load_is_not_marked_as_done(golden_input, tmp_path, monkeypatch):
+    config = write_config(tmp_path, golden_input, send_to_database="YES", extra=STREAMING)
+    calls = []
+    failing = {"category"}
+
+    def loader(name):
+        def load(cursor, csv_path, connection):
+            calls.append(name)
+            return name not in failing
+        return (name, load)
+
+    monkeypatch.setattr(reader, "connect_to_db", lambda config: FakeConnection())
+    monkeypatch.setattr(reader, "create_recharge_file_stats_db", lambda db_name, cursor, connection: None)
+    monkeypatch.setattr(reader, "connect_to_new_db", lambda db_name, config: FakeConnection())
+    monkeypatch.setattr(reader, "DB_LOADERS", [loader("location"), loader("category"), loader("payment_method")])
+
+    run_engine(config, "streaming")
+
+    assert calls == ["location", "category", "payment_method"]
+    assert load_checkpoint_file(config)["stages_done"] == ["ingest", "reports", "database_location", "database_payment_method"]
+
+    calls.clear()
+    failing.clear()
+    run_engine(config, "streaming")
+
+    assert calls == ["category"]
+    assert not os.path.exists(streaming_reader.import_checkpoint_path(config))